@@ -0,0 +1,92 @@
+"""Computes the reports of the analytics endpoint in the database.
+
+Each report is a single aggregate query: the rows are grouped and summed by the database, so
+only the totals are transferred, whatever the number of contracts and events. The reports are:
+    - salesmen: per sales contact, the contracts, the revenue, i.e. the amount of the signed
+      contracts, and the payments still due on them;
+    - pipeline: the number and amount of the signed and unsigned contracts;
+    - support: per support contact, the events, upcoming or past, and their attendees;
+    - monthly: per month, the contracts created and the events held, over the last `months`
+      months, the current one included, and the months ahead holding upcoming events."""
+
+
+from datetime import datetime
+
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from epic_events.crm.models import Contract, Event
+
+SIGNED = Q(signed=True)
+
+
+def get_salesmen_report():
+    rows = (Contract.objects.values("sales_contact__username")
+            .annotate(contracts=Count("id"),
+                      signed_contracts=Count("id", filter=SIGNED),
+                      revenue=Coalesce(Sum("amount", filter=SIGNED), 0.0),
+                      outstanding=Coalesce(Sum("payment_due", filter=SIGNED), 0.0))
+            .order_by("sales_contact__username"))
+    return [{"sales_contact": row.pop("sales_contact__username"), **row} for row in rows]
+
+
+def get_pipeline_report():
+    return Contract.objects.aggregate(
+        signed_contracts=Count("id", filter=SIGNED),
+        signed_amount=Coalesce(Sum("amount", filter=SIGNED), 0.0),
+        unsigned_contracts=Count("id", filter=~SIGNED),
+        unsigned_amount=Coalesce(Sum("amount", filter=~SIGNED), 0.0),
+        outstanding=Coalesce(Sum("payment_due", filter=SIGNED), 0.0),
+    )
+
+
+def get_support_report(now):
+    upcoming = Q(event_date__gte=now)
+    rows = (Event.objects.values("support_contact__username")
+            .annotate(events=Count("id"),
+                      upcoming_events=Count("id", filter=upcoming),
+                      past_events=Count("id", filter=~upcoming),
+                      total_attendees=Coalesce(Sum("attendees"), 0),
+                      upcoming_attendees=Coalesce(Sum("attendees", filter=upcoming), 0))
+            .order_by("support_contact__username"))
+    return [{"support_contact": row.pop("support_contact__username"), **row} for row in rows]
+
+
+def get_start_month(now, months):
+    """Returns the first instant of the month `months - 1` months before the one of now, in
+    the current time zone."""
+    now = timezone.localtime(now)
+    index = now.year * 12 + now.month - 1 - (months - 1)
+    return timezone.make_aware(datetime(index // 12, index % 12 + 1, 1))
+
+
+def get_monthly_report(now, months):
+    start = get_start_month(now, months)
+    contracts = (Contract.objects.filter(date_created__gte=start)
+                 .annotate(month=TruncMonth("date_created")).values("month")
+                 .annotate(contracts=Count("id"),
+                           signed_contracts=Count("id", filter=SIGNED),
+                           signed_amount=Coalesce(Sum("amount", filter=SIGNED), 0.0))
+                 .order_by("month"))
+    events = (Event.objects.filter(event_date__gte=start)
+              .annotate(month=TruncMonth("event_date")).values("month")
+              .annotate(events=Count("id"), total_attendees=Coalesce(Sum("attendees"), 0))
+              .order_by("month"))
+    empty = {"contracts": 0, "signed_contracts": 0, "signed_amount": 0.0, "events": 0,
+             "total_attendees": 0}
+    series = {}
+    for row in [*contracts, *events]:
+        month = row.pop("month").strftime("%Y-%m")
+        series.setdefault(month, dict(empty)).update(row)
+    return [{"month": month, **totals} for month, totals in sorted(series.items())]
+
+
+def get_reports(months):
+    now = timezone.now()
+    return {
+        "salesmen": get_salesmen_report(),
+        "pipeline": get_pipeline_report(),
+        "support": get_support_report(now),
+        "monthly": get_monthly_report(now, months),
+    }
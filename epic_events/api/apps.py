@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CrmApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'epic_events.api'
+
+    def ready(self):
+        # connects the receivers invalidating the cached responses.
+        from . import cache  # noqa: F401
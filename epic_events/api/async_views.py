@@ -0,0 +1,192 @@
+"""Asynchronous versions of the read endpoints of views.py, served under api/async/.
+
+Under ASGI, an async view doesn't hold a worker thread while it waits: the validator and the
+page are fetched with the async interface of the ORM, aaggregate and async iteration, and the
+cache is read with aget, so the event loop serves the other requests in the meantime. One
+process can thus serve many slow clients at once. Under WSGI, the views still work, each
+request running in its own event loop.
+
+The views return the same data as the sync ones: same filters, sparse fields, keyset
+pagination, conditional GET and list cache. Only JSON is rendered, the browsable API being
+built by sync renderers. ?stream=jsonl and ?stream=csv stream the rows as they're fetched
+with async iteration, StreamingHttpResponse consuming asynchronous iterators.
+
+The async ORM methods run the queries through sync_to_async. The ASGI handler gives each
+request its own thread for them, so slow queries don't queue behind each other, but they
+still use one database connection per running request."""
+
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from epic_events.crm.models import Client, ClientRollup, Contract, CustomUser, Event
+from epic_events.crm.permissions import VIEW, scoped_queryset
+from .serializers import CustomUserSerializer, ClientReadSerializer
+from .serializers import ContractReadSerializer, EventReadSerializer
+from .filters import filter_queryset, get_requested_fields
+from .filters import ClientFilterSerializer, ContractFilterSerializer, EventFilterSerializer
+from .streaming import get_stream_format, astream_response
+from .conditional import aget_validator, get_etag, get_not_modified_response
+from .cache import CachedListMixin
+from .pagination import KeysetPagination
+from .representations import ValuesRepresentation
+
+# the headers set by the DRF exception handler.
+EXCEPTION_HEADERS = ("WWW-Authenticate", "Retry-After")
+
+
+def authenticate(request):
+    """Returns the user authenticated by the authenticators of the DRF request. Raises
+    NotAuthenticated for anonymous users, as the IsAuthenticated permission does."""
+    user = request.user
+    if not user or not user.is_authenticated:
+        raise NotAuthenticated()
+    return user
+
+
+class AsyncListView(CachedListMixin, View):
+    """Lists the rows of model the user can view, represented by serializer_class.
+
+    Subclasses set the same attributes as the matching sync view: the filters, the ordering
+    of the pagination, the related rows of the ETag and the models of the cache key."""
+    authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+    pagination_class = KeysetPagination
+    query_budget = 6
+    read_from_replica = True
+    model = None
+    serializer_class = None
+    filter_serializer_class = None
+    filename = None
+    ordering = ("date_created", "id")
+    etag_related = ()
+    conditional_get = True
+
+    async def get(self, request, *args, **kwargs):
+        request = Request(request, authenticators=[authentication()
+                                                   for authentication
+                                                   in self.authentication_classes])
+        try:
+            # the authenticators read the session and the user from the database.
+            user = await sync_to_async(authenticate)(request)
+            return await self.list(request, user)
+        except APIException as exc:
+            return self.handle_exception(request, exc)
+
+    def get_queryset(self, user):
+        return scoped_queryset(user, self.model, VIEW, self.model.objects.all())
+
+    async def list(self, request, user):
+        queryset = self.get_queryset(user)
+        if self.filter_serializer_class is not None:
+            queryset = filter_queryset(request, queryset, self.filter_serializer_class)
+        context = {"fields": get_requested_fields(request, self.serializer_class)}
+        stream_format = get_stream_format(request)
+        if stream_format:
+            return astream_response(queryset.order_by(*self.ordering), self.serializer_class,
+                                    stream_format, self.filename, context)
+
+        etag = None
+        if self.conditional_get:
+            count, last_modified = await aget_validator(queryset, self.etag_related)
+            etag = get_etag(request, "json", user, self.model, count, last_modified)
+            not_modified = get_not_modified_response(request, etag)
+            if not_modified:
+                return not_modified
+
+        async def build_response():
+            return await self.get_page_response(request, queryset, context)
+        response = await self.aget_cached_response(request, self.model, build_response)
+        if response.status_code == 200 and etag:
+            response["ETag"] = etag
+        return response
+
+    async def get_page_response(self, request, queryset, context):
+        """Fetches the requested page as values() rows and represents them as the sync view
+        does."""
+        representation = ValuesRepresentation(self.serializer_class(context=context))
+        paginator = self.pagination_class()
+        queryset = paginator.get_page_queryset(
+            representation.get_queryset(queryset, self.ordering), request, self)
+        rows = paginator.paginate_rows([row async for row in queryset])
+        return self.render({"next": paginator.get_next_link(),
+                            "results": representation.represent(rows)})
+
+    def render(self, data, status_code=status.HTTP_200_OK):
+        return HttpResponse(JSONRenderer().render(data), status=status_code,
+                            content_type=JSONRenderer.media_type)
+
+    def handle_exception(self, request, exc):
+        """Renders the exception as APIView.handle_exception does: authentication failures
+        are answered with a 401 when the first authenticator defines a WWW-Authenticate
+        header, with a 403 otherwise."""
+        if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+            header = None
+            if request.authenticators:
+                header = request.authenticators[0].authenticate_header(request)
+            if header:
+                exc.auth_header = header
+            else:
+                exc.status_code = status.HTTP_403_FORBIDDEN
+        handled = exception_handler(exc, {"request": request, "view": self})
+        response = self.render(handled.data, handled.status_code)
+        for header in EXCEPTION_HEADERS:
+            if handled.has_header(header):
+                response[header] = handled[header]
+        return response
+
+
+class AsyncCustomUserView(AsyncListView):
+    """Async version of CustomUserView. Managers list all the users, the salesmen and the
+    support team members get their own data."""
+    model = CustomUser
+    serializer_class = CustomUserSerializer
+    filename = "users"
+    ordering = ("date_joined", "id")
+    cache_models = (CustomUser,)
+    # users don't have a date_updated field.
+    conditional_get = False
+
+    def get_queryset(self, user):
+        return CustomUser.objects.all()
+
+    async def list(self, request, user):
+        if user.user_type == 1:
+            return await super().list(request, user)
+        return self.render(CustomUserSerializer(user).data)
+
+
+class AsyncClientView(AsyncListView):
+    """Async version of ClientView."""
+    model = Client
+    serializer_class = ClientReadSerializer
+    filter_serializer_class = ClientFilterSerializer
+    filename = "clients"
+    cache_models = (Client, ClientRollup, CustomUser)
+    etag_related = ("rollup",)
+
+
+class AsyncContractView(AsyncListView):
+    """Async version of ContractView."""
+    model = Contract
+    serializer_class = ContractReadSerializer
+    filter_serializer_class = ContractFilterSerializer
+    filename = "contracts"
+    cache_models = (Contract, Client, CustomUser)
+    etag_related = ("client",)
+
+
+class AsyncEventView(AsyncListView):
+    """Async version of EventView."""
+    model = Event
+    serializer_class = EventReadSerializer
+    filter_serializer_class = EventFilterSerializer
+    filename = "events"
+    cache_models = (Event, Contract, CustomUser)
+    etag_related = ("contract",)
@@ -0,0 +1,93 @@
+"""Helpers shared by the views receiving a list of objects instead of a single one.
+
+Related objects are referred to through their natural keys: usernames, "First Last" client
+names and contract titles. Rather than resolving them row by row, the views collect every key
+of a request, resolve each kind of key with a single query and hand the resulting dicts to
+the serializers."""
+
+
+from rest_framework.exceptions import PermissionDenied, ValidationError
+
+from epic_events.crm.models import Client, Contract, CustomUser
+
+
+def get_rows(data):
+    """Ensures the received data is a list of JSON objects."""
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        raise ValidationError("Expected a list of objects.")
+    return data
+
+
+def collect_keys(rows, *fields):
+    """Returns the set of string values found under any of the fields in the rows."""
+    keys = set()
+    for row in rows:
+        for field in fields:
+            value = row.get(field)
+            if isinstance(value, str):
+                keys.add(value)
+    return keys
+
+
+def resolve(row, field, instances):
+    """Returns the instance the value of the field refers to, or None if there's none."""
+    value = row.get(field)
+    if not isinstance(value, str):
+        return None
+    return instances.get(value)
+
+
+def contacts_by_username(rows, model, field_name):
+    """Resolves the usernames found under field_name in the rows into the users the foreign key
+    of model with that name accepts, keyed by username. As with the serializers of single
+    objects, the users excluded by the limit_choices_to of the field, e.g. the support team
+    members for a sales_contact, are left out and thus reported as not existing."""
+    limit_choices_to = model._meta.get_field(field_name).get_limit_choices_to()
+    users = CustomUser.objects.complex_filter(limit_choices_to)
+    return users.in_bulk(collect_keys(rows, field_name), field_name="username")
+
+
+def clients_by_name(names):
+    return Client.objects.in_bulk_by_name(names)
+
+
+def contracts_by_title(titles):
+    return Contract.objects.in_bulk(titles, field_name="title")
+
+
+def check_rows_permission(rows, is_allowed, message, name=None):
+    """Raises a PermissionDenied listing every row for which is_allowed returns False. The
+    rows are listed by their index, or by the value name returns for them if it's given.
+    Nothing is written if a single row is denied."""
+    denied = [str(name(row) if name else index)
+              for index, row in enumerate(rows) if not is_allowed(row)]
+    if denied:
+        raise PermissionDenied(f"{message} Denied items: {', '.join(denied)}.")
+
+
+def get_keys(data):
+    """Returns the natural keys listed under "keys" in the received data."""
+    keys = data.get("keys") if isinstance(data, dict) else None
+    if not keys or not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+        raise ValidationError({"keys": ["Expected a non-empty list of strings."]})
+    return set(keys)
+
+
+def check_found(keys, instances):
+    """Raises a ValidationError if some keys weren't resolved into instances."""
+    missing = sorted(keys - set(instances))
+    if missing:
+        raise ValidationError({"keys": [f"Those objects do not exist: {', '.join(missing)}."]})
+
+
+def get_changes(data, updatable_fields):
+    """Returns the changes listed under "changes" in the received data. Raises a ValidationError
+    if there's none or if a field that cannot be updated in bulk is listed."""
+    changes = data.get("changes")
+    if not changes or not isinstance(changes, dict):
+        raise ValidationError({"changes": ["Expected a non-empty object."]})
+    forbidden = sorted(set(changes) - set(updatable_fields))
+    if forbidden:
+        raise ValidationError({"changes": [f"Those fields cannot be updated in bulk: "
+                                           f"{', '.join(forbidden)}."]})
+    return changes
@@ -0,0 +1,182 @@
+"""Caches the rendered responses of the read endpoints.
+
+Each cached response is stored under a key holding a version number for every model shown in
+the response, e.g. Event, Contract and CustomUser for the events list. Whenever a row of a
+model is saved or deleted, the version of that model is incremented, so the keys built from
+the previous version are never read again and expire on their own. The versions are bumped
+once per transaction, after its commit, no matter how many rows were written.
+
+The cache backend is the one configured in the CACHES setting under API_CACHE_ALIAS. It must
+be shared by all the worker processes, e.g. the file-based backend, for the invalidation to
+reach every process."""
+
+
+import hashlib
+import time
+from collections import Counter
+from threading import Lock, local
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+from epic_events.crm.models import Client, ClientRollup, Contract, CustomUser, Event
+from epic_events.crm.permissions import visibility_scope
+from epic_events.crm.signals import rows_changed
+
+CACHED_MODELS = (CustomUser, Client, ClientRollup, Contract, Event)
+
+_stats = Counter()
+_stats_lock = Lock()
+_pending_invalidation = local()
+
+
+def get_cache():
+    return caches[getattr(settings, "API_CACHE_ALIAS", "default")]
+
+
+def get_stats():
+    """Returns the number of hits and misses of the current process."""
+    with _stats_lock:
+        return {"hits": _stats["hits"], "misses": _stats["misses"]}
+
+
+def _count(outcome):
+    with _stats_lock:
+        _stats[outcome] += 1
+
+
+def _version_key(model):
+    return f"api:version:{model._meta.label_lower}"
+
+
+def get_versions(models):
+    """Returns the current version of each model. A missing version, never set or evicted,
+    is initialized with the current time so that it cannot match an older key."""
+    cache = get_cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns())
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(models):
+    cache = get_cache()
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate(model):
+    """Marks the cached responses showing rows of model as stale once the current transaction
+    is committed, or right away outside a transaction."""
+    pending = getattr(_pending_invalidation, "models", None)
+    if pending is None:
+        pending = _pending_invalidation.models = set()
+    pending.add(model)
+    transaction.on_commit(flush_invalidations)
+
+
+def flush_invalidations():
+    pending = getattr(_pending_invalidation, "models", None)
+    if not pending:
+        return
+    _pending_invalidation.models = None
+    bump_versions(pending)
+
+
+def invalidate_on_save(sender, update_fields=None, **kwargs):
+    # a user logging in only updates last_login, which isn't shown by any endpoint.
+    if update_fields is not None and set(update_fields) == {"last_login"}:
+        return
+    invalidate(sender)
+
+
+@receiver(rows_changed)
+def invalidate_on_change(sender, **kwargs):
+    if sender in CACHED_MODELS:
+        invalidate(sender)
+
+
+# the receivers are connected to the cached models only: a model with a post_delete receiver
+# loses the fast path of QuerySet.delete, which then loads every row to send the signal. The
+# rollup of a client is only deleted along with the client, which invalidates the same
+# responses, so the rollups keep the fast path.
+for model in CACHED_MODELS:
+    post_save.connect(invalidate_on_save, sender=model)
+    if model is not ClientRollup:
+        post_delete.connect(invalidate_on_change, sender=model)
+
+
+class CachedListMixin:
+    """Serves the responses of a read endpoint from the cache when the models listed in
+    cache_models haven't changed since the response was built.
+
+    The key also holds the full path of the request, which holds the filters and the cursor,
+    and the visibility scope of the user, so users who can view the same rows share the
+    cached responses. It tells apart the responses read from the primary database from those
+    read from a replica: a response read from a lagging replica after a write would otherwise
+    be stored under the new versions and served to the user who wrote, whose reads are pinned
+    to the primary, see general_settings/routers.py. Only JSON responses are cached, the
+    browsable API pages embed data specific to the user such as the CSRF token."""
+    cache_models = ()
+
+    def get_cache_timeout(self):
+        return getattr(settings, "API_CACHE_TIMEOUT", 300)
+
+    def get_cache_key(self, request, model):
+        versions = ".".join(str(version) for version in get_versions(self.cache_models))
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        scope = visibility_scope(request.user, model)
+        source = "primary" if router.db_for_read(model) == DEFAULT_DB_ALIAS else "replica"
+        return f"api:{model._meta.label_lower}:{versions}:{scope}:{source}:{path}"
+
+    def get_cached_response(self, request, model, build_response):
+        """Returns the cached response if there's one. Otherwise, returns the response built
+        by build_response and caches it once it's rendered."""
+        if request.accepted_renderer.format != "json":
+            return build_response()
+        cache = get_cache()
+        key = self.get_cache_key(request, model)
+        cached = cache.get(key)
+        if cached is not None:
+            _count("hits")
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        _count("misses")
+        response = build_response()
+
+        def store(rendered):
+            if rendered.status_code == 200:
+                cache.set(key, (rendered.content, rendered["Content-Type"]),
+                          timeout=self.get_cache_timeout())
+
+        response.add_post_render_callback(store)
+        return response
+
+    async def aget_cached_response(self, request, model, build_response):
+        """Asynchronous version of get_cached_response, for the async views, which only render
+        JSON. build_response is a coroutine function returning a rendered response."""
+        cache = get_cache()
+        key = await sync_to_async(self.get_cache_key)(request, model)
+        cached = await cache.aget(key)
+        if cached is not None:
+            _count("hits")
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        _count("misses")
+        response = await build_response()
+        if response.status_code == 200:
+            await cache.aset(key, (response.content, response["Content-Type"]),
+                             timeout=self.get_cache_timeout())
+        return response
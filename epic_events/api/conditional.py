@@ -0,0 +1,92 @@
+"""Answers the conditional GET requests of the read endpoints.
+
+Before serializing anything, a read endpoint computes a validator for the rows it would return:
+their number and the latest date_updated among them and among the related rows shown in
+the response. Both are obtained with a single aggregate query and hashed into the ETag of the
+response. If the client already holds a response built from the same rows, as told by its
+If-None-Match header, a 304 Not Modified response is sent without running the serialization at
+all.
+
+No Last-Modified header is sent: deleting a row doesn't move the latest date_updated, so
+If-Modified-Since alone would have the client keep a list still showing the deleted row. The
+number of rows held by the ETag covers that case."""
+
+
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+
+from epic_events.crm.permissions import visibility_scope
+
+
+def get_validator_aggregates(related=()):
+    aggregates = {"count": Count("pk"), "last_modified": Max("date_updated")}
+    for name in related:
+        aggregates[f"{name}_last_modified"] = Max(f"{name}__date_updated")
+    return aggregates
+
+
+def read_validator(values):
+    count = values.pop("count")
+    dates = [date for date in values.values() if date is not None]
+    return count, max(dates, default=None)
+
+
+def get_validator(queryset, related=()):
+    """Returns the number of rows of the queryset and the latest date_updated among those rows
+    and the rows they point to through the related foreign keys."""
+    return read_validator(queryset.order_by().aggregate(**get_validator_aggregates(related)))
+
+
+async def aget_validator(queryset, related=()):
+    """Asynchronous version of get_validator."""
+    aggregates = get_validator_aggregates(related)
+    return read_validator(await queryset.order_by().aaggregate(**aggregates))
+
+
+def get_etag(request, renderer_format, user, model, count, last_modified):
+    """Returns the ETag of a response."""
+    key = "|".join([
+        request.get_full_path(),
+        renderer_format,
+        visibility_scope(user, model),
+        str(count),
+        last_modified.isoformat() if last_modified else "",
+    ])
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def get_not_modified_response(request, etag):
+    """Returns a 304 response if the ETag matches the If-None-Match header of the request, None
+    otherwise. As required by RFC 9110, the 304 response carries the ETag."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None and response.status_code == 304:
+        response["ETag"] = etag
+    return response
+
+
+class ConditionalGetMixin:
+    """Adds an ETag header to the responses of a read endpoint and answers 304 to the requests
+    whose ETag still matches.
+
+    The ETag is derived from the full path of the request, which holds the filters and the
+    cursor, from the rendered format, from the visibility scope of the user and from the
+    validator of the queryset.
+    etag_related lists the foreign keys whose date_updated is shown in the response, e.g.
+    a contract title in the events list. Usernames aren't tracked this way as users don't
+    have a date_updated field."""
+    etag_related = ()
+
+    def get_not_modified_response(self, request, queryset):
+        """Returns a 304 response if the client's copy is still valid, None otherwise."""
+        count, last_modified = get_validator(queryset, self.etag_related)
+        self.etag = get_etag(request, request.accepted_renderer.format, request.user,
+                             queryset.model, count, last_modified)
+        return get_not_modified_response(request, self.etag)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code == 200 and getattr(self, "etag", None):
+            response["ETag"] = self.etag
+        return response
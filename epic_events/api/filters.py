@@ -0,0 +1,113 @@
+"""Defines the query parameters accepted by the read endpoints to filter the returned rows.
+
+Each set of parameters is declared as a serializer, so that the received values are validated
+and converted to Python data types before being turned into ORM lookups. Related objects are
+referred to by the same natural keys as in the responses: usernames, contract titles and
+"First Last" client names. The lookups are backed by the indexes declared in crm/models.py.
+
+The ?fields= parameter, on the other hand, narrows the columns: the other fields are dropped
+from the serializer, and thus their columns from the values() query fetching the rows."""
+
+
+from rest_framework import serializers
+
+from .search import SEARCH_FIELDS
+
+FIELDS_QUERY_PARAM = "fields"
+
+
+class QueryFilterSerializer(serializers.Serializer):
+    """Maps each declared field to the ORM lookup listed under its name in lookups. Fields that
+    aren't passed in the query string don't filter the queryset."""
+    lookups = {}
+
+    def get_filters(self):
+        return {self.lookups[name]: value for name, value in self.validated_data.items()}
+
+    def filter_queryset(self, queryset):
+        return queryset.filter(**self.get_filters())
+
+
+class ClientFilterSerializer(QueryFilterSerializer):
+    sales_contact = serializers.CharField(required=False)
+
+    lookups = {
+        "sales_contact": "sales_contact__username",
+    }
+
+
+class ContractFilterSerializer(QueryFilterSerializer):
+    signed = serializers.BooleanField(required=False)
+    client = serializers.CharField(required=False)
+    sales_contact = serializers.CharField(required=False)
+
+    lookups = {
+        "signed": "signed",
+        "sales_contact": "sales_contact__username",
+    }
+
+    def validate_client(self, value):
+        parts = value.split(" ")
+        if len(parts) != 2:
+            raise serializers.ValidationError('Expected a "First Last" client name.')
+        return parts
+
+    def get_filters(self):
+        filters = self.validated_data.copy()
+        client = filters.pop("client", None)
+        filters = {self.lookups[name]: value for name, value in filters.items()}
+        if client is not None:
+            filters["client__first_name"], filters["client__last_name"] = client
+        return filters
+
+
+class EventFilterSerializer(QueryFilterSerializer):
+    event_date_after = serializers.DateTimeField(required=False)
+    event_date_before = serializers.DateTimeField(required=False)
+    status = serializers.BooleanField(required=False)
+    support_contact = serializers.CharField(required=False)
+    contract = serializers.CharField(required=False)
+
+    lookups = {
+        "event_date_after": "event_date__gte",
+        "event_date_before": "event_date__lt",
+        "status": "status",
+        "support_contact": "support_contact__username",
+        "contract": "contract__title",
+    }
+
+
+def filter_queryset(request, queryset, filter_serializer_class):
+    """Validates the query parameters with filter_serializer_class and returns the filtered
+    queryset. Invalid parameters result in a 400 response."""
+    # a plain dict is passed as, for a QueryDict, DRF would treat a missing boolean as False.
+    serializer = filter_serializer_class(data=request.query_params.dict())
+    serializer.is_valid(raise_exception=True)
+    return serializer.filter_queryset(queryset)
+
+
+def get_requested_fields(request, serializer_class):
+    """Returns the list of fields passed as ?fields=a,b,c, or None if all the fields are
+    requested. Unknown fields result in a 400 response."""
+    requested = request.query_params.get(FIELDS_QUERY_PARAM)
+    if requested is None:
+        return None
+    fields = [name for name in requested.split(",") if name]
+    unknown = sorted(set(fields) - set(serializer_class.Meta.fields))
+    if not fields or unknown:
+        raise serializers.ValidationError(
+            {FIELDS_QUERY_PARAM: [f"choose among {', '.join(serializer_class.Meta.fields)}"]})
+    return fields
+
+
+class SearchParamsSerializer(serializers.Serializer):
+    """The ?q= parameter of the search endpoint, and ?type= to search a single model."""
+    q = serializers.CharField(max_length=200)
+    type = serializers.ChoiceField(choices=list(SEARCH_FIELDS), required=False)
+
+
+class AnalyticsParamsSerializer(serializers.Serializer):
+    """The ?months= parameter of the analytics endpoint: the number of months of the monthly
+    series, the current one included."""
+    months = serializers.IntegerField(min_value=1, max_value=120, default=12)
+
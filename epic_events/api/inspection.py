@@ -0,0 +1,124 @@
+"""Inspects the SQL queries of each request, to catch N+1 patterns and query budget overruns
+before they reach production. Meant for tests and staging, it's off unless API_QUERY_INSPECTION
+is set:
+    - "log" logs the findings as warnings of the epic_events.queries logger;
+    - "raise" also raises QueryBudgetExceeded when a view exceeds its budget.
+
+Every query run while handling a request is fingerprinted: its SQL with the parameters left
+out and the lists of placeholders collapsed, so that the queries differing only by their
+values share a fingerprint. When a fingerprint comes back API_QUERY_REPEAT_THRESHOLD times in
+one request, the queries are reported as a probable N+1, along with the line of the project
+code that issued them.
+
+A view declares its budget with a query_budget attribute, on the APIView for the API and on
+the ModelAdmin for the admin site. The budget counts every query of the request, including
+those loading the session and the user."""
+
+
+import logging
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from . import metrics
+
+logger = logging.getLogger("epic_events.queries")
+
+PROJECT_DIR = str(Path(__file__).resolve().parent.parent)
+# the modules whose frames stand between a query and the code issuing it.
+WRAPPER_FILES = {__file__, metrics.__file__}
+PLACEHOLDERS = re.compile(r"\((?:%s, )*%s\)")
+ROWS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def get_fingerprint(sql):
+    return ROWS.sub("(...)", PLACEHOLDERS.sub("(...)", sql))
+
+
+def get_caller():
+    """Returns the innermost frame of the project code, outside this module, as a
+    "path:line in function" string."""
+    frame = sys._getframe()
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(PROJECT_DIR) and filename not in WRAPPER_FILES:
+            return (f"{Path(filename).relative_to(Path(PROJECT_DIR).parent)}:{frame.f_lineno} "
+                    f"in {frame.f_code.co_name}")
+        frame = frame.f_back
+    return "unknown"
+
+
+def get_query_budget(view_func):
+    """Returns the query_budget declared by the APIView, ViewSet or ModelAdmin behind the
+    view function, if any."""
+    for attribute in ("view_class", "cls", "model_admin"):
+        owner = getattr(view_func, attribute, None)
+        if owner is not None:
+            return getattr(owner, "query_budget", None)
+    return None
+
+
+class QueryRecorder:
+    """Execute wrapper recording the fingerprint of each query and the caller of its first
+    occurrence."""
+
+    def __init__(self):
+        self.count = 0
+        self.fingerprints = Counter()
+        self.callers = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        fingerprint = get_fingerprint(sql)
+        self.count += 1
+        self.fingerprints[fingerprint] += 1
+        if fingerprint not in self.callers:
+            self.callers[fingerprint] = get_caller()
+        return execute(sql, params, many, context)
+
+
+class QueryInspectionMiddleware:
+    """Reports the repeated queries of each request and enforces the budget of its view."""
+
+    def __init__(self, get_response):
+        self.mode = getattr(settings, "API_QUERY_INSPECTION", None)
+        if not self.mode:
+            raise MiddlewareNotUsed
+        self.threshold = getattr(settings, "API_QUERY_REPEAT_THRESHOLD", 5)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request._query_budget = None
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        if response.streaming:
+            # the queries of a streamed response run after the middleware returns.
+            return response
+
+        route = f"{request.method} {request.path}"
+        for fingerprint, count in recorder.fingerprints.items():
+            if count >= self.threshold:
+                logger.warning("Probable N+1 on %s: %d queries issued from %s: %s", route,
+                               count, recorder.callers[fingerprint], fingerprint)
+        budget = request._query_budget
+        if budget is not None and recorder.count > budget:
+            message = f"{route} made {recorder.count} queries, its budget is {budget}."
+            logger.warning(message)
+            if self.mode == "raise":
+                raise QueryBudgetExceeded(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = get_query_budget(view_func)
@@ -0,0 +1,194 @@
+"""Defines the compare_load command, which sends the same load to the sync read endpoints
+through the WSGI handler and to their async versions through the ASGI handler:
+
+    python manage.py compare_load --requests 400 --concurrency 50 --threads 8
+    python manage.py compare_load --query-latency 20 --path /api/event/view
+
+The WSGI handler is called from a pool of --threads threads, as a threaded WSGI server does,
+and the ASGI handler from a single event loop with --concurrency requests in flight. With
+--query-latency, every SQL query is delayed by that many milliseconds, to stand for a remote
+database: a WSGI worker then waits for each query with a thread, an ASGI worker without one.
+
+As the benchmark command does, the command creates a test database and fills it with
+generated rows. The cache is disabled, so every request reads the database. For each handler,
+the throughput and the latency percentiles are reported."""
+
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client as TestClient
+from django.test.utils import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from epic_events.crm.management.commands.benchmark import seed
+from epic_events.crm.models import CustomUser
+
+DEFAULT_PATHS = ["/api/users/view", "/api/client/view", "/api/contract/view", "/api/event/view"]
+ASYNC_PREFIX = "/api/async/"
+
+
+def get_async_path(path):
+    return ASYNC_PREFIX + path[len("/api/"):]
+
+
+class QueryLatency:
+    """Execute wrapper delaying each query, installed on every connection opened."""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.seconds)
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        # the connections are opened lazily, while the middleware may have pushed its own
+        # wrappers, which are popped off the end of the list.
+        connection.execute_wrappers.insert(0, self)
+
+
+def call_wsgi(handler, path, cookie):
+    path, _, query_string = path.partition("?")
+    environ = {"PATH_INFO": path, "QUERY_STRING": query_string, "HTTP_COOKIE": cookie,
+               "HTTP_ACCEPT": "application/json"}
+    setup_testing_defaults(environ)
+    statuses = []
+    response = handler(environ, lambda status, headers: statuses.append(status))
+    for _chunk in response:
+        pass
+    response.close()
+    return int(statuses[0].split(" ")[0])
+
+
+async def call_asgi(application, path, cookie):
+    path, _, query_string = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query_string.encode(), "client": ("127.0.0.1", 0),
+        "server": ("testserver", 80),
+        "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode()),
+                    (b"accept", b"application/json")],
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]["status"]
+
+
+def percentile(values, rank):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * rank / 100))]
+
+
+class Command(BaseCommand):
+    help = "Compares the sync read endpoints under WSGI with their async versions under ASGI."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=500)
+        parser.add_argument("--contracts", type=int, default=1000)
+        parser.add_argument("--events", type=int, default=1000)
+        parser.add_argument("--requests", type=int, default=200,
+                            help="Number of requests sent to each handler.")
+        parser.add_argument("--concurrency", type=int, default=50,
+                            help="Number of requests in flight on the ASGI handler.")
+        parser.add_argument("--threads", type=int, default=8,
+                            help="Number of threads calling the WSGI handler.")
+        parser.add_argument("--query-latency", type=float, default=0,
+                            help="Delay added to every SQL query, in milliseconds.")
+        parser.add_argument("--path", action="append", dest="paths",
+                            help="Sync endpoint to request, repeatable. Defaults to the four "
+                                 "list endpoints.")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive",
+                            help="Deletes a leftover test database without asking.")
+
+    def handle(self, *args, **options):
+        paths = options["paths"] or DEFAULT_PATHS
+        for path in paths:
+            if not path.startswith("/api/") or path.startswith(ASYNC_PREFIX):
+                raise CommandError(f"{path}: expected a sync endpoint under /api/.")
+        if min(options["requests"], options["concurrency"], options["threads"]) < 1:
+            raise CommandError("--requests, --concurrency and --threads must be positive.")
+        requests = [paths[index % len(paths)] for index in range(options["requests"])]
+
+        old_name = connection.settings_dict["NAME"]
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options["interactive"],
+                                           serialize=False)
+        latency = QueryLatency(options["query_latency"] / 1000)
+        dummy = {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}
+        try:
+            with override_settings(CACHES={alias: dummy for alias in settings.CACHES}):
+                seed(options["clients"], options["contracts"], options["events"], 10, 10)
+                client = TestClient()
+                client.force_login(CustomUser.objects.get(username="manager"))
+                cookie = f"{settings.SESSION_COOKIE_NAME}={client.session.session_key}"
+                if latency.seconds:
+                    latency.install(None, connection)
+                    connection_created.connect(latency.install)
+                results = {
+                    "wsgi": self.run_wsgi(requests, cookie, options["threads"]),
+                    "asgi": self.run_asgi([get_async_path(path) for path in requests], cookie,
+                                          options["concurrency"]),
+                }
+        finally:
+            connection_created.disconnect(latency.install)
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        self.write_results(results)
+
+    def run_wsgi(self, requests, cookie, threads):
+        handler = WSGIHandler()
+
+        def send(path):
+            start = time.perf_counter()
+            status = call_wsgi(handler, path, cookie)
+            return status, time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            outcomes = list(pool.map(send, requests))
+        return outcomes, time.perf_counter() - start
+
+    def run_asgi(self, requests, cookie, concurrency):
+        application = ASGIHandler()
+
+        async def send(path, semaphore):
+            async with semaphore:
+                start = time.perf_counter()
+                status = await call_asgi(application, path, cookie)
+                return status, time.perf_counter() - start
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(send(path, semaphore) for path in requests))
+
+        start = time.perf_counter()
+        outcomes = asyncio.run(run())
+        return outcomes, time.perf_counter() - start
+
+    def write_results(self, results):
+        self.stdout.write(f"{'handler':<10}{'req/s':>10}{'p50 (ms)':>10}{'p95 (ms)':>10}"
+                          f"{'p99 (ms)':>10}{'errors':>8}")
+        for name, (outcomes, elapsed) in results.items():
+            durations = [duration * 1000 for _, duration in outcomes]
+            errors = sum(1 for status, _ in outcomes if status != 200)
+            self.stdout.write(f"{name:<10}{len(outcomes) / elapsed:>10.1f}"
+                              f"{percentile(durations, 50):>10.1f}"
+                              f"{percentile(durations, 95):>10.1f}"
+                              f"{percentile(durations, 99):>10.1f}{errors:>8}")
@@ -0,0 +1,74 @@
+"""Defines the export_crm command, which writes all the clients, contracts and events to
+gzip-compressed files, for backups and BI loads:
+
+    python manage.py export_crm --output-dir /backups/crm --format csv
+    python manage.py export_crm --output-dir /backups/crm --since 2023-01-01T00:00:00Z
+
+One file is written per model, e.g. contracts.csv.gz. The rows hold every column of the table,
+related objects being represented by their natural keys, and the rollups of the clients. The
+files can be loaded back with the import_crm command, which reads the fields accepted by the
+create endpoints and ignores the other ones: the ids, the dates, the status of the clients and
+events and the rollups are set anew, the statuses and rollups being derived from the rows
+imported.
+
+The rows are produced the same way as the streamed responses of the read endpoints, see
+api/streaming.py: the related natural keys are joined in SQL, the rows are read by chunks
+through QuerySet.iterator, which uses a server-side cursor on Postgres, and written as soon as
+they're fetched. The memory used thus doesn't depend on the size of the tables."""
+
+
+import gzip
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from epic_events.crm.models import Client, Contract, Event
+from epic_events.api.serializers import ClientExportSerializer, ContractReadSerializer
+from epic_events.api.serializers import EventReadSerializer
+from epic_events.api.streaming import iter_csv, iter_jsonl, iter_representations
+
+EXPORTS = {
+    "clients": (Client, ClientExportSerializer),
+    "contracts": (Contract, ContractReadSerializer),
+    "events": (Event, EventReadSerializer),
+}
+
+
+class Command(BaseCommand):
+    help = "Exports the clients, contracts and events to gzip-compressed CSV or JSON lines files."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output-dir", default=".")
+        parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+        parser.add_argument("--since", help="Only exports the rows updated since this datetime.")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("--since expects an ISO 8601 datetime.")
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        os.makedirs(options["output_dir"], exist_ok=True)
+
+        for name, (model, serializer_class) in EXPORTS.items():
+            queryset = model.objects.order_by("date_created", "id")
+            if since is not None:
+                queryset = queryset.filter(date_updated__gte=since)
+            serializer = serializer_class()
+            rows = iter_representations(queryset, serializer)
+            if options["format"] == "csv":
+                lines = iter_csv(rows, list(serializer.fields))
+            else:
+                lines = iter_jsonl(rows)
+
+            path = os.path.join(options["output_dir"], f"{name}.{options['format']}.gz")
+            count = -1 if options["format"] == "csv" else 0
+            with gzip.open(path, "wt", encoding="utf-8", newline="") as file:
+                for line in lines:
+                    file.write(line)
+                    count += 1
+            self.stdout.write(f"{count} {name} exported to {path}.")
@@ -0,0 +1,271 @@
+"""Defines the import_crm command, which loads clients, contracts and events from files:
+
+    python manage.py import_crm --clients clients.csv --contracts contracts.jsonl \
+        --events events.csv.gz --workers 4 --checkpoint import.json
+
+The files are CSV, with a header line, or JSON lines, optionally gzip-compressed. Their
+columns are the fields accepted by the create endpoints, related objects being referred to by
+their natural keys: usernames, "First Last" client names and contract titles. Empty CSV cells
+are read as nulls.
+
+The files are read as a stream and handled by chunks of rows, in the order clients, contracts,
+events. For each chunk, the natural keys are resolved with one query per kind of key, the rows
+are validated by the serializers of the bulk endpoints and written in a single transaction,
+with bulk_create or, on Postgres, COPY. With --workers, the chunks of a file are spread over a
+pool of processes.
+
+With --checkpoint, the chunks written are recorded in a file. When the import stops, on
+invalid rows for instance, running the same command again skips them."""
+
+
+import csv
+import gzip
+import io
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
+from multiprocessing import get_context
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, connections, transaction
+
+from epic_events.crm.models import Client, Contract, Event, schedule_client_status_refresh
+from epic_events.crm.rollups import refresh_client_rollups, schedule_rollup_refresh
+from epic_events.crm.signals import rows_changed
+from epic_events.api.bulk import collect_keys, contacts_by_username
+from epic_events.api.bulk import clients_by_name, contracts_by_title
+from epic_events.api.serializers import ClientBulkSerializer, ContractBulkSerializer
+from epic_events.api.serializers import EventBulkSerializer
+
+COPY_NULL = "\\N"
+
+
+def client_context(rows):
+    return {"users": contacts_by_username(rows, Client, "sales_contact")}
+
+
+def contract_context(rows):
+    return {"users": contacts_by_username(rows, Contract, "sales_contact"),
+            "clients": clients_by_name(collect_keys(rows, "client"))}
+
+
+def event_context(rows):
+    return {"users": contacts_by_username(rows, Event, "support_contact"),
+            "contracts": contracts_by_title(collect_keys(rows, "contract"))}
+
+
+# the entity types, in the order they are imported, with the serializer validating their rows
+# and the function resolving the natural keys of a chunk.
+ENTITIES = {
+    "clients": (ClientBulkSerializer, client_context),
+    "contracts": (ContractBulkSerializer, contract_context),
+    "events": (EventBulkSerializer, event_context),
+}
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def iter_rows(path):
+    """Yields the rows of a CSV or JSON lines file as dicts, one at a time."""
+    name = path[:-3] if path.endswith(".gz") else path
+    with open_text(path) as file:
+        if name.endswith(".csv"):
+            for row in csv.DictReader(file):
+                yield {field: value if value != "" else None for field, value in row.items()}
+        elif name.endswith(".jsonl"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            raise CommandError(f"{path}: expected a .csv or .jsonl file, optionally gzipped.")
+
+
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def copy_instances(model, instances):
+    """Inserts the instances with a COPY statement. As with bulk_create, the pre_save method of
+    each field is called, e.g. to fill the auto_now_add dates."""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for instance in instances:
+        values = (field.get_db_prep_save(field.pre_save(instance, True), connection)
+                  for field in fields)
+        writer.writerow([COPY_NULL if value is None else value for value in values])
+    buffer.seek(0)
+    quote_name = connection.ops.quote_name
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f"COPY {quote_name(model._meta.db_table)} ({columns}) FROM STDIN "
+                           f"WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+
+
+def import_chunk(entity, rows, use_copy):
+    """Validates and writes a chunk of rows. Returns the number of rows written, or the errors
+    of the invalid rows keyed by their index in the chunk, in which case nothing is written.
+
+    The rows are checked against those already in the database, not against the chunks being
+    written at the same time by the other workers. A natural key found in two such chunks
+    makes the second insert fail, the error is then returned for the whole chunk, keyed by
+    None."""
+    serializer_class, get_context = ENTITIES[entity]
+    serializer = serializer_class(data=rows, many=True, context=get_context(rows))
+    if not serializer.is_valid():
+        errors = serializer.errors
+        if isinstance(errors, dict):
+            return {0: errors}
+        return {index: error for index, error in enumerate(errors) if error}
+    model = serializer_class.Meta.model
+    instances = [serializer.child.build_instance(attrs) for attrs in serializer.validated_data]
+    try:
+        with transaction.atomic():
+            if use_copy:
+                copy_instances(model, instances)
+            else:
+                model.objects.bulk_create(instances)
+            rows_changed.send(sender=model)
+            if model is Contract:
+                schedule_rollup_refresh(
+                    client_ids={contract.client_id for contract in instances},
+                    salesman_ids={contract.sales_contact_id for contract in instances})
+            if model is Event:
+                schedule_client_status_refresh(
+                    contract_ids={event.contract_id for event in instances})
+                schedule_rollup_refresh(contract_ids={event.contract_id for event in instances})
+    except IntegrityError as error:
+        return {None: str(error)}
+    return len(instances)
+
+
+class Checkpoint:
+    """Records in a JSON file the chunks written for each entity type. The file is replaced
+    atomically, so it's never left half written."""
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as file:
+                self.data = json.load(file)
+
+    def get_done(self, entity, source, chunk_size):
+        state = self.data.setdefault(entity, {"source": source, "chunk_size": chunk_size,
+                                              "done": []})
+        if state["source"] != source or state["chunk_size"] != chunk_size:
+            raise CommandError(f"The checkpoint of the {entity} was recorded for "
+                               f"{state['source']} with chunks of {state['chunk_size']} rows.")
+        return set(state["done"])
+
+    def mark_done(self, entity, index):
+        self.data[entity]["done"].append(index)
+        if self.path:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "w", encoding="utf-8") as file:
+                json.dump(self.data, file)
+            os.replace(temporary_path, self.path)
+
+
+class Command(BaseCommand):
+    help = "Imports clients, contracts and events from CSV or JSON lines files."
+
+    def add_arguments(self, parser):
+        for entity in ENTITIES:
+            parser.add_argument(f"--{entity}", metavar="FILE")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--workers", type=int, default=1,
+                            help="Number of processes writing the chunks of a file.")
+        parser.add_argument("--checkpoint", metavar="FILE",
+                            help="File recording the chunks written, to resume an import.")
+        parser.add_argument("--no-copy", action="store_false", dest="copy",
+                            help="Uses bulk_create even on Postgres.")
+
+    def handle(self, *args, **options):
+        if not any(options[entity] for entity in ENTITIES):
+            raise CommandError(f"Pass at least one of --{', --'.join(ENTITIES)}.")
+        use_copy = options["copy"] and connection.vendor == "postgresql"
+        checkpoint = Checkpoint(options["checkpoint"])
+        for entity in ENTITIES:
+            path = options[entity]
+            if path:
+                done = checkpoint.get_done(entity, os.path.abspath(path), options["chunk_size"])
+                chunks = ((index, chunk)
+                          for index, chunk in enumerate(iter_chunks(iter_rows(path),
+                                                                    options["chunk_size"]))
+                          if index not in done)
+                written = self.import_chunks(entity, chunks, use_copy, options["workers"],
+                                             checkpoint, options["chunk_size"])
+                if entity == "clients":
+                    # COPY doesn't return the ids of the clients, their rollups are created
+                    # at once for the whole file.
+                    refresh_client_rollups(Client.objects.filter(rollup__isnull=True))
+                self.stdout.write(f"{written} {entity} imported from {path}.")
+
+    def import_chunks(self, entity, chunks, use_copy, workers, checkpoint, chunk_size):
+        """Imports the chunks one after the other, or with a pool of workers, holding at most
+        two chunks per worker in memory. Stops at the first chunk holding invalid rows."""
+        written = 0
+        errors = {}
+        if workers <= 1:
+            for index, chunk in chunks:
+                result = import_chunk(entity, chunk, use_copy)
+                if isinstance(result, dict):
+                    errors[index] = result
+                    break
+                written += result
+                checkpoint.mark_done(entity, index)
+        else:
+            # the forked workers must open their own connections.
+            connections.close_all()
+            with ProcessPoolExecutor(workers, mp_context=get_context("fork")) as pool:
+                running = {}
+                for index, chunk in chunks:
+                    if len(running) >= 2 * workers:
+                        written += self.collect(entity, running, errors, checkpoint)
+                    if errors:
+                        break
+                    running[pool.submit(import_chunk, entity, chunk, use_copy)] = index
+                while running:
+                    written += self.collect(entity, running, errors, checkpoint)
+        if errors:
+            raise CommandError(self.format_errors(entity, errors, chunk_size, written))
+        return written
+
+    def collect(self, entity, running, errors, checkpoint):
+        """Waits for at least one chunk to be handled by the pool and records the outcome."""
+        written = 0
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            index = running.pop(future)
+            result = future.result()
+            if isinstance(result, dict):
+                errors[index] = result
+            else:
+                written += result
+                checkpoint.mark_done(entity, index)
+        return written
+
+    def format_errors(self, entity, errors, chunk_size, written):
+        lines = [f"Invalid {entity}, {written} rows were imported before stopping:"]
+        for index, chunk_errors in sorted(errors.items()):
+            for row, error in chunk_errors.items():
+                if row is None:
+                    # running the import again with the same checkpoint validates the chunk
+                    # against the rows written meanwhile, which points out the faulty rows.
+                    lines.append(f"rows {index * chunk_size + 1} to {(index + 1) * chunk_size}: "
+                                 f"{error}. Run the import again with the same --checkpoint to "
+                                 f"find the rows already written by another chunk.")
+                else:
+                    lines.append(f"row {index * chunk_size + row + 1}: {json.dumps(error)}")
+        return "\n".join(lines)
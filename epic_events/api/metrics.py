@@ -0,0 +1,215 @@
+"""Measures each request and exposes the aggregated measures in the Prometheus text format.
+
+MetricsMiddleware records, per route, the latency of the requests, the number and duration of
+their SQL queries, the time spent rendering their responses and the size of the responses.
+The measures of a request are sent back in its Server-Timing header and added to histograms
+kept in memory, which managers can read at /metrics along with the hits and misses of the list
+cache, see cache.py. Each worker process keeps its own histograms and counters, Prometheus sums
+them up when it scrapes every process.
+
+When API_METRICS_ENABLED is False, the middleware removes itself from the middleware chain
+when the server starts, so the requests don't go through it at all."""
+
+
+import time
+from contextlib import ExitStack
+from threading import Lock
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+from rest_framework import permissions
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.views import APIView
+
+from .cache import get_stats
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def metrics_enabled():
+    return getattr(settings, "API_METRICS_ENABLED", False)
+
+
+class Histogram:
+    """A Prometheus histogram, with one series of cumulative buckets per set of labels."""
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0,
+                                            "count": 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["buckets"][index] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self.series.items()):
+            route, method = labels
+            label = f'route="{route}",method="{method}"'
+            for bound, count in zip(self.buckets, series["buckets"]):
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {series["count"]}')
+            lines.append(f"{self.name}_sum{{{label}}} {series['sum']}")
+            lines.append(f"{self.name}_count{{{label}}} {series['count']}")
+        return lines
+
+
+HISTOGRAMS = {
+    "duration": Histogram("epic_events_request_duration_seconds",
+                          "Time spent handling the request.", SECONDS_BUCKETS),
+    "queries": Histogram("epic_events_request_queries",
+                         "Number of SQL queries made by the request.", QUERIES_BUCKETS),
+    "db": Histogram("epic_events_request_db_seconds",
+                    "Time spent running the SQL queries of the request.", SECONDS_BUCKETS),
+    "render": Histogram("epic_events_request_render_seconds",
+                        "Time spent rendering the response.", SECONDS_BUCKETS),
+    "size": Histogram("epic_events_response_size_bytes",
+                      "Size of the response body, streamed responses excluded.", BYTES_BUCKETS),
+}
+
+_lock = Lock()
+
+
+def record(route, method, measures):
+    labels = (route, method)
+    with _lock:
+        for name, value in measures.items():
+            HISTOGRAMS[name].observe(labels, value)
+
+
+def cache_exposition():
+    name = "epic_events_list_cache_requests_total"
+    stats = get_stats()
+    return [f"# HELP {name} Requests of the list endpoints served from the cache or not.",
+            f"# TYPE {name} counter",
+            f'{name}{{result="hit"}} {stats["hits"]}',
+            f'{name}{{result="miss"}} {stats["misses"]}']
+
+
+def exposition():
+    with _lock:
+        lines = []
+        for histogram in HISTOGRAMS.values():
+            lines.extend(histogram.exposition())
+    lines.extend(cache_exposition())
+    return "\n".join(lines) + "\n"
+
+
+class QueryTimer:
+    """Execute wrapper counting the queries run on a connection and their duration."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+class RenderTimer:
+    """Measures the rendering of a template response, i.e. the serialization of the data of a
+    DRF response, between process_template_response and the post-render callbacks."""
+
+    def __init__(self):
+        self.start = None
+        self.duration = 0
+
+    def __call__(self, response):
+        self.duration = time.perf_counter() - self.start
+
+
+class MetricsMiddleware:
+    """Records the measures of every request and adds its Server-Timing header.
+
+    The middleware also runs in async mode, so that the async views aren't pushed back to a
+    thread. The queries of an async request run in other threads, on other connections, so
+    they aren't counted."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not metrics_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # tells the handler that calling the middleware returns a coroutine, as
+            # MiddlewareMixin does.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        query_timer = QueryTimer()
+        request._render_timer = RenderTimer()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_timer))
+            response = self.get_response(request)
+        return self.finish(request, response, start, query_timer)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        request._render_timer = RenderTimer()
+        response = await self.get_response(request)
+        return self.finish(request, response, start)
+
+    def finish(self, request, response, start, query_timer=None):
+        duration = time.perf_counter() - start
+        render = request._render_timer.duration
+        measures = {"duration": duration, "render": render}
+        timings = []
+        if query_timer is not None:
+            measures["queries"] = query_timer.count
+            measures["db"] = query_timer.duration
+            timings.append(f'db;dur={query_timer.duration * 1000:.1f};'
+                           f'desc="{query_timer.count} queries"')
+        if not response.streaming:
+            measures["size"] = len(response.content)
+        match = request.resolver_match
+        record(match.route if match else "unmatched", request.method, measures)
+
+        timings.append(f"render;dur={render * 1000:.1f}")
+        timings.append(f"total;dur={duration * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(timings)
+        return response
+
+    def process_template_response(self, request, response):
+        request._render_timer.start = time.perf_counter()
+        response.add_post_render_callback(request._render_timer)
+        return response
+
+
+class MetricsView(APIView):
+    """Returns the histograms and the cache counters of the current process in the Prometheus
+    text format. Only managers can read them."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        if not metrics_enabled():
+            raise Http404
+        if request.user.user_type != 1:
+            raise PermissionDenied("Only managers can read the metrics.")
+        return HttpResponse(exposition(), content_type=CONTENT_TYPE)
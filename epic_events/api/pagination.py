@@ -0,0 +1,168 @@
+"""Defines the pagination used by the read endpoints.
+
+The rows are walked in the order of a creation timestamp, ties being broken by the id. Each
+page ends with an opaque cursor encoding the position of its last row. The next page is then
+fetched with a WHERE clause on that position instead of an OFFSET, so a deep page costs the
+same as the first one as long as the ordering fields are indexed.
+
+A cursor which can't be decoded, e.g. one that was altered by hand, is refused with a 400
+response, as any other invalid query parameter."""
+
+
+import base64
+import json
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Paginates a queryset on the (timestamp, id) pair given by the view's ordering attribute.
+
+    The page size defaults to PAGE_SIZE in the REST_FRAMEWORK settings. The client can ask for
+    another size through the page_size query parameter, but never for more than
+    API_MAX_PAGE_SIZE rows. Only forward pagination is offered: each response holds the link
+    to the next page, which is null on the last page."""
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    ordering = ("date_created", "id")
+    invalid_cursor_message = "Invalid cursor"
+    # the ids are those of a BigAutoField, a larger one would fail in the database.
+    max_pk = 2 ** 63 - 1
+
+    def get_page_size(self, request):
+        page_size = api_settings.PAGE_SIZE
+        max_page_size = getattr(settings, "API_MAX_PAGE_SIZE", page_size)
+        if self.page_size_query_param in request.query_params:
+            try:
+                page_size = _positive_int(request.query_params[self.page_size_query_param],
+                                          strict=True)
+            except (KeyError, ValueError):
+                pass
+        return min(page_size, max_page_size)
+
+    def get_ordering(self, view):
+        return getattr(view, "ordering", self.ordering)
+
+    def decode_cursor(self, request):
+        """Returns the (timestamp, id) position encoded in the cursor query parameter, or None
+        if the first page is requested."""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            timestamp, pk = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (TypeError, ValueError, OverflowError):
+            raise self.invalid_cursor()
+        if timestamp is None or not 0 < pk <= self.max_pk:
+            raise self.invalid_cursor()
+        return timestamp, pk
+
+    def invalid_cursor(self):
+        return ValidationError({self.cursor_query_param: [self.invalid_cursor_message]})
+
+    def encode_cursor(self, position):
+        timestamp, pk = position
+        data = json.dumps([timestamp.isoformat(), pk]).encode("ascii")
+        return base64.urlsafe_b64encode(data).decode("ascii")
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """Returns the queryset restricted to the rows of the requested page, plus one row used
+        to know whether there's a next page. Nothing is evaluated, the caller decides how the
+        rows are fetched and then hands them to paginate_rows."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(view)
+        timestamp_field, pk_field = self.ordering
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            timestamp, pk = position
+            queryset = queryset.filter(
+                Q(**{f"{timestamp_field}__gt": timestamp})
+                | Q(**{timestamp_field: timestamp, f"{pk_field}__gt": pk})
+            )
+        return queryset.order_by(*self.ordering)[:self.page_size + 1]
+
+    def paginate_rows(self, rows):
+        """Receives the rows fetched from get_page_queryset, which can be model instances or
+        dicts, and returns those belonging to the page."""
+        rows = list(rows)
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = None
+        if self.has_next:
+            last = rows[-1]
+            if isinstance(last, dict):
+                self.next_position = tuple(last[field] for field in self.ordering)
+            else:
+                self.next_position = tuple(getattr(last, field) for field in self.ordering)
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_rows(self.get_page_queryset(queryset, request, view))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {
+                    "type": "string",
+                    "nullable": True,
+                },
+                "results": schema,
+            },
+        }
+
+
+class SearchPagination(KeysetPagination):
+    """Paginates the results of a search on the (rank, type, id) triple, best ranks first.
+
+    The results are the union of one query per model, which can't be filtered once combined,
+    so get_page_queryset receives the function building them after a given position."""
+    ordering = ("rank", "type", "id")
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            rank, result_type, pk = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+            rank, result_type, pk = float(rank), str(result_type), int(pk)
+        except (TypeError, ValueError, OverflowError):
+            raise self.invalid_cursor()
+        if not 0 < pk <= self.max_pk:
+            raise self.invalid_cursor()
+        return rank, result_type, pk
+
+    def encode_cursor(self, position):
+        data = json.dumps(list(position)).encode("ascii")
+        return base64.urlsafe_b64encode(data).decode("ascii")
+
+    def get_page_queryset(self, build_queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        return build_queryset(self.decode_cursor(request))[:self.page_size + 1]
+
@@ -0,0 +1,128 @@
+"""Searches the clients, contracts and events for the /api/search?q= endpoint.
+
+Each model is searched on its own fields: the names, email and company name of the clients,
+the title of the contracts, the title and notes of the events. The matches of the three
+models are ranked, combined with a UNION ALL and sorted by rank, the best first, in a single
+query. Each model is restricted to the rows the user can view beforehand.
+
+On Postgres, the fields of a model are matched with a full-text search: a tsvector built with
+the "simple" configuration, so names aren't stemmed, against the query parsed by
+websearch_to_tsquery, which accepts "quoted phrases", OR and -excluded words. The vectors are
+indexed by the GIN indexes of crm/migrations/0003_search_indexes.py, which must be built from
+the same expressions as SEARCH_FIELDS for the planner to use them. The rows are ranked with
+ts_rank.
+
+On the other databases, e.g. SQLite in development, every word of the query must be found,
+case-insensitively, in one of the fields, and a row is ranked by the number of its fields
+holding each word. This needs a full scan of the tables."""
+
+
+import re
+from functools import reduce
+from operator import add
+
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Concat
+
+from epic_events.crm.models import Client, Contract, Event
+from epic_events.crm.permissions import VIEW, scoped_queryset
+
+SEARCH_CONFIG = "simple"
+
+# the type of each result, with the model searched and the fields matched. The keys are
+# sorted, the position of the pagination relies on their order.
+SEARCH_FIELDS = {
+    "client": (Client, ("first_name", "last_name", "email", "company_name")),
+    "contract": (Contract, ("title",)),
+    "event": (Event, ("title", "notes")),
+}
+
+# the key refers to the result in the URLs of the API, the detail helps telling it apart.
+RESULT_COLUMNS = {
+    "client": (Concat("first_name", Value(" "), "last_name"), F("company_name")),
+    "contract": (F("title"), Concat("client__first_name", Value(" "), "client__last_name")),
+    "event": (F("title"), F("contract__title")),
+}
+
+
+def full_text_match(queryset, fields, query):
+    # imported here as django.contrib.postgres imports psycopg2, which the fallback doesn't
+    # need.
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    vector = SearchVector(*fields, config=SEARCH_CONFIG)
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+    return (queryset.annotate(search=vector).filter(search=search_query)
+            .annotate(rank=Cast(SearchRank(vector, search_query), FloatField())))
+
+
+def full_text_prefix_match(queryset, fields, query):
+    """Keeps the rows holding, in one of the fields, a word starting with each word of the
+    query, e.g. while it's being typed. The prefixes are matched by the same GIN indexes as
+    the full-text search. Returns None when the query holds no word."""
+    from django.contrib.postgres.search import SearchQuery, SearchVector
+
+    words = re.findall(r"\w+", query)
+    if not words:
+        return None
+    search_query = SearchQuery(" & ".join(f"{word}:*" for word in words),
+                               config=SEARCH_CONFIG, search_type="raw")
+    return (queryset.annotate(search=SearchVector(*fields, config=SEARCH_CONFIG))
+            .filter(search=search_query))
+
+
+def words_match(queryset, fields, query):
+    words = query.split()
+    for word in words:
+        queryset = queryset.filter(
+            reduce(lambda q1, q2: q1 | q2, (Q(**{f"{field}__icontains": word})
+                                            for field in fields)))
+    rank = reduce(add, (Case(When(**{f"{field}__icontains": word}, then=Value(1.0)),
+                             default=Value(0.0), output_field=FloatField())
+                        for word in words for field in fields))
+    return queryset.annotate(rank=rank)
+
+
+def after_position(queryset, result_type, position):
+    """Keeps the results following position, a (rank, type, id) triple, in the order of
+    the search: rank descending, then type and id ascending."""
+    if position is None:
+        return queryset
+    rank, last_type, pk = position
+    if result_type < last_type:
+        return queryset.filter(rank__lt=rank)
+    if result_type == last_type:
+        return queryset.filter(Q(rank__lt=rank) | Q(rank=rank, pk__gt=pk))
+    return queryset.filter(rank__lte=rank)
+
+
+def get_ranked_queryset(user, result_type, query, position=None):
+    """Returns the values of the rows of the type matching the query, as dicts holding their
+    id, type, key, detail and rank."""
+    model, fields = SEARCH_FIELDS[result_type]
+    key, detail = RESULT_COLUMNS[result_type]
+    queryset = scoped_queryset(user, model, VIEW, model.objects.all())
+    queryset = queryset.annotate(type=Value(result_type), key=key, detail=detail)
+    if connections[queryset.db].vendor == "postgresql":
+        queryset = full_text_match(queryset, fields, query)
+    else:
+        queryset = words_match(queryset, fields, query)
+    queryset = after_position(queryset, result_type, position)
+    return queryset.order_by().values("id", "type", "key", "detail", "rank")
+
+
+def search(user, query, result_types=None, position=None):
+    """Returns the results of the query among the rows the user can view, of all types or of
+    result_types, best ranked first. The rows after position are returned when it's given."""
+    querysets = [get_ranked_queryset(user, result_type, query, position)
+                 for result_type in result_types or SEARCH_FIELDS]
+    queryset = querysets[0]
+    if len(querysets) > 1:
+        queryset = queryset.union(*querysets[1:], all=True)
+    return queryset.order_by("-rank", "type", "id")
+
+
+def represent(row):
+    return {"type": row["type"], "key": row["key"], "detail": row["detail"],
+            "rank": row["rank"]}
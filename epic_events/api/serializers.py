@@ -5,12 +5,31 @@ through the API. Second, converting model instances into JSON data. This happens
 example when a GET request is received through the API."""
 
 
+from django.core.exceptions import ValidationError as DjangoValidationError
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
 from ..crm.models import CustomUser, Contract, Event, Client
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    """Drops the fields that aren't listed under "fields" in the serializer context, when
+    the client asked for a subset of the fields with ?fields=.
+
+    Meta.field_sources lists the model fields read by each serializer field whose source
+    isn't the model field of the same name, and Meta.field_formats how the fields read from
+    several columns are represented. The views use them to fetch the rows with values(), see
+    api/representations.py."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.context.get("fields")
+        if requested is not None:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+
+class CustomUserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Convert user instances into JSON data and vice versa, if the received data
     is validated."""
 
@@ -46,3 +65,198 @@ class ContractSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contract
         fields = "__all__"
+
+
+class ClientReadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Convert client instances into JSON data for the read endpoints. The sales contact
+    is represented by its username. The totals of the contracts and events of the client are
+    read from its rollup. The queryset should select_related the sales_contact and the rollup
+    so that no query is made per client."""
+    sales_contact = serializers.SlugRelatedField(slug_field="username", read_only=True)
+    contract_count = serializers.IntegerField(source="rollup.contract_count", read_only=True)
+    total_amount = serializers.FloatField(source="rollup.total_amount", read_only=True)
+    total_payment_due = serializers.FloatField(source="rollup.total_payment_due",
+                                               read_only=True)
+    upcoming_event_count = serializers.IntegerField(source="rollup.upcoming_event_count",
+                                                    read_only=True)
+    past_event_count = serializers.IntegerField(source="rollup.past_event_count",
+                                                read_only=True)
+
+    class Meta:
+        model = Client
+        fields = ["first_name", "last_name", "email", "phone",
+                  "mobile", "company_name", "sales_contact", "contract_count", "total_amount",
+                  "total_payment_due", "upcoming_event_count", "past_event_count"]
+        field_sources = {"sales_contact": ["sales_contact__username"],
+                         "contract_count": ["rollup__contract_count"],
+                         "total_amount": ["rollup__total_amount"],
+                         "total_payment_due": ["rollup__total_payment_due"],
+                         "upcoming_event_count": ["rollup__upcoming_event_count"],
+                         "past_event_count": ["rollup__past_event_count"]}
+
+
+class ClientExportSerializer(ClientReadSerializer):
+    """Convert client instances into the rows of the export_crm files. Unlike the read
+    endpoints, every column of the clients is included, as the contracts and events have."""
+
+    class Meta(ClientReadSerializer.Meta):
+        fields = (["id"] + ClientReadSerializer.Meta.fields
+                  + ["client_status", "date_updated", "date_created"])
+
+
+class ContractReadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Convert contract instances into JSON data for the read endpoints. The sales contact
+    is represented by its username and the client by its first and last name. The queryset
+    should select_related both the sales_contact and the client."""
+    sales_contact = serializers.SlugRelatedField(slug_field="username", read_only=True)
+    client = serializers.CharField(source="client.full_name", read_only=True)
+
+    class Meta:
+        model = Contract
+        fields = ["id", "title", "signed", "amount", "payment_due", "date_updated",
+                  "date_created", "sales_contact", "client"]
+        field_sources = {"sales_contact": ["sales_contact__username"],
+                         "client": ["client__first_name", "client__last_name"]}
+        field_formats = {"client": "{} {}"}
+
+
+class EventReadSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Convert event instances into JSON data for the read endpoints. The support contact
+    is represented by its username and the contract by its title. The queryset should
+    select_related both the support_contact and the contract."""
+    support_contact = serializers.SlugRelatedField(slug_field="username", read_only=True)
+    contract = serializers.SlugRelatedField(slug_field="title", read_only=True)
+
+    class Meta:
+        model = Event
+        fields = ["id", "title", "status", "attendees", "event_date", "notes",
+                  "date_updated", "date_created", "support_contact", "contract"]
+        field_sources = {"support_contact": ["support_contact__username"],
+                         "contract": ["contract__title"]}
+
+
+class NaturalKeyField(serializers.Field):
+    """Represents a related instance by one of its natural keys, e.g. a user by its username.
+
+    Instead of querying the database for each received key, the field looks the key up in a
+    dict stored in the serializer context under context_key. The view resolves all the keys
+    received in a request at once and passes the resulting dict to the serializer."""
+    default_error_messages = {
+        "does_not_exist": "Object with {natural_key}={value} does not exist.",
+    }
+
+    def __init__(self, context_key, natural_key, **kwargs):
+        self.context_key = context_key
+        self.natural_key = natural_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        try:
+            return self.context[self.context_key][data]
+        except (KeyError, TypeError):
+            self.fail("does_not_exist", natural_key=self.natural_key, value=data)
+
+    def to_representation(self, value):
+        return getattr(value, self.natural_key)
+
+
+class BulkCreateListSerializer(serializers.ListSerializer):
+    """Validates a list of objects and inserts them with a single bulk_create.
+
+    The uniqueness of the fields listed in the child's Meta.bulk_unique_fields is checked
+    with one query for the whole list instead of one query per object. Errors are reported
+    per object, in the same order as the received list."""
+
+    def to_internal_value(self, data):
+        validated_data = super().to_internal_value(data)
+        model = self.child.Meta.model
+        unique_fields = self.child.Meta.bulk_unique_fields
+        keys = [tuple(attrs[field] for field in unique_fields) for attrs in validated_data]
+        # only the leading column of the unique index is filtered on, see
+        # ClientQuerySet.in_bulk_by_name. The keys are then compared whole.
+        lookup = {f"{unique_fields[0]}__in": {key[0] for key in keys}}
+        existing = set(model.objects.filter(**lookup).values_list(*unique_fields))
+
+        errors = []
+        seen = set()
+        for key in keys:
+            if key in existing or key in seen:
+                if len(unique_fields) == 1:
+                    error_key = unique_fields[0]
+                else:
+                    error_key = api_settings.NON_FIELD_ERRORS_KEY
+                errors.append({error_key: [f"{model._meta.verbose_name} with this "
+                                           f"{' and '.join(unique_fields)} already exists."]})
+            else:
+                errors.append({})
+            seen.add(key)
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return validated_data
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        instances = [self.child.build_instance(attrs) for attrs in validated_data]
+        return model.objects.bulk_create(instances)
+
+
+class BulkCreateSerializerMixin:
+    """bulk_create doesn't call the save method of the models. Thus, the checks done by their
+    clean method are run while validating each object. Partial data, used to update many objects
+    at once, is only validated field by field as the clean methods need whole objects."""
+
+    def build_instance(self, attrs):
+        return self.Meta.model(**attrs)
+
+    def validate(self, attrs):
+        if self.partial:
+            return attrs
+        instance = self.build_instance(attrs)
+        try:
+            instance.clean()
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.messages)
+        # clean may have modified the instance, e.g. by replacing the spaces of a title.
+        return {field: getattr(instance, field) for field in attrs}
+
+
+class ClientBulkSerializer(BulkCreateSerializerMixin, ClientSerializer):
+    """Convert a list of clients into JSON data and vice versa. The sales contact is
+    represented by its username."""
+    sales_contact = NaturalKeyField("users", "username", allow_null=True, required=False)
+
+    class Meta(ClientSerializer.Meta):
+        validators = []
+        bulk_unique_fields = ("first_name", "last_name")
+        list_serializer_class = BulkCreateListSerializer
+
+
+class ContractBulkSerializer(BulkCreateSerializerMixin, ContractSerializer):
+    """Convert a list of contracts into JSON data and vice versa. The sales contact is
+    represented by its username and the client by its first and last name."""
+    sales_contact = NaturalKeyField("users", "username", allow_null=True, required=False)
+    client = NaturalKeyField("clients", "full_name")
+
+    class Meta(ContractSerializer.Meta):
+        fields = ContractReadSerializer.Meta.fields
+        extra_kwargs = {"title": {"validators": []}}
+        bulk_unique_fields = ("title",)
+        list_serializer_class = BulkCreateListSerializer
+
+
+class EventBulkSerializer(BulkCreateSerializerMixin, EventSerializer):
+    """Convert a list of events into JSON data and vice versa. The support contact is
+    represented by its username and the contract by its title."""
+    support_contact = NaturalKeyField("users", "username", allow_null=True, required=False)
+    contract = NaturalKeyField("contracts", "title")
+
+    class Meta(EventSerializer.Meta):
+        fields = EventReadSerializer.Meta.fields
+        extra_kwargs = {"title": {"validators": []}}
+        bulk_unique_fields = ("title",)
+        list_serializer_class = BulkCreateListSerializer
+
+    def build_instance(self, attrs):
+        event = super().build_instance(attrs)
+        event.set_status()
+        return event
@@ -0,0 +1,119 @@
+"""Streams the rows of a read endpoint instead of building the whole payload in memory.
+
+The queryset is read through QuerySet.iterator, which uses a server-side cursor on Postgres,
+and each row is serialized and sent to the client as soon as it's fetched. The memory used
+by the worker is thus bounded by the chunk size, not by the size of the table."""
+
+
+import csv
+
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .representations import ValuesRepresentation
+
+STREAM_QUERY_PARAM = "stream"
+STREAM_CHUNK_SIZE = 2000
+
+STREAM_FORMATS = {
+    # ?stream=1 is a shortcut for JSON lines.
+    "1": "jsonl",
+    "jsonl": "jsonl",
+    "csv": "csv",
+}
+
+CONTENT_TYPES = {
+    "jsonl": "application/jsonl",
+    "csv": "text/csv",
+}
+
+
+class Echo:
+    """Implements the write method of a file-like object by returning the written value, so
+    that csv.writer can be used to build the lines of a streaming response."""
+
+    def write(self, value):
+        return value
+
+
+def get_stream_format(request):
+    """Returns None if the request doesn't ask for a streaming response, the requested format
+    otherwise. Raises a ValidationError if the format isn't supported."""
+    requested = request.query_params.get(STREAM_QUERY_PARAM)
+    if requested is None:
+        return None
+    try:
+        return STREAM_FORMATS[requested]
+    except KeyError:
+        raise ValidationError({STREAM_QUERY_PARAM: f"choose among {', '.join(STREAM_FORMATS)}"})
+
+
+def iter_representations(queryset, serializer):
+    """Yields the serialized rows one by one. The rows are fetched as dicts with values() and
+    represented as the serializer would represent the model instances."""
+    representation = ValuesRepresentation(serializer)
+    for row in representation.get_queryset(queryset).iterator(chunk_size=STREAM_CHUNK_SIZE):
+        yield representation.to_representation(row)
+
+
+def iter_jsonl(rows):
+    encoder = JSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
+def iter_csv(rows, field_names):
+    writer = csv.writer(Echo())
+    yield writer.writerow(field_names)
+    for row in rows:
+        yield writer.writerow([row[name] for name in field_names])
+
+
+async def aiter_representations(queryset, serializer):
+    """Asynchronous version of iter_representations."""
+    representation = ValuesRepresentation(serializer)
+    rows = representation.get_queryset(queryset).aiterator(chunk_size=STREAM_CHUNK_SIZE)
+    async for row in rows:
+        yield representation.to_representation(row)
+
+
+async def aiter_jsonl(rows):
+    encoder = JSONEncoder()
+    async for row in rows:
+        yield encoder.encode(row) + "\n"
+
+
+async def aiter_csv(rows, field_names):
+    writer = csv.writer(Echo())
+    yield writer.writerow(field_names)
+    async for row in rows:
+        yield writer.writerow([row[name] for name in field_names])
+
+
+def stream_response(queryset, serializer_class, stream_format, filename, context=None):
+    """Returns a StreamingHttpResponse holding the rows of the queryset, serialized with
+    serializer_class, as JSON lines or CSV."""
+    serializer = serializer_class(context=context or {})
+    rows = iter_representations(queryset, serializer)
+    if stream_format == "csv":
+        content = iter_csv(rows, list(serializer.fields))
+    else:
+        content = iter_jsonl(rows)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[stream_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{stream_format}"'
+    return response
+
+
+def astream_response(queryset, serializer_class, stream_format, filename, context=None):
+    """Asynchronous version of stream_response, for the async views. The rows are fetched with
+    QuerySet.aiterator, so the event loop serves other requests while waiting for them."""
+    serializer = serializer_class(context=context or {})
+    rows = aiter_representations(queryset, serializer)
+    if stream_format == "csv":
+        content = aiter_csv(rows, list(serializer.fields))
+    else:
+        content = aiter_jsonl(rows)
+    response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[stream_format])
+    response["Content-Disposition"] = f'attachment; filename="{filename}.{stream_format}"'
+    return response
@@ -0,0 +1,418 @@
+"""Tests of the endpoints of the API and of the import_crm and export_crm commands.
+
+The responses of the list endpoints are cached, see cache.py. The tests use a local-memory
+cache, cleared before each test, instead of the file-based one shared by the worker processes.
+Run them with python manage.py test epic_events.api.tests."""
+
+
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from epic_events.crm.models import Client, Contract, CustomUser, Event
+
+TEST_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+def create_user(username, user_type):
+    return CustomUser.objects.create_user(username=username, password="password",
+                                          email=f"{username}@example.com",
+                                          first_name=username.capitalize(),
+                                          last_name="Test", user_type=user_type)
+
+
+def create_rows(start, count, salesman, support):
+    """Creates count clients, each with a contract holding an event, named from start on."""
+    now = timezone.now()
+    for number in range(start, start + count):
+        client = Client.objects.create(first_name=f"First{number}", last_name=f"Last{number}",
+                                       email=f"client{number}@example.com",
+                                       company_name=f"Company{number}", sales_contact=salesman)
+        contract = Contract.objects.create(title=f"Contract{number}", signed=True, amount=1000,
+                                           payment_due=0, sales_contact=salesman,
+                                           client=client)
+        Event.objects.create(title=f"Event{number}", attendees=10,
+                             event_date=now + timedelta(days=number), notes="notes",
+                             support_contact=support, contract=contract)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ApiTestCase(APITestCase):
+    """Creates a manager, a salesman and a support team member, and authenticates as the
+    manager."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_user("manager", 1)
+        cls.salesman = create_user("salesman", 2)
+        cls.support = create_user("support", 3)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.manager)
+
+    def get_list(self, path):
+        response = self.client.get(path, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+
+class ListQueriesTests(ApiTestCase):
+    """The list endpoints fetch the users, clients and contracts they name along with their
+    rows, so they make the same number of queries whatever the number of rows."""
+    paths = ["/api/client/view", "/api/contract/view", "/api/event/view"]
+
+    def count_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_list(path)
+        return len(queries)
+
+    def test_queries_do_not_depend_on_the_number_of_rows(self):
+        create_rows(0, 2, self.salesman, self.support)
+        counts = {path: self.count_queries(path) for path in self.paths}
+
+        create_rows(2, 20, self.salesman, self.support)
+        for path in self.paths:
+            with self.subTest(path=path):
+                # the cached responses would be served without any query.
+                cache.clear()
+                with self.assertNumQueries(counts[path]):
+                    rows = self.get_list(path)
+                self.assertEqual(len(rows), 22)
+
+
+class ListCacheTests(ApiTestCase):
+    """The cached responses of a list endpoint are invalidated by the writes to the models
+    it shows, once their transaction is committed."""
+
+    def setUp(self):
+        super().setUp()
+        create_rows(0, 3, self.salesman, self.support)
+
+    def get_company_names(self):
+        return {row["company_name"] for row in self.get_list("/api/client/view")}
+
+    def test_write_is_visible_on_next_read(self):
+        self.assertIn("Company1", self.get_company_names())
+        # the test runs in a transaction which is never committed.
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put("/api/client/First1/Last1/",
+                                       {"company_name": "Renamed", "sales_contact": "salesman"},
+                                       format="json")
+        self.assertEqual(response.status_code, 200)
+        names = self.get_company_names()
+        self.assertIn("Renamed", names)
+        self.assertNotIn("Company1", names)
+
+    def get_cache_counts(self):
+        with self.settings(API_METRICS_ENABLED=True):
+            response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        counts = {}
+        for line in response.content.decode().splitlines():
+            if line.startswith("epic_events_list_cache_requests_total{"):
+                result = line.split('"')[1]
+                counts[result] = int(line.rsplit(" ", 1)[1])
+        return counts
+
+    def test_repeated_read_is_a_hit(self):
+        before = self.get_cache_counts()
+        self.get_company_names()
+        self.get_company_names()
+        after = self.get_cache_counts()
+        self.assertEqual(after["miss"] - before["miss"], 1)
+        self.assertEqual(after["hit"] - before["hit"], 1)
+
+    def test_bulk_write_is_visible_on_next_read(self):
+        self.get_company_names()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch("/api/client/bulk",
+                                         {"keys": ["First0 Last0", "First2 Last2"],
+                                          "changes": {"company_name": "Merged"}},
+                                         format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_company_names(), {"Merged", "Company1"})
+
+
+class KeysetPaginationTests(ApiTestCase):
+    """The pages of the list endpoints are walked through the cursors of their next links,
+    which are refused with a 400 response when they're altered."""
+    paths = ["/api/client/view", "/api/async/client/view"]
+
+    def setUp(self):
+        super().setUp()
+        create_rows(0, 10, self.salesman, self.support)
+        # the rows created together share a timestamp, so the cursor falls between equal ones.
+        now = timezone.now()
+        for numbers, timestamp in ((range(0, 4), now), (range(4, 10), now + timedelta(hours=1))):
+            Client.objects.filter(first_name__in=[f"First{number}" for number in numbers]) \
+                .update(date_created=timestamp)
+
+    def get(self, path):
+        return self.client.get(path, HTTP_ACCEPT="application/json")
+
+    def encode(self, position):
+        return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+    def test_pages_hold_every_row_once(self):
+        expected = sorted(f"First{number}" for number in range(10))
+        for path in self.paths:
+            for page_size in (1, 3, 4):
+                with self.subTest(path=path, page_size=page_size):
+                    names = []
+                    url = f"{path}?page_size={page_size}"
+                    while url is not None:
+                        response = self.get(url)
+                        self.assertEqual(response.status_code, 200)
+                        page = response.json()
+                        self.assertLessEqual(len(page["results"]), page_size)
+                        names += [row["first_name"] for row in page["results"]]
+                        url = page["next"]
+                    self.assertEqual(sorted(names), expected)
+
+    def test_invalid_cursor_is_refused(self):
+        response = self.get("/api/client/view?page_size=3")
+        valid = response.json()["next"].split("cursor=")[1].split("&")[0]
+        timestamp = timezone.now().isoformat()
+        cursors = ["not-a-cursor!", valid[:-4], self.encode(42),
+                   self.encode(["yesterday", 1]), self.encode([timestamp, "one"]),
+                   self.encode([timestamp]), self.encode([timestamp, 2 ** 70])]
+        for path in self.paths:
+            for cursor in cursors:
+                with self.subTest(path=path, cursor=cursor):
+                    response = self.get(f"{path}?cursor={cursor}")
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn("cursor", response.json())
+
+
+class ConditionalGetTests(ApiTestCase):
+    """The list endpoints answer 304 while the rows they would return are unchanged, which
+    includes their number."""
+    path = "/api/client/view"
+
+    def setUp(self):
+        super().setUp()
+        create_rows(0, 3, self.salesman, self.support)
+
+    def get(self, **headers):
+        return self.client.get(self.path, HTTP_ACCEPT="application/json", **headers)
+
+    def test_not_modified_carries_the_etag(self):
+        etag = self.get()["ETag"]
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_delete_changes_the_etag(self):
+        response = self.get()
+        self.assertNotIn("Last-Modified", response)
+        with self.captureOnCommitCallbacks(execute=True):
+            Client.objects.get(first_name="First1").delete()
+        response = self.get(HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 2)
+
+
+class BulkCreateContactTests(ApiTestCase):
+    """A list of objects is refused when one of them names a contact of the wrong team, as a
+    single object is."""
+
+    def setUp(self):
+        super().setUp()
+        create_rows(0, 1, self.salesman, self.support)
+        event_date = (timezone.now() + timedelta(days=10)).isoformat()
+        self.cases = [
+            ("/api/client/create", Client, "sales_contact",
+             {"first_name": "New", "last_name": "Client", "email": "new@example.com",
+              "company_name": "New"}),
+            ("/api/contract/create", Contract, "sales_contact",
+             {"title": "NewContract", "signed": False, "amount": 100, "payment_due": 0,
+              "client": "First0 Last0"}),
+            ("/api/event/create", Event, "support_contact",
+             {"title": "NewEvent", "attendees": 5, "event_date": event_date, "notes": "",
+              "contract": "Contract0"}),
+        ]
+
+    def test_wrong_team_is_refused(self):
+        wrong_users = {"sales_contact": [self.manager, self.support],
+                       "support_contact": [self.manager, self.salesman]}
+        for path, model, field, row in self.cases:
+            for user in wrong_users[field]:
+                with self.subTest(path=path, contact=user.username):
+                    row = dict(row, **{field: user.username})
+                    single = self.client.post(path, row, format="json")
+                    self.assertEqual(single.status_code, 400)
+                    response = self.client.post(path, [row], format="json")
+                    self.assertEqual(response.status_code, 400)
+                    self.assertIn(field, response.json()[0])
+                    self.assertEqual(model.objects.count(), 1)
+
+    def test_right_team_is_accepted(self):
+        contacts = {"sales_contact": self.salesman, "support_contact": self.support}
+        for path, model, field, row in self.cases:
+            with self.subTest(path=path):
+                row = dict(row, **{field: contacts[field].username})
+                response = self.client.post(path, [row], format="json")
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(model.objects.count(), 2)
+
+
+class BulkWriteTests(ApiTestCase):
+    """The bulk update and delete endpoints check the permission on every keyed object, run the
+    checks of the single endpoints and refresh the status of the clients concerned."""
+
+    def setUp(self):
+        super().setUp()
+        self.other_salesman = create_user("othersalesman", 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            create_rows(0, 2, self.salesman, self.support)
+            create_rows(2, 1, self.other_salesman, self.support)
+
+    def bulk(self, method, path, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)(path, data, format="json")
+
+    def get_status(self, number):
+        return Client.objects.get(first_name=f"First{number}").client_status
+
+    def test_salesman_cannot_write_other_clients_objects(self):
+        self.client.force_authenticate(self.salesman)
+        response = self.bulk("patch", "/api/contract/bulk",
+                             {"keys": ["Contract0", "Contract2"], "changes": {"signed": False}})
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("Contract2", response.json()["detail"])
+        self.assertTrue(Contract.objects.get(title="Contract0").signed)
+
+        response = self.bulk("delete", "/api/event/bulk", {"keys": ["Event0", "Event2"]})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Event.objects.count(), 3)
+
+    def test_payment_due_cannot_exceed_amount(self):
+        for changes in ({"payment_due": 5000}, {"amount": 10, "payment_due": 20}):
+            with self.subTest(changes=changes):
+                response = self.bulk("patch", "/api/contract/bulk",
+                                     {"keys": ["Contract0", "Contract1"], "changes": changes})
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Contract.objects.filter(payment_due__gt=0).exists())
+
+        Contract.objects.filter(title="Contract1").update(payment_due=500)
+        response = self.bulk("patch", "/api/contract/bulk",
+                             {"keys": ["Contract0", "Contract1"], "changes": {"amount": 100}})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Contract.objects.filter(amount=100).exists())
+
+    def test_client_status_is_refreshed(self):
+        # Event0 takes place as it's created, the other events are upcoming.
+        self.assertEqual([self.get_status(number) for number in range(3)], [3, 2, 2])
+        past = (timezone.now() - timedelta(days=1)).isoformat()
+        response = self.bulk("patch", "/api/event/bulk",
+                             {"keys": ["Event1"], "changes": {"event_date": past}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_status(1), 3)
+
+        # the contract moves to another client along with its past event.
+        response = self.bulk("patch", "/api/contract/bulk",
+                             {"keys": ["Contract1"], "changes": {"client": "First2 Last2"}})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((self.get_status(1), self.get_status(2)), (1, 3))
+
+        response = self.bulk("delete", "/api/event/bulk", {"keys": ["Event1"]})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_status(2), 2)
+
+    def test_wrong_team_contact_is_refused(self):
+        cases = [("/api/client/bulk", "First0 Last0", "sales_contact", self.support),
+                 ("/api/contract/bulk", "Contract0", "sales_contact", self.manager),
+                 ("/api/event/bulk", "Event0", "support_contact", self.manager),
+                 ("/api/event/bulk", "Event0", "support_contact", self.salesman)]
+        for path, key, field, user in cases:
+            with self.subTest(path=path, contact=user.username):
+                response = self.bulk("patch", path,
+                                     {"keys": [key], "changes": {field: user.username}})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(field, response.json())
+        self.assertEqual(Client.objects.get(first_name="First0").sales_contact, self.salesman)
+        self.assertEqual(Contract.objects.get(title="Contract0").sales_contact, self.salesman)
+        self.assertEqual(Event.objects.get(title="Event0").support_contact, self.support)
+
+
+class ImportExportTests(ApiTestCase):
+    """The files written by export_crm are loaded back by import_crm, chunk by chunk, and an
+    import stopped by an invalid row is resumed from its checkpoint."""
+    # the columns set anew by the import.
+    regenerated = {"id", "date_updated", "date_created"}
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        with self.captureOnCommitCallbacks(execute=True):
+            create_rows(0, 5, self.salesman, self.support)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def export(self, name):
+        call_command("export_crm", output_dir=self.path(name), stdout=io.StringIO())
+        exported = {}
+        for entity in ("clients", "contracts", "events"):
+            with gzip.open(self.path(f"{name}/{entity}.csv.gz"), "rt", newline="") as file:
+                exported[entity] = [{column: value for column, value in row.items()
+                                     if column not in self.regenerated}
+                                    for row in csv.DictReader(file)]
+        return exported
+
+    def run_import(self, **files):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_crm", chunk_size=2, checkpoint=self.path("checkpoint.json"),
+                         stdout=io.StringIO(), **files)
+
+    def write_events(self, rows):
+        with open(self.path("events.csv"), "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def test_round_trip_with_resume(self):
+        exported = self.export("before")
+        Client.objects.all().delete()
+
+        # the fourth event is invalid, the first chunk of two events is written.
+        events = [dict(row) for row in exported["events"]]
+        events[3]["attendees"] = "many"
+        self.write_events(events)
+        with self.assertRaisesRegex(CommandError, "row 4: .*attendees"):
+            self.run_import(clients=self.path("before/clients.csv.gz"),
+                            contracts=self.path("before/contracts.csv.gz"),
+                            events=self.path("events.csv"))
+        self.assertEqual(Event.objects.count(), 2)
+
+        self.write_events(exported["events"])
+        self.run_import(events=self.path("events.csv"))
+        self.assertEqual(self.export("after"), exported)
+
+    def test_wrong_team_contact_is_refused(self):
+        exported = self.export("before")
+        Client.objects.all().delete()
+        with open(self.path("clients.csv"), "w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=list(exported["clients"][0]))
+            writer.writeheader()
+            writer.writerow(dict(exported["clients"][0], sales_contact=self.support.username))
+        with self.assertRaisesRegex(CommandError, "row 1: .*sales_contact"):
+            self.run_import(clients=self.path("clients.csv"))
+        self.assertFalse(Client.objects.exists())
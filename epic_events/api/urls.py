@@ -4,10 +4,13 @@ that handles the requests send to that path."""
 
 
 from django.urls import path
-from .views import ClientView, ClientViewSet, CreateClientView
-from .views import EventView, EventViewSet, CreateEventView
-from .views import ContractView, ContractViewSet, CreateContractView
+from .views import ClientView, ClientViewSet, CreateClientView, ClientBulkViewSet
+from .views import EventView, EventViewSet, CreateEventView, EventBulkViewSet
+from .views import ContractView, ContractViewSet, CreateContractView, ContractBulkViewSet
 from .views import CustomUserView, CreateCustomUserView, CustomUserViewSet
+from .views import SearchView, AnalyticsView
+from .async_views import AsyncCustomUserView, AsyncClientView, AsyncContractView
+from .async_views import AsyncEventView
 
 app_name = "crm"
 
@@ -32,6 +35,11 @@ urlpatterns = [
         "delete": "destroy"
     })),
 
+    path('client/bulk', ClientBulkViewSet.as_view({
+        "patch": "update",
+        "delete": "destroy"
+    })),
+
     path('contract/view', ContractView.as_view()),
 
     path('contract/create', CreateContractView.as_view()),
@@ -42,6 +50,11 @@ urlpatterns = [
         "delete": "destroy"
     })),
 
+    path('contract/bulk', ContractBulkViewSet.as_view({
+        "patch": "update",
+        "delete": "destroy"
+    })),
+
     path('event/view', EventView.as_view()),
 
     path('event/create', CreateEventView.as_view()),
@@ -51,4 +64,22 @@ urlpatterns = [
         "put": "update",
         "delete": "destroy"
     })),
+
+    path('event/bulk', EventBulkViewSet.as_view({
+        "patch": "update",
+        "delete": "destroy"
+    })),
+
+    path('search', SearchView.as_view()),
+
+    path('analytics', AnalyticsView.as_view()),
+
+    # async versions of the read endpoints, see async_views.py.
+    path('async/users/view', AsyncCustomUserView.as_view()),
+
+    path('async/client/view', AsyncClientView.as_view()),
+
+    path('async/contract/view', AsyncContractView.as_view()),
+
+    path('async/event/view', AsyncEventView.as_view()),
 ]
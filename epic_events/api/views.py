@@ -5,31 +5,67 @@ and a third one for both the PUT and DELETE request. In other words, this module
 ensures that for each model the CRUD operations are available through the API."""
 
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, FloatField, Value
 from django.utils import timezone
 from rest_framework import permissions
 from rest_framework import status
-from rest_framework.exceptions import PermissionDenied
-from rest_framework.generics import CreateAPIView
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.generics import CreateAPIView, GenericAPIView
 from rest_framework.response import Response
-from rest_framework.views import APIView
 from rest_framework.viewsets import GenericViewSet
 
-from epic_events.crm.models import Client, Event, Contract, CustomUser
+from epic_events.crm.models import Client, ClientRollup, Event, Contract, CustomUser
+from epic_events.crm.models import schedule_client_status_refresh
+from epic_events.crm.rollups import create_client_rollups, refresh_rollups_on_commit
+from epic_events.crm.rollups import schedule_rollup_refresh
+from epic_events.crm.signals import rows_changed
+from epic_events.crm.permissions import VIEW, CHANGE, DELETE, scoped_queryset
+from epic_events.crm.permissions import has_object_permission, annotate_permission
 from .serializers import CustomUserSerializer, ClientSerializer, EventSerializer, ContractSerializer
-
-
-class CustomUserView(APIView):
+from .serializers import ClientReadSerializer, EventReadSerializer, ContractReadSerializer
+from .serializers import ClientBulkSerializer, EventBulkSerializer, ContractBulkSerializer
+from .bulk import get_rows, collect_keys, resolve, check_rows_permission
+from .bulk import get_keys, check_found, get_changes
+from .bulk import contacts_by_username, clients_by_name, contracts_by_title
+from .streaming import get_stream_format, stream_response
+from .conditional import ConditionalGetMixin
+from .cache import CachedListMixin
+from .representations import ValuesListMixin
+from .filters import filter_queryset, get_requested_fields
+from .filters import ClientFilterSerializer, ContractFilterSerializer, EventFilterSerializer
+from .filters import SearchParamsSerializer, AnalyticsParamsSerializer
+from .pagination import SearchPagination
+from .search import search, represent
+from .analytics import get_reports
+
+
+class CustomUserView(CachedListMixin, ValuesListMixin, GenericAPIView):
     """The get method ensures an authenticated user can access the CustomUser model according to his
-    permissions."""
+    permissions. The users are paginated in the order they joined."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
+    read_from_replica = True
+    ordering = ("date_joined", "id")
+    cache_models = (CustomUser,)
 
     def get(self, request, *args, **kwargs):
         """Only managers have read access to other User instances. Salesmen and Support team
-        members can access other Users."""
+        members can access other Users. Managers can stream all users with ?stream=jsonl or
+        ?stream=csv."""
         users = CustomUser.objects.all()
         if request.user.user_type == 1:
-            serializer = CustomUserSerializer(users, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            fields = get_requested_fields(request, CustomUserSerializer)
+            stream_format = get_stream_format(request)
+            if stream_format:
+                return stream_response(users.order_by(*self.ordering), CustomUserSerializer,
+                                       stream_format, "users", {"fields": fields})
+
+            def build_response():
+                serializer = CustomUserSerializer(context={"fields": fields})
+                return self.get_values_response(users, serializer)
+            return self.get_cached_response(request, CustomUser, build_response)
         elif request.user.user_type in [2, 3]:
             user = CustomUserSerializer(request.user)
             return Response(user.data, status=status.HTTP_200_OK)
@@ -39,6 +75,7 @@ class CreateCustomUserView(CreateAPIView):
     """The create method ensures an authenticated user can create a User instance according to his
     permissions."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
     serializer_class = CustomUserSerializer
     http_method_names = ["post"]
 
@@ -62,6 +99,7 @@ class CustomUserViewSet(GenericViewSet):
     permissions. The destroy method ensures an authenticated user can delete a User instance
     according to his permissions."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 12
     serializer_class = CustomUserSerializer
     http_method_names = ["put", "delete"]
 
@@ -100,33 +138,50 @@ class CustomUserViewSet(GenericViewSet):
             raise PermissionDenied("Only managers can delete users")
 
 
-class ClientView(APIView):
+class ClientView(ConditionalGetMixin, CachedListMixin, ValuesListMixin, GenericAPIView):
     """The get method ensures an authenticated user can access the Client model according to his
-    permissions."""
+    permissions. The clients are paginated in the order they were created."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
+    read_from_replica = True
+    cache_models = (Client, ClientRollup, CustomUser)
+    etag_related = ("rollup",)
 
     def get(self, request, *args, **kwargs):
-        """Any authenticated user has read access to all clients."""
+        """Any authenticated user has read access to all clients. The clients are paginated, unless
+        ?stream=jsonl or ?stream=csv is passed, in which case all of them are streamed. They can
+        be filtered by ?sales_contact=<username>."""
         clients = Client.objects.all()
-        serializer = ClientSerializer(clients, many=True)
-        for client in serializer.data:
-            sales_contact_id = client["sales_contact"]
-            if sales_contact_id:
-                sales_contact = CustomUser.objects.get(id=sales_contact_id)
-                client["sales_contact"] = sales_contact.username
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        clients = scoped_queryset(request.user, Client, VIEW, clients)
+        clients = filter_queryset(request, clients, ClientFilterSerializer)
+        fields = get_requested_fields(request, ClientReadSerializer)
+        stream_format = get_stream_format(request)
+        if stream_format:
+            return stream_response(clients.order_by("date_created", "id"), ClientReadSerializer,
+                                   stream_format, "clients", {"fields": fields})
+        not_modified = self.get_not_modified_response(request, clients)
+        if not_modified:
+            return not_modified
+
+        def build_response():
+            serializer = ClientReadSerializer(context={"fields": fields})
+            return self.get_values_response(clients, serializer)
+        return self.get_cached_response(request, Client, build_response)
 
 
 class CreateClientView(CreateAPIView):
     """The create method ensures an authenticated user can create a Client instance according to his
     permissions"""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
     serializer_class = ClientSerializer
     http_method_names = ["post"]
 
     def create(self, request, *args, **kwargs):
         """Only managers and salesmen can add new clients to the crm. Salesmen can edit only their
-        clients."""
+        clients. A list of clients can be sent instead of a single one."""
+        if isinstance(request.data, list):
+            return self.create_many(request)
         if request.user.user_type in [1, 2]:
             if request.user.user_type == 2 and request.user.username != request.data["sales_contact"]:
                 raise PermissionDenied("Salesmen cannot assign another salesmen a client")
@@ -146,6 +201,26 @@ class CreateClientView(CreateAPIView):
                         status=status.HTTP_201_CREATED,
                         headers=headers)
 
+    def create_many(self, request):
+        """Creates all the received clients in a single transaction, or none of them if any is
+        invalid. The sales contacts are resolved with one query for the whole list."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("only managers and salesmen can add new users to the crm")
+        rows = get_rows(request.data)
+        if request.user.user_type == 2:
+            check_rows_permission(rows,
+                                  lambda row: row.get("sales_contact") == request.user.username,
+                                  "Salesmen cannot assign another salesmen a client.")
+        context = {"users": contacts_by_username(rows, Client, "sales_contact")}
+        serializer = ClientBulkSerializer(data=rows, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            clients = serializer.save()
+            rows_changed.send(sender=Client)
+            # bulk_create doesn't send the post_save signal creating the rollups.
+            create_client_rollups(clients)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 class ClientViewSet(GenericViewSet):
     """The update method ensures an authenticated user can update a Client instance according to his
@@ -157,6 +232,7 @@ class ClientViewSet(GenericViewSet):
     the client that's going to be modified/deleted.
     """
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 12
     serializer_class = ClientSerializer
     http_method_names = ["put", "delete"]
 
@@ -171,8 +247,7 @@ class ClientViewSet(GenericViewSet):
         client = Client.objects.get(last_name=client_last_name,
                                     first_name=client_first_name)
         if request.user.user_type in [1, 2]:
-            salesman_clients = Client.objects.filter(sales_contact_id=request.user.id)
-            if request.user.user_type == 2 and client not in salesman_clients:
+            if not has_object_permission(request.user, CHANGE, client):
                 raise PermissionDenied("Salesmen can only update his own clients")
             serializer = self.serializer_class(client,
                                                data=request.data,
@@ -196,8 +271,7 @@ class ClientViewSet(GenericViewSet):
         client = Client.objects.get(first_name=client_first_name,
                                     last_name=client_last_name)
         if request.user.user_type in [1, 2]:
-            salesman_clients = Client.objects.filter(sales_contact_id=request.user.id)
-            if request.user.user_type == 2 and client not in salesman_clients:
+            if not has_object_permission(request.user, DELETE, client):
                 raise PermissionDenied("Salesmen can only delete their clients")
             client.delete()
         elif request.user.user_type == 3:
@@ -205,33 +279,100 @@ class ClientViewSet(GenericViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ContractView(APIView):
+class ClientBulkViewSet(GenericViewSet):
+    """The update method ensures an authenticated user can update many Client instances at once
+    according to his permissions. The destroy method does the same for deletions.
+
+    The clients are referred to by their "First Last" names, listed under "keys" in the request
+    body. The changes, listed under "changes", are applied to all of them with a single UPDATE.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
+    http_method_names = ["patch", "delete"]
+    updatable_fields = ["email", "phone", "mobile", "company_name", "sales_contact"]
+
+    def get_clients(self, request, action, message):
+        """Resolves all the received names and checks the user can act on each client with
+        one query."""
+        keys = get_keys(request.data)
+        clients = annotate_permission(Client.objects.all(), request.user, action, "allowed")
+        clients = clients.in_bulk_by_name(keys)
+        check_found(keys, clients)
+        check_rows_permission(list(clients.values()), lambda client: client.allowed,
+                              message, name=lambda client: client.full_name)
+        return [client.id for client in clients.values()]
+
+    def update(self, request, *args, **kwargs):
+        """Managers can update any clients. Salesmen can only update their clients and cannot
+        change the sales_contact field. Support team members cannot modify clients."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Only managers and salesmen can update clients")
+        changes = get_changes(request.data, self.updatable_fields)
+        if request.user.user_type == 2 and "sales_contact" in changes:
+            raise PermissionDenied("Salesmen cannot change the sales_contact field")
+        client_ids = self.get_clients(request, CHANGE,
+                                      "Salesmen can only update their own clients.")
+        context = {"users": contacts_by_username([changes], Client, "sales_contact")}
+        serializer = ClientBulkSerializer(data=changes, partial=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        updated = Client.objects.filter(pk__in=client_ids).update(date_updated=timezone.now(),
+                                                                  **serializer.validated_data)
+        rows_changed.send(sender=Client)
+        return Response({"updated": updated}, status=status.HTTP_200_OK)
+
+    def destroy(self, request, *args, **kwargs):
+        """Managers can delete any clients. Salesmen can only delete their clients. Support team
+        members cannot delete clients."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Only managers and salesmen can delete clients")
+        client_ids = self.get_clients(request, DELETE, "Salesmen can only delete their clients.")
+        with refresh_rollups_on_commit():
+            Client.objects.filter(pk__in=client_ids).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class ContractView(ConditionalGetMixin, CachedListMixin, ValuesListMixin, GenericAPIView):
     """The get method ensures an authenticated user can access the Contract model according to his
-    permissions."""
+    permissions. The contracts are paginated in the order they were created."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
+    read_from_replica = True
+    cache_models = (Contract, Client, CustomUser)
+    etag_related = ("client",)
 
     def get(self, request, *args, **kwargs):
-        """Any authenticated user has read access to all contracts.
+        """Any authenticated user has read access to all contracts. The contracts are paginated,
+        unless ?stream=jsonl or ?stream=csv is passed, in which case all of them are streamed.
+        They can be filtered by ?signed=<bool>, ?client=<First Last> and ?sales_contact=<username>.
 
         Foreign key relationships are done through pk, in our case the id. However, that
         pk shouldn't be public. Thus, we use the username field to represent the CustomUser
-        related model.
+        related model and the first and last name to represent the Client related model. Both
+        related models are joined in the same query as the contracts.
         """
         contracts = Contract.objects.all()
-        serializer = ContractSerializer(contracts, many=True)
-        for contract in serializer.data:
-            if contract["sales_contact"]:
-                sales_contact = CustomUser.objects.get(id=contract["sales_contact"])
-                contract["sales_contact"] = sales_contact.username
-            client = Client.objects.get(id=contract["client"])
-            contract["client"] = f"{client.first_name} {client.last_name}"
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        contracts = scoped_queryset(request.user, Contract, VIEW, contracts)
+        contracts = filter_queryset(request, contracts, ContractFilterSerializer)
+        fields = get_requested_fields(request, ContractReadSerializer)
+        stream_format = get_stream_format(request)
+        if stream_format:
+            return stream_response(contracts.order_by("date_created", "id"), ContractReadSerializer,
+                                   stream_format, "contracts", {"fields": fields})
+        not_modified = self.get_not_modified_response(request, contracts)
+        if not_modified:
+            return not_modified
+
+        def build_response():
+            serializer = ContractReadSerializer(context={"fields": fields})
+            return self.get_values_response(contracts, serializer)
+        return self.get_cached_response(request, Contract, build_response)
 
 
 class CreateContractView(CreateAPIView):
     """The create method ensures an authenticated user can create a Contract instance according to his
     permissions"""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
     serializer_class = ContractSerializer
     http_method_names = ["post"]
 
@@ -241,7 +382,10 @@ class CreateContractView(CreateAPIView):
 
         Foreign key relationships are done through pk, in our case the id. However, that
         pk shouldn't be public. Thus, we use the first name and last name fields to query
-        the client instance related to the created contract."""
+        the client instance related to the created contract. A list of contracts can be sent
+        instead of a single one."""
+        if isinstance(request.data, list):
+            return self.create_many(request)
         if request.user.user_type in [1, 2]:
             serializer = self.get_serializer(data=request.data)
             first_name, last_name = request.data["client"].split(" ")
@@ -263,6 +407,33 @@ class CreateContractView(CreateAPIView):
         elif request.user.user_type == 3:
             raise PermissionDenied("Only managers and salesmen can create contracts.")
 
+    def create_many(self, request):
+        """Creates all the received contracts in a single transaction, or none of them if any is
+        invalid. The clients and the sales contacts are resolved with one query per kind of key
+        for the whole list."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Only managers and salesmen can create contracts.")
+        rows = get_rows(request.data)
+        clients = clients_by_name(collect_keys(rows, "client"))
+        if request.user.user_type == 2:
+            def is_allowed(row):
+                client = resolve(row, "client", clients)
+                return client is None or client.sales_contact_id == request.user.id
+            check_rows_permission(rows, is_allowed,
+                                  "Salesmen can create contracts only for their clients.")
+        context = {"users": contacts_by_username(rows, Contract, "sales_contact"),
+                   "clients": clients}
+        serializer = ContractBulkSerializer(data=rows, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            contracts = serializer.save()
+            rows_changed.send(sender=Contract)
+            # bulk_create doesn't send the post_save signal updating the rollups.
+            schedule_rollup_refresh(
+                client_ids={contract.client_id for contract in contracts},
+                salesman_ids={contract.sales_contact_id for contract in contracts})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 class ContractViewSet(GenericViewSet):
     """The update method ensures an authenticated user can update a Contract instance according to his
@@ -275,22 +446,25 @@ class ContractViewSet(GenericViewSet):
     to query the CustomUser related to the updated contract.
     """
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 12
     serializer_class = ContractSerializer
     http_method_names = ["put", "delete"]
 
     def update(self, request, *args, **kwargs):
         contract_title = kwargs["contract_title"]
-        contract = Contract.objects.get(title=contract_title)
+        # the sales contact is compared with the one received.
+        contract = Contract.objects.select_related("sales_contact").get(title=contract_title)
 
         if request.user.user_type in [1, 2]:
             """Managers have edit access to all contracts. Salesmen can only modify their clients'
              contracts. And salesmen cannot change the sales_contact field. Support team members 
              cannot modify contracts."""
-            salesman_clients = Client.objects.filter(sales_contact=request.user.id)
-            if request.user.user_type == 2 and contract.client not in salesman_clients:
+            if not has_object_permission(request.user, CHANGE, contract):
                 raise PermissionDenied("Salesmen can edit only their clients' contracts.")
 
-            if request.user.user_type == 2 and request.data["sales_contact"] != contract.sales_contact:
+            sales_contact = contract.sales_contact
+            current_username = sales_contact.username if sales_contact else None
+            if request.user.user_type == 2 and request.data["sales_contact"] != current_username:
                 raise PermissionDenied("Salesmen cannot change the sales_contact field")
 
             serializer = self.serializer_class(contract,
@@ -324,8 +498,7 @@ class ContractViewSet(GenericViewSet):
         contract_title = kwargs["contract_title"]
         contract = Contract.objects.get(title=contract_title)
         if request.user.user_type in [1, 2]:
-            salesman_clients = Client.objects.filter(sales_contact=request.user.id)
-            if request.user.user_type == 2 and contract.client not in salesman_clients:
+            if not has_object_permission(request.user, DELETE, contract):
                 raise PermissionDenied("Salesmen can delete only their clients' contracts.")
             contract.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
@@ -333,29 +506,135 @@ class ContractViewSet(GenericViewSet):
             raise PermissionDenied("Only managers and salesmen can delete contracts.")
 
 
-class EventView(APIView):
+class ContractBulkViewSet(GenericViewSet):
+    """The update method ensures an authenticated user can update many Contract instances at once
+    according to his permissions. The destroy method does the same for deletions.
+
+    The contracts are referred to by their titles, listed under "keys" in the request body. The
+    changes, listed under "changes", are applied to all of them with a single UPDATE.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
+    http_method_names = ["patch", "delete"]
+    updatable_fields = ["signed", "amount", "payment_due", "sales_contact", "client"]
+    # the fields the rollups of the clients and salesmen depend on.
+    rollup_fields = {"amount", "payment_due", "sales_contact", "client"}
+
+    def get_contracts(self, request, action, message):
+        """Resolves all the received titles and checks the user can act on each contract with
+        one query."""
+        keys = get_keys(request.data)
+        contracts = annotate_permission(Contract.objects.filter(title__in=keys),
+                                        request.user, action, "allowed")
+        contracts = {contract["title"]: contract
+                     for contract in contracts.values("id", "title", "allowed")}
+        check_found(keys, contracts)
+        check_rows_permission(list(contracts.values()), lambda contract: contract["allowed"],
+                              message, name=lambda contract: contract["title"])
+        return [contract["id"] for contract in contracts.values()]
+
+    def update(self, request, *args, **kwargs):
+        """Managers can update any contracts. Salesmen can only update their clients' contracts
+        and cannot change the sales_contact field. Support team members cannot modify
+        contracts. The payment due cannot be superior to the amount of any updated contract.
+        When the client of the contracts changes, the status of the clients concerned is
+        updated."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Only managers and salesmen can edit contracts")
+        changes = get_changes(request.data, self.updatable_fields)
+        if request.user.user_type == 2 and "sales_contact" in changes:
+            raise PermissionDenied("Salesmen cannot change the sales_contact field")
+        contract_ids = self.get_contracts(request, CHANGE,
+                                          "Salesmen can edit only their clients' contracts.")
+        context = {"users": contacts_by_username([changes], Contract, "sales_contact"),
+                   "clients": clients_by_name(collect_keys([changes], "client"))}
+        serializer = ContractBulkSerializer(data=changes, partial=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        if (request.user.user_type == 2 and "client" in validated_data
+                and validated_data["client"].sales_contact_id != request.user.id):
+            raise PermissionDenied("Salesmen can only assign contracts to their clients.")
+
+        contracts = Contract.objects.filter(pk__in=contract_ids)
+        if "amount" in validated_data or "payment_due" in validated_data:
+            # the check made by Contract.clean is run against every contract in one query.
+            new_amount = F("amount")
+            if "amount" in validated_data:
+                new_amount = Value(validated_data["amount"], output_field=FloatField())
+            new_payment_due = F("payment_due")
+            if "payment_due" in validated_data:
+                new_payment_due = Value(validated_data["payment_due"], output_field=FloatField())
+            overdue = contracts.alias(new_amount=new_amount, new_payment_due=new_payment_due)
+            if overdue.filter(new_payment_due__gt=F("new_amount")).exists():
+                raise ValidationError("The payment due cannot be superior to the total amount.")
+        with transaction.atomic():
+            if self.rollup_fields.intersection(validated_data):
+                # the rollups of the previous clients and salesmen are refreshed as well.
+                previous = list(contracts.values_list("client_id", "sales_contact_id"))
+                schedule_rollup_refresh(
+                    client_ids={client_id for client_id, _ in previous},
+                    salesman_ids={salesman_id for _, salesman_id in previous})
+            updated = contracts.update(date_updated=timezone.now(), **validated_data)
+            rows_changed.send(sender=Contract)
+            if "client" in validated_data:
+                schedule_rollup_refresh(client_ids=[validated_data["client"].pk])
+                # the events move along with the contracts, and update doesn't send the
+                # post_save signal.
+                schedule_client_status_refresh(
+                    client_ids={client_id for client_id, _ in previous}
+                    | {validated_data["client"].pk})
+            if validated_data.get("sales_contact") is not None:
+                schedule_rollup_refresh(salesman_ids=[validated_data["sales_contact"].pk])
+        return Response({"updated": updated}, status=status.HTTP_200_OK)
+
+    def destroy(self, request, *args, **kwargs):
+        """Managers can delete any contracts. Salesmen can only delete their clients' contracts.
+        Support team members cannot delete contracts. The status of the clients whose events
+        are deleted along with the contracts is updated by the post_delete signal."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Only managers and salesmen can delete contracts.")
+        contract_ids = self.get_contracts(request, DELETE,
+                                          "Salesmen can delete only their clients' contracts.")
+        with refresh_rollups_on_commit():
+            Contract.objects.filter(pk__in=contract_ids).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class EventView(ConditionalGetMixin, CachedListMixin, ValuesListMixin, GenericAPIView):
     """The get method ensures an authenticated user can access the Event model according to his
-    permissions.
+    permissions. The events are paginated in the order they were created.
 
     Foreign key relationships are done through pk, in our case the id. However, that
-    pk shouldn't be public. Thus, we use the username field to query the CustomUser related to the
-    requested event. Similarly, we use the title to query the Contract related to the requested event."""
+    pk shouldn't be public. Thus, we use the username field to represent the CustomUser related to the
+    requested event. Similarly, we use the title to represent the Contract related to the requested
+    event. Both related models are joined in the same query as the events."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 6
+    read_from_replica = True
+    cache_models = (Event, Contract, CustomUser)
+    etag_related = ("contract",)
 
     def get(self, request, *args, **kwargs):
-        """Any authenticated user has read access to all events."""
+        """Any authenticated user has read access to all events. The events are paginated, unless
+        ?stream=jsonl or ?stream=csv is passed, in which case all of them are streamed. They can
+        be filtered by ?event_date_after=<datetime>, ?event_date_before=<datetime>,
+        ?status=<bool>, ?support_contact=<username> and ?contract=<title>."""
         events = Event.objects.all()
-        serializer = EventSerializer(events, many=True)
-        for event in serializer.data:
-            if event["support_contact"]:
-                support_contact_id = event["support_contact"]
-                support_contact = CustomUser.objects.get(id=support_contact_id)
-                event["support_contact"] = support_contact.username
-
-            contract_id = event["contract"]
-            contract = Contract.objects.get(id=contract_id)
-            event["contract"] = contract.title
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        events = scoped_queryset(request.user, Event, VIEW, events)
+        events = filter_queryset(request, events, EventFilterSerializer)
+        fields = get_requested_fields(request, EventReadSerializer)
+        stream_format = get_stream_format(request)
+        if stream_format:
+            return stream_response(events.order_by("date_created", "id"), EventReadSerializer,
+                                   stream_format, "events", {"fields": fields})
+        not_modified = self.get_not_modified_response(request, events)
+        if not_modified:
+            return not_modified
+
+        def build_response():
+            serializer = EventReadSerializer(context={"fields": fields})
+            return self.get_values_response(events, serializer)
+        return self.get_cached_response(request, Event, build_response)
 
 
 class CreateEventView(CreateAPIView):
@@ -366,12 +645,16 @@ class CreateEventView(CreateAPIView):
     pk shouldn't be public. Thus, we use the username field to query the CustomUser related to the
     created event. Similarly, we use the title to query the Contract related to the created event."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
     serializer_class = EventSerializer
     http_method_names = ["post"]
 
     def create(self, request, *args, **kwargs):
         """Only managers and salesmen can create events.
-        Salesmen can only create events for their clients."""
+        Salesmen can only create events for their clients.
+        A list of events can be sent instead of a single one."""
+        if isinstance(request.data, list):
+            return self.create_many(request)
         if request.user.user_type in [1, 2]:
             serializer = self.get_serializer(data=request.data)
             contract_title = request.data["contract"]
@@ -391,6 +674,33 @@ class CreateEventView(CreateAPIView):
         elif request.user.user_type == 3:
             raise PermissionDenied("Only managers and salesmen can create events.")
 
+    def create_many(self, request):
+        """Creates all the received events in a single transaction, or none of them if any is
+        invalid. The contracts and the support contacts are resolved with one query per kind
+        of key for the whole list. The status of the clients concerned by the new events is
+        then updated with a single query once the transaction is committed."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Only managers and salesmen can create events.")
+        rows = get_rows(request.data)
+        contracts = contracts_by_title(collect_keys(rows, "contract"))
+        if request.user.user_type == 2:
+            def is_allowed(row):
+                contract = resolve(row, "contract", contracts)
+                return contract is None or contract.sales_contact_id == request.user.id
+            check_rows_permission(rows, is_allowed,
+                                  "Salesmen can only create events for their clients.")
+        context = {"users": contacts_by_username(rows, Event, "support_contact"),
+                   "contracts": contracts}
+        serializer = EventBulkSerializer(data=rows, many=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            events = serializer.save()
+            rows_changed.send(sender=Event)
+            # bulk_create doesn't send the post_save signal.
+            schedule_client_status_refresh(contract_ids={event.contract_id for event in events})
+            schedule_rollup_refresh(contract_ids={event.contract_id for event in events})
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
 
 class EventViewSet(GenericViewSet):
     """The update method ensures an authenticated user can update an Event instance according to his
@@ -401,6 +711,7 @@ class EventViewSet(GenericViewSet):
     pk shouldn't be public. Thus, we use the username field to query the CustomUser related to the
     updated event. Similarly, we use the title to query the Contract related to the updated event."""
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 12
     serializer_class = EventSerializer
     http_method_names = ["put", "delete"]
 
@@ -411,7 +722,7 @@ class EventViewSet(GenericViewSet):
         event = Event.objects.get(title=event_title)
 
         if request.user.user_type in [1, 2]:
-            if request.user.user_type == 2 and event.contract.sales_contact != request.user:
+            if not has_object_permission(request.user, CHANGE, event):
                 raise PermissionDenied("Salesmen can only edit their client's event.")
 
             serializer = self.serializer_class(event,
@@ -427,10 +738,9 @@ class EventViewSet(GenericViewSet):
             serializer.save()
             return Response(serializer.data, status=status.HTTP_200_OK)
         elif request.user.user_type == 3:
-            if event.support_contact != request.user:
-                raise PermissionDenied("Support team members can only edit their events")
-            if event.event_date < timezone.now():
-                raise PermissionDenied("You cannot edit events after they happen")
+            if not has_object_permission(request.user, CHANGE, event):
+                raise PermissionDenied("Support team members can only edit their events until "
+                                       "they happen")
             serializer = self.serializer_class(event,
                                                data=request.data)
             contract_title = serializer.initial_data["contract"]
@@ -452,9 +762,135 @@ class EventViewSet(GenericViewSet):
             event.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         elif request.user.user_type == 2:
-            if event.contract.sales_contact == request.user:
+            if has_object_permission(request.user, DELETE, event):
                 event.delete()
                 return Response(status=status.HTTP_204_NO_CONTENT)
             raise PermissionDenied("Salesmen can only delete their clients' events.")
         elif request.user.user_type == 3:
             raise PermissionDenied("Support team member can only delete their clients' events.")
+
+
+class EventBulkViewSet(GenericViewSet):
+    """The update method ensures an authenticated user can update many Event instances at once
+    according to his permissions. The destroy method does the same for deletions.
+
+    The events are referred to by their titles, listed under "keys" in the request body. The
+    changes, listed under "changes", are applied to all of them with a single UPDATE. For
+    instance, all the events of a support team member can be reassigned in one request.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 10
+    http_method_names = ["patch", "delete"]
+    updatable_fields = ["attendees", "event_date", "notes", "support_contact", "contract"]
+
+    def get_events(self, request, action, message):
+        """Resolves all the received titles and checks the user can act on each event with
+        one query."""
+        keys = get_keys(request.data)
+        events = annotate_permission(Event.objects.filter(title__in=keys),
+                                     request.user, action, "allowed")
+        events = {event["title"]: event
+                  for event in events.values("id", "title", "contract__client_id", "allowed")}
+        check_found(keys, events)
+        check_rows_permission(list(events.values()), lambda event: event["allowed"], message,
+                              name=lambda event: event["title"])
+        return list(events.values())
+
+    def update(self, request, *args, **kwargs):
+        """Managers can update all events. Salesmen can only update their clients' events.
+        Similarly, support team member can only update events they are assigned to until they
+        happen. When the date or the contract of the events change, the status of the clients
+        concerned is updated."""
+        user = request.user
+        now = timezone.now()
+        events = self.get_events(request, CHANGE,
+                                 "Salesmen can only edit their client's events and support team "
+                                 "members can only edit their events until they happen.")
+
+        changes = get_changes(request.data, self.updatable_fields)
+        context = {"users": contacts_by_username([changes], Event, "support_contact"),
+                   "contracts": contracts_by_title(collect_keys([changes], "contract"))}
+        serializer = EventBulkSerializer(data=changes, partial=True, context=context)
+        serializer.is_valid(raise_exception=True)
+        validated_data = dict(serializer.validated_data)
+        if (user.user_type == 2 and "contract" in validated_data
+                and validated_data["contract"].sales_contact_id != user.id):
+            raise PermissionDenied("Salesmen can only assign events to their contracts.")
+        if "event_date" in validated_data:
+            validated_data["status"] = validated_data["event_date"] < now
+
+        with transaction.atomic():
+            updated = Event.objects.filter(pk__in=[event["id"] for event in events]).update(
+                date_updated=now, **validated_data)
+            rows_changed.send(sender=Event)
+            if "event_date" in validated_data or "contract" in validated_data:
+                client_ids = {event["contract__client_id"] for event in events}
+                if "contract" in validated_data:
+                    client_ids.add(validated_data["contract"].client_id)
+                # update doesn't send the post_save signal.
+                schedule_client_status_refresh(client_ids=client_ids)
+                schedule_rollup_refresh(client_ids=client_ids)
+        return Response({"updated": updated}, status=status.HTTP_200_OK)
+
+    def destroy(self, request, *args, **kwargs):
+        """Managers can delete all events. Salesmen can only delete their clients' events.
+        However, support team member cannot delete events. The status of the clients concerned
+        is updated by the post_delete signal."""
+        if request.user.user_type == 3:
+            raise PermissionDenied("Support team member can only delete their clients' events.")
+        events = self.get_events(request, DELETE, "Salesmen can only delete their clients' events.")
+        with refresh_rollups_on_commit():
+            Event.objects.filter(pk__in=[event["id"] for event in events]).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SearchView(GenericAPIView):
+    """The get method searches the clients, contracts and events an authenticated user can view,
+    see search.py. The results are ranked, the best first, and paginated."""
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SearchPagination
+    query_budget = 6
+    read_from_replica = True
+
+    def get(self, request, *args, **kwargs):
+        """The words to look for are passed as ?q=<words>. The search can be restricted to a
+        single model with ?type=client, ?type=contract or ?type=event. Each result holds its
+        type, its key, i.e. the "First Last" name of a client or the title of a contract or
+        an event, a detail telling it apart and its rank."""
+        params = SearchParamsSerializer(data=request.query_params.dict())
+        params.is_valid(raise_exception=True)
+        query = params.validated_data["q"]
+        result_type = params.validated_data.get("type")
+        result_types = [result_type] if result_type else None
+
+        def build_queryset(position):
+            return search(request.user, query, result_types, position)
+        rows = self.paginator.paginate_rows(
+            self.paginator.get_page_queryset(build_queryset, request, self))
+        return self.paginator.get_paginated_response([represent(row) for row in rows])
+
+
+class AnalyticsView(CachedListMixin, GenericAPIView):
+    """The get method returns the revenue, pipeline and support load reports, computed in the
+    database, see analytics.py. Only managers can read them. The responses are cached for
+    API_ANALYTICS_CACHE_TIMEOUT seconds, or until a contract, an event or a user changes."""
+    permission_classes = [permissions.IsAuthenticated]
+    query_budget = 8
+    read_from_replica = True
+    cache_models = (Contract, Event, CustomUser)
+
+    def get_cache_timeout(self):
+        return getattr(settings, "API_ANALYTICS_CACHE_TIMEOUT", 60)
+
+    def get(self, request, *args, **kwargs):
+        """The monthly series covers the last 12 months by default, ?months=<n> sets another
+        number of months."""
+        if request.user.user_type != 1:
+            raise PermissionDenied("Only managers can read the analytics.")
+        params = AnalyticsParamsSerializer(data=request.query_params.dict())
+        params.is_valid(raise_exception=True)
+
+        def build_response():
+            return Response(get_reports(params.validated_data["months"]))
+        return self.get_cached_response(request, Contract, build_response)
+
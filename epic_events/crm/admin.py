@@ -1,20 +1,131 @@
-"""Defines classes controlling the access from the admin site to the models."""
+"""Defines classes controlling the access from the admin site to the models.
+
+The changelists of the clients, contracts and events stay fast on large tables: the related
+rows shown in the columns are fetched by the same query as the rows, the filters use indexed
+columns, and the foreign keys are edited with autocomplete widgets, which fetch the matching
+rows as they're typed instead of listing the whole related table in the page. On Postgres,
+the searches use the full-text indexes of crm/migrations/0003_search_indexes.py and the
+number of rows of an unfiltered changelist is estimated rather than counted."""
 
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import Group
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 
+from epic_events.api.search import SEARCH_FIELDS, full_text_prefix_match
 from .forms import CustomUserCreationForm, CustomUserChangeForm
 from .models import Client, Contract, Event
+from .permissions import CHANGE, annotate_permission, get_filter
+from .permissions import has_object_permission
+
+# below this estimated number of rows, the rows of a changelist are counted exactly.
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+# the annotations holding the permissions of the user on each row fetched by the admin.
+PERMISSION_ANNOTATIONS = {CHANGE: "can_change"}
+
+
+def get_estimated_count(queryset):
+    """Returns the number of rows of the table of queryset estimated by Postgres, as last
+    updated by VACUUM or ANALYZE, or None if the table was never analyzed."""
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass",
+                       [connection.ops.quote_name(queryset.model._meta.db_table)])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginates the changelists. On Postgres, COUNT(*) reads the whole table, so the number of
+    rows of an unfiltered changelist is taken from the statistics of the table when they
+    estimate it above ESTIMATED_COUNT_THRESHOLD. The number of pages is then approximate."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if (hasattr(queryset, "query") and not queryset.query.where
+                and connections[queryset.db].vendor == "postgresql"):
+            estimate = get_estimated_count(queryset)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class CrmModelAdmin(admin.ModelAdmin):
+    """Base class of the admin of the crm models. Their search_fields are those of the model
+    in api/search.py. On Postgres, the rows are searched by word prefixes through the
+    full-text index built on those fields. On the other databases, the lookups of the admin
+    scan the table.
+
+    The admin asks for the permissions of the user on an object many times per request, e.g.
+    to build a change form and its buttons. When they depend on the ownership of the rows,
+    they're annotated on the rows by the query fetching them, and the permission hooks read
+    them through get_object_permission."""
+    paginator = EstimatedCountPaginator
+    # the total number of rows, shown next to the number of filtered rows, would be counted.
+    show_full_result_count = False
+    # the default order of the changelists, given to the autocomplete widgets as well.
+    ordering = ["-pk"]
+
+    # the actions whose permissions are annotated on the rows, see get_object_permission.
+    annotated_actions = (CHANGE,)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        for action in self.annotated_actions:
+            name = PERMISSION_ANNOTATIONS[action]
+            # the rules depending only on the user_type are checked without any query.
+            if get_filter(request.user, self.model, action):
+                queryset = annotate_permission(queryset, request.user, action, name)
+        return queryset
+
+    def get_object_permission(self, request, action, obj):
+        """Returns whether the user can act on obj, as annotated on it by get_queryset. An
+        object fetched otherwise is checked with one query, made once per request."""
+        allowed = getattr(obj, PERMISSION_ANNOTATIONS[action], None)
+        if allowed is not None:
+            return allowed
+        checked = request.__dict__.setdefault("_object_permissions", {})
+        key = (type(obj), obj.pk, action)
+        if key not in checked:
+            checked[key] = has_object_permission(request.user, action, obj)
+        return checked[key]
+
+    def get_search_results(self, request, queryset, search_term):
+        if connections[queryset.db].vendor == "postgresql":
+            matches = full_text_prefix_match(queryset, self.get_search_fields(request),
+                                             search_term)
+            if matches is not None:
+                return matches, False
+        return super().get_search_results(request, queryset, search_term)
+
+
+def rollup_display(relation, name, description):
+    """Returns a changelist column showing the total name of the rollup the row points to
+    through relation, which the changelist should select_related. The column is empty when
+    the row has no rollup."""
+    @admin.display(description=description, ordering=f"{relation}__{name}")
+    def display(self, obj):
+        rollup = getattr(obj, relation, None)
+        return getattr(rollup, name, None)
+    return display
 
 
 class CustomUserAdmin(UserAdmin):
     """Controls how the User model is accessed in the admin site."""
+    query_budget = 10
     form = CustomUserChangeForm
     add_form = CustomUserCreationForm
 
-    list_display = ["email", "username", "user_type"]
+    list_display = ["email", "username", "user_type", "contract_count", "total_amount",
+                    "total_payment_due"]
+    list_select_related = ["salesman_rollup"]
     fieldsets = (
         (None, {"fields": ("username",
                            'user_type',)}),
@@ -37,6 +148,10 @@ class CustomUserAdmin(UserAdmin):
     )
 
     # for the has_wiew_permission, we can keep the default
+    contract_count = rollup_display("salesman_rollup", "contract_count", "contracts")
+    total_amount = rollup_display("salesman_rollup", "total_amount", "total amount")
+    total_payment_due = rollup_display("salesman_rollup", "total_payment_due", "payment due")
+
     def has_add_permission(self, request, *args):
         """Only managers can add new users.
         """
@@ -59,10 +174,23 @@ class CustomUserAdmin(UserAdmin):
         return False
 
 
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(CrmModelAdmin):
     """Controls how the Client model is accessed in the admin site."""
+    query_budget = 10
     model = Client
     readonly_fields = ["client_status"]
+    search_fields = SEARCH_FIELDS["client"][1]
+    autocomplete_fields = ["sales_contact"]
+    list_display = ["__str__", "sales_contact", "client_status", "contract_count",
+                    "total_amount", "total_payment_due", "upcoming_event_count",
+                    "past_event_count"]
+    list_select_related = ["sales_contact", "rollup"]
+
+    contract_count = rollup_display("rollup", "contract_count", "contracts")
+    total_amount = rollup_display("rollup", "total_amount", "total amount")
+    total_payment_due = rollup_display("rollup", "total_payment_due", "payment due")
+    upcoming_event_count = rollup_display("rollup", "upcoming_event_count", "upcoming events")
+    past_event_count = rollup_display("rollup", "past_event_count", "past events")
 
     def get_form(self, request, obj=None, *args, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -72,7 +200,7 @@ class ClientAdmin(admin.ModelAdmin):
             # if he's not the assigned sale contact, he doesn't have access to
             # the sales contact field, so Django would complain if we try to
             # modify it.
-            if obj.sales_contact == request.user:
+            elif obj.sales_contact_id == request.user.pk:
                 form.base_fields["sales_contact"].disabled = True
         return form
 
@@ -91,9 +219,7 @@ class ClientAdmin(admin.ModelAdmin):
         if request.user.user_type == 1:
             return True
         if obj is not None:
-            owner = obj.sales_contact
-            if owner == request.user:
-                return True
+            return self.get_object_permission(request, CHANGE, obj)
         return False
 
     def has_delete_permission(self, request, *args):
@@ -104,10 +230,18 @@ class ClientAdmin(admin.ModelAdmin):
         return False
 
 
-class EventAdmin(admin.ModelAdmin):
+class EventAdmin(CrmModelAdmin):
     """Controls how the Event model is accessed in the admin site."""
+    query_budget = 10
     model = Event
     readonly_fields = ["status"]
+    search_fields = SEARCH_FIELDS["event"][1]
+    list_display = ["title", "contract", "support_contact", "event_date", "status",
+                    "attendees"]
+    list_select_related = ["contract", "support_contact"]
+    # both are indexed, see event_status_date_idx and event_date_idx.
+    list_filter = ["status", "event_date"]
+    autocomplete_fields = ["contract", "support_contact"]
 
     def formfield_for_dbfield(self, db_field, request, **kwargs):
         """If a sales team member tries to create an event, he should base
@@ -122,8 +256,9 @@ class EventAdmin(admin.ModelAdmin):
         if request.user.user_type == 3:
             # if he's not the assigned support member, he doesn't have access to
             # the support contact field, so Django would complain if we try to
-            # modify it.
-            if obj.support_contact == request.user:
+            # modify it. Once the event happened, the form is read-only and has no fields.
+            if (obj is not None and obj.support_contact_id == request.user.pk
+                    and "support_contact" in form.base_fields):
                 form.base_fields["support_contact"].disabled = True
         return form
 
@@ -136,22 +271,18 @@ class EventAdmin(admin.ModelAdmin):
         return False
 
     def has_change_permission(self, request, obj=None):
-        """Only managers and the assigned member of the
+        """Only managers, the member of the sales team in
+        charge of the contract and the assigned member of the
         support team can change events (until the event
         happens).
         """
         if request.user.user_type == 1:
             return True
-        if obj is not None:
-            owner = obj.support_contact
-            in_charge_sales_member = obj.contract.sales_contact
-            # if status is set to True, then the event happened
-            # and the assigned support member cannot change the
-            # event anymore.
-            if owner == request.user and not obj.status:
-                return True
-            if in_charge_sales_member == request.user and not obj.status:
-                return True
+        # if status is set to True, then the event happened
+        # and the assigned members cannot change the event
+        # anymore.
+        if obj is not None and not obj.status:
+            return self.get_object_permission(request, CHANGE, obj)
         return False
 
     def has_delete_permission(self, request, *args):
@@ -162,9 +293,29 @@ class EventAdmin(admin.ModelAdmin):
         return False
 
 
-class ContractAdmin(admin.ModelAdmin):
+class ContractAdmin(CrmModelAdmin):
     """Controls how the Contract model is accessed in the admin site."""
+    query_budget = 10
     model = Contract
+    search_fields = SEARCH_FIELDS["contract"][1]
+    list_display = ["title", "client", "sales_contact", "signed", "amount", "payment_due",
+                    "date_created"]
+    list_select_related = ["client", "sales_contact"]
+    # indexed, see contract_signed_created_idx.
+    list_filter = ["signed"]
+    autocomplete_fields = ["client", "sales_contact"]
+    # the change permission depends on the sales contact of the contract only.
+    annotated_actions = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        """The contracts proposed to a salesman by the autocomplete widget of the contract of
+        an event are restricted to their own, as in EventAdmin.formfield_for_dbfield."""
+        queryset, may_have_duplicates = super().get_search_results(request, queryset,
+                                                                   search_term)
+        if (request.user.user_type == 2 and request.resolver_match.url_name == "autocomplete"
+                and request.GET.get("model_name") == "event"):
+            queryset = queryset.filter(sales_contact=request.user)
+        return queryset, may_have_duplicates
 
     def get_form(self, request, obj=None, **kwargs):
         form = super().get_form(request, obj, **kwargs)
@@ -174,7 +325,7 @@ class ContractAdmin(admin.ModelAdmin):
             # if he's not the assigned sale member, he doesn't have access to
             # the sales contact field, so Django would complain if we try to
             # modify it.
-            if obj.sales_contact == request.user:
+            elif obj.sales_contact_id == request.user.pk:
                 form.base_fields["sales_contact"].disabled = True
         return form
 
@@ -187,16 +338,14 @@ class ContractAdmin(admin.ModelAdmin):
         return False
 
     def has_change_permission(self, request, obj=None):
-        """Only managers and the member of the assigned member
-        of the sales team can change contracts.
+        """Only managers and the member of the sales team who
+        signed the contract can change contracts. Unlike the API,
+        see crm/permissions.py, the admin lets them change a contract
+        signed for the client of another salesman.
         """
         if request.user.user_type == 1:
             return True
-        if obj is not None:
-            owner = obj.sales_contact
-            if owner == request.user:
-                return True
-        return False
+        return obj is not None and obj.sales_contact_id == request.user.pk
 
     def has_delete_permission(self, request, *args):
         """Only managers can delete other admins.
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'epic_events.crm'
+
+    def ready(self):
+        # connects the receivers maintaining the rollup tables.
+        from . import rollups  # noqa: F401
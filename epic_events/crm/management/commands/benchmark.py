@@ -0,0 +1,343 @@
+"""Defines the benchmark command, which measures every route of api/urls.py, the /metrics
+endpoint and the changelists of the admin site against a generated data set:
+
+    python manage.py benchmark --clients 5000 --contracts 10000 --events 10000
+    python manage.py benchmark --save
+
+The command creates a test database, the way the test runner does, so it runs on SQLite as
+well as on a local Postgres and never touches the data in use. The endpoints are requested
+in-process through the Django test client. For each of them, the wall time, the number of SQL
+queries and the peak memory allocated by Python, traced with tracemalloc, are recorded. The
+list cache is cleared before each request, unless the endpoint is meant to hit it.
+
+The measures are compared with the baseline stored in benchmark_baseline.json, or written to
+it with --save. The command fails when an endpoint makes more queries than in the baseline, the
+only measure that doesn't depend on the machine or its load. The time and memory are reported
+next to the baseline ones, with a warning when they exceed them beyond the tolerance, provided
+the baseline was recorded with the same database vendor and volumes. They never fail the
+command."""
+
+
+import json
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import timedelta
+from pathlib import Path
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+
+from epic_events.crm.models import Client, Contract, CustomUser, Event
+from epic_events.crm.rollups import refresh_client_rollups, refresh_salesman_rollups
+
+DEFAULT_BASELINE = Path(__file__).with_name("benchmark_baseline.json")
+
+BULK_SIZE = 100
+
+Endpoint = namedtuple("Endpoint", ["name", "method", "path", "data", "user", "repeatable",
+                                   "cached"])
+
+
+def endpoint(name, method, path, data=None, user="manager", repeatable=None, cached=False):
+    """Describes a request to measure. Only the GET requests are repeated by default, as the
+    other ones change the data."""
+    if repeatable is None:
+        repeatable = method == "get"
+    return Endpoint(name, method, path, data, user, repeatable, cached)
+
+
+def bench_names(prefix, count):
+    return [f"{prefix}{i}" for i in range(count)]
+
+
+def get_endpoints():
+    """Lists the requests made by the benchmark, in order. The write requests create their own
+    rows, then update and delete them, so the generated data set stays the same."""
+    now = timezone.now()
+    clients = [{"first_name": "Bench", "last_name": name, "email": f"{name}@bench.com",
+                "company_name": "Bench", "sales_contact": "salesman0"}
+               for name in bench_names("Client", BULK_SIZE)]
+    client_names = [f"Bench {client['last_name']}" for client in clients]
+    contracts = [{"title": title, "signed": True, "amount": 1000, "payment_due": 100,
+                  "sales_contact": "salesman0", "client": name}
+                 for title, name in zip(bench_names("BenchContract", BULK_SIZE), client_names)]
+    contract_titles = [contract["title"] for contract in contracts]
+    event_date = (now + timedelta(days=30)).isoformat()
+    events = [{"title": title, "attendees": 10, "event_date": event_date, "notes": "",
+               "support_contact": "support0", "contract": contract}
+              for title, contract in zip(bench_names("BenchEvent", BULK_SIZE), contract_titles)]
+    event_titles = [event["title"] for event in events]
+    return [
+        endpoint("users list", "get", "/api/users/view"),
+        endpoint("users csv stream", "get", "/api/users/view?stream=csv"),
+        endpoint("clients list", "get", "/api/client/view"),
+        endpoint("clients list, salesman", "get", "/api/client/view", user="salesman0"),
+        endpoint("clients jsonl stream", "get", "/api/client/view?stream=jsonl"),
+        endpoint("contracts list", "get", "/api/contract/view"),
+        endpoint("contracts list, filtered", "get", "/api/contract/view?signed=true"),
+        endpoint("contracts csv stream", "get", "/api/contract/view?stream=csv"),
+        endpoint("events list", "get", "/api/event/view"),
+        endpoint("events list, cached", "get", "/api/event/view", cached=True),
+        endpoint("events list, sparse", "get", "/api/event/view?fields=title,event_date"),
+        endpoint("events list, max page", "get",
+                 f"/api/event/view?page_size={settings.API_MAX_PAGE_SIZE}"),
+        endpoint("events jsonl stream", "get", "/api/event/view?stream=jsonl"),
+        endpoint("async clients list", "get", "/api/async/client/view"),
+        endpoint("async contracts list", "get", "/api/async/contract/view"),
+        endpoint("async events list", "get", "/api/async/event/view"),
+        endpoint("async events jsonl stream", "get", "/api/async/event/view?stream=jsonl"),
+        endpoint("search", "get", "/api/search?q=Company1"),
+        endpoint("search, salesman", "get", "/api/search?q=Company1", user="salesman0"),
+        endpoint("analytics", "get", "/api/analytics"),
+        endpoint("analytics, cached", "get", "/api/analytics", cached=True),
+        endpoint("user create", "post", "/api/users/create",
+                 {"username": "benchuser", "first_name": "Bench", "last_name": "User",
+                  "email": "user@bench.com", "user_type": 2}),
+        endpoint("user update", "put", "/api/users/benchuser/", {"first_name": "Benched"}),
+        endpoint("client create", "post", "/api/client/create",
+                 {"first_name": "Bench", "last_name": "Single", "email": "single@bench.com",
+                  "company_name": "Bench", "sales_contact": "salesman0"}),
+        endpoint("clients bulk create", "post", "/api/client/create", clients),
+        endpoint("client update", "put", "/api/client/Bench/Single/",
+                 {"company_name": "Benched", "sales_contact": "salesman0"}),
+        endpoint("clients bulk update", "patch", "/api/client/bulk",
+                 {"keys": client_names, "changes": {"company_name": "Benched"}}),
+        endpoint("contract create", "post", "/api/contract/create",
+                 {"title": "BenchSingle", "signed": False, "amount": 1000, "payment_due": 100,
+                  "sales_contact": "salesman0", "client": "Bench Single"}),
+        endpoint("contracts bulk create", "post", "/api/contract/create", contracts),
+        endpoint("contract update", "put", "/api/contract/BenchSingle/",
+                 {"title": "BenchSingle", "signed": True, "sales_contact": "salesman0",
+                  "client": "Bench Single"}),
+        endpoint("contracts bulk update", "patch", "/api/contract/bulk",
+                 {"keys": contract_titles, "changes": {"signed": False}}),
+        endpoint("event create", "post", "/api/event/create",
+                 {"title": "BenchSingle", "attendees": 10, "event_date": event_date,
+                  "notes": "", "support_contact": "support0", "contract": "BenchSingle"}),
+        endpoint("events bulk create", "post", "/api/event/create", events),
+        endpoint("event update", "put", "/api/event/BenchSingle/",
+                 {"attendees": 20, "support_contact": "support0", "contract": "BenchSingle"}),
+        endpoint("events bulk update", "patch", "/api/event/bulk",
+                 {"keys": event_titles, "changes": {"support_contact": "support1"}}),
+        endpoint("event delete", "delete", "/api/event/BenchSingle/"),
+        endpoint("events bulk delete", "delete", "/api/event/bulk", {"keys": event_titles}),
+        endpoint("contract delete", "delete", "/api/contract/BenchSingle/"),
+        endpoint("contracts bulk delete", "delete", "/api/contract/bulk",
+                 {"keys": contract_titles}),
+        endpoint("client delete", "delete", "/api/client/Bench/Single/"),
+        endpoint("clients bulk delete", "delete", "/api/client/bulk", {"keys": client_names}),
+        endpoint("user delete", "delete", "/api/users/benchuser/"),
+    ] + [
+        endpoint(f"admin {model._meta.model_name} changelist", "get",
+                 reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist"))
+        for model in (CustomUser, Client, Contract, Event)
+    ] + [
+        endpoint("metrics", "get", "/metrics"),
+    ]
+
+
+def consume(response):
+    """Reads the whole content of a streamed response, which the async views produce with an
+    asynchronous iterator."""
+    if not response.is_async:
+        for _chunk in response.streaming_content:
+            pass
+        return
+
+    async def consume_async():
+        async for _chunk in response.streaming_content:
+            pass
+    async_to_sync(consume_async)()
+
+
+def seed(clients, contracts, events, salesmen, support):
+    """Creates the users, then the given number of clients, contracts and events with a few
+    bulk inserts. The contracts are spread over the clients and the events over the
+    contracts. Half of the events are past, the other half upcoming."""
+    now = timezone.now()
+    password = make_password("benchmark")
+    users = [CustomUser(username="manager", first_name="Bench", last_name="Manager",
+                        email="manager@bench.com", user_type=1, is_staff=True, is_superuser=True,
+                        password=password)]
+    users += [CustomUser(username=username, first_name="Bench", last_name="Salesman",
+                         email=f"{username}@bench.com", user_type=2, is_staff=True,
+                         password=password)
+              for username in bench_names("salesman", salesmen)]
+    users += [CustomUser(username=username, first_name="Bench", last_name="Support",
+                         email=f"{username}@bench.com", user_type=3, is_staff=True,
+                         password=password)
+              for username in bench_names("support", support)]
+    users = CustomUser.objects.bulk_create(users)
+    salesmen_users = [user for user in users if user.user_type == 2]
+    support_users = [user for user in users if user.user_type == 3]
+
+    client_rows = Client.objects.bulk_create(
+        Client(first_name=f"First{i}", last_name=f"Last{i}", email=f"client{i}@bench.com",
+               phone="0102030405", company_name=f"Company{i % 100}",
+               sales_contact=salesmen_users[i % len(salesmen_users)])
+        for i in range(clients))
+    contract_rows = Contract.objects.bulk_create(
+        Contract(title=f"Contract{i}", signed=i % 2 == 0, amount=1000 + i, payment_due=i % 1000,
+                 sales_contact=client_rows[i % clients].sales_contact,
+                 client=client_rows[i % clients])
+        for i in range(contracts))
+    Event.objects.bulk_create(
+        Event(title=f"Event{i}", status=i % 2 == 0, attendees=i % 500,
+              event_date=now + timedelta(days=-1 - i if i % 2 == 0 else 1 + i),
+              notes="Benchmark event", support_contact=support_users[i % len(support_users)],
+              contract=contract_rows[i % contracts])
+        for i in range(events))
+    Client.objects.refresh_status()
+    refresh_client_rollups()
+    refresh_salesman_rollups()
+
+
+class Command(BaseCommand):
+    help = "Measures the time, queries and memory of the API endpoints and admin changelists."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=2000)
+        parser.add_argument("--contracts", type=int, default=4000)
+        parser.add_argument("--events", type=int, default=4000)
+        parser.add_argument("--salesmen", type=int, default=10)
+        parser.add_argument("--support", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=3,
+                            help="Number of runs of the read requests, the best one is kept.")
+        parser.add_argument("--tolerance", type=float, default=0.5,
+                            help="Relative excess of time and memory over the baseline above "
+                                 "which a warning is written.")
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument("--save", action="store_true",
+                            help="Writes the measures to the baseline instead of checking them.")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive",
+                            help="Deletes a leftover test database without asking.")
+
+    def handle(self, *args, **options):
+        volume = {name: options[name]
+                  for name in ("clients", "contracts", "events", "salesmen", "support")}
+        if min(volume.values()) < 2:
+            raise CommandError("The volumes must be at least 2.")
+
+        old_name = connection.settings_dict["NAME"]
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=not options["interactive"],
+                                           serialize=False)
+        try:
+            # the file-based cache of the settings would be shared with the running servers.
+            locmem = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+            with override_settings(CACHES={alias: locmem for alias in settings.CACHES}):
+                seed(**volume)
+                results = self.measure(get_endpoints(), options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {"vendor": connection.vendor, "volume": volume, "endpoints": results}
+        baseline_path = Path(options["baseline"])
+        if options["save"]:
+            baseline_path.write_text(json.dumps(report, indent=4) + "\n")
+            self.write_results(results, {})
+            self.stdout.write(f"Baseline written to {baseline_path}.")
+            return
+
+        baseline = {}
+        if baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+        self.write_results(results, baseline.get("endpoints", {}))
+        failures = self.check_budgets(report, baseline, options["tolerance"])
+        if failures:
+            raise CommandError("Budget exceeded:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("All the endpoints are within their query budgets."))
+
+    def measure(self, endpoints, repeat):
+        """Requests each endpoint and returns its best time in seconds, its number of queries
+        and its peak memory in bytes, keyed by the endpoint name."""
+        clients = {}
+        for username in {request.user for request in endpoints}:
+            clients[username] = TestClient()
+            clients[username].force_login(CustomUser.objects.get(username=username))
+
+        results = {}
+        for item in endpoints:
+            client = clients[item.user]
+            send = getattr(client, item.method)
+            kwargs = {}
+            if item.data is not None:
+                kwargs = {"data": json.dumps(item.data), "content_type": "application/json"}
+            if item.cached:
+                send(item.path, **kwargs)
+
+            best = None
+            for _ in range(repeat if item.repeatable else 1):
+                if not item.cached:
+                    for cache in caches.all():
+                        cache.clear()
+                tracemalloc.start()
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.perf_counter()
+                    response = send(item.path, **kwargs)
+                    if response.streaming:
+                        consume(response)
+                    elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                if response.status_code >= 400:
+                    raise CommandError(f"{item.name}: {item.method.upper()} "
+                                       f"{item.path} returned {response.status_code}.")
+                if best is None or elapsed < best["time"]:
+                    best = {"time": round(elapsed, 4), "queries": len(queries), "memory": peak}
+            results[item.name] = best
+        return results
+
+    def write_results(self, results, baseline):
+        self.stdout.write(f"{'endpoint':<32}{'time (ms)':>12}{'queries':>10}{'peak (KiB)':>12}")
+        for name, result in results.items():
+            line = (f"{name:<32}{result['time'] * 1000:>12.1f}{result['queries']:>10}"
+                    f"{result['memory'] / 1024:>12.0f}")
+            if name in baseline:
+                reference = baseline[name]
+                line += (f"   baseline {reference['time'] * 1000:.1f} ms, "
+                         f"{reference['queries']} queries, {reference['memory'] / 1024:.0f} KiB")
+            self.stdout.write(line)
+
+    def check_budgets(self, report, baseline, tolerance):
+        """Returns the list of the query budgets exceeded by the measures in report, and warns
+        about the times and memory peaks exceeding the baseline."""
+        if not baseline:
+            self.stdout.write(self.style.WARNING("No baseline to compare with, run with --save."))
+            return []
+        same_setup = (baseline["vendor"] == report["vendor"]
+                      and baseline["volume"] == report["volume"])
+        if not same_setup:
+            self.stdout.write(self.style.WARNING(
+                "The baseline was recorded with another database or volume, the time and memory "
+                "aren't compared."))
+        failures = []
+        warnings = []
+        for name, result in report["endpoints"].items():
+            reference = baseline["endpoints"].get(name)
+            if reference is None:
+                continue
+            if result["queries"] > reference["queries"]:
+                failures.append(f"{name}: {result['queries']} queries, "
+                                f"{reference['queries']} in the baseline.")
+            if not same_setup:
+                continue
+            for metric in ("time", "memory"):
+                if result[metric] > reference[metric] * (1 + tolerance):
+                    warnings.append(f"{name}: {metric} {result[metric]}, "
+                                    f"{reference[metric]} in the baseline.")
+        if warnings:
+            self.stdout.write(self.style.WARNING(
+                "Over the baseline, not counted as failures:\n" + "\n".join(warnings)))
+        return failures
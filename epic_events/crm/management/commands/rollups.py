@@ -0,0 +1,57 @@
+"""Defines the rollups command, which checks the ClientRollup and SalesmanRollup tables against
+the contracts and events, and rebuilds them:
+
+    python manage.py rollups
+    python manage.py rollups --rebuild
+
+The check compares every rollup with the totals computed from scratch, in one query per table,
+and fails when any of them is stale or missing. The rebuild recomputes all of them, in one
+UPDATE per table, creating the missing ones, within a single transaction."""
+
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from epic_events.crm.models import Client, CustomUser
+from epic_events.crm.rollups import get_stale_client_rollups, get_stale_salesman_rollups
+from epic_events.crm.rollups import refresh_client_rollups, refresh_salesman_rollups
+
+# the number of stale rollups listed by the check.
+SHOWN = 10
+
+
+class Command(BaseCommand):
+    help = "Checks the rollup tables against the contracts and events, or rebuilds them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rebuild", action="store_true",
+                            help="Recomputes all the rollups instead of checking them.")
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            with transaction.atomic():
+                clients = refresh_client_rollups()
+                salesmen = refresh_salesman_rollups()
+            self.stdout.write(f"{clients} client rollup(s) and {salesmen} salesman rollup(s) "
+                              "rebuilt.")
+            return
+
+        problems = []
+        missing = Client.objects.filter(rollup__isnull=True).count()
+        if missing:
+            problems.append(f"{missing} client(s) without a rollup.")
+        missing = (CustomUser.objects.filter(contract__isnull=False,
+                                             salesman_rollup__isnull=True)
+                   .distinct().count())
+        if missing:
+            problems.append(f"{missing} salesman(en) holding contracts without a rollup.")
+        for name, stale in (("client", get_stale_client_rollups()),
+                            ("salesman", get_stale_salesman_rollups())):
+            keys = list(stale.values_list("pk", flat=True)[:SHOWN + 1])
+            if keys:
+                shown = ", ".join(str(key) for key in keys[:SHOWN])
+                more = ", ..." if len(keys) > SHOWN else ""
+                problems.append(f"stale {name} rollup(s) of id {shown}{more}.")
+        if problems:
+            raise CommandError("\n".join(problems) + "\nRun rollups --rebuild to fix them.")
+        self.stdout.write("The rollups match the contracts and events.")
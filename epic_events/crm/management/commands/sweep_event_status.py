@@ -0,0 +1,40 @@
+"""Defines the sweep_event_status command, meant to be scheduled, for instance every minute:
+
+    * * * * * cd /path/to/OCRP12 && python manage.py sweep_event_status
+
+Event.save sets the status of an event only when the event is written. Thus, an event whose
+date passes stays upcoming until someone edits it, and so does the status of its client. The
+command catches up on both with two set-based UPDATE statements, then recomputes the rollups
+of those clients, which count the events as upcoming or past. Running it again right after
+changes nothing."""
+
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from epic_events.crm.models import Client, Event
+from epic_events.crm.rollups import schedule_rollup_refresh
+from epic_events.crm.signals import rows_changed
+
+
+class Command(BaseCommand):
+    help = "Marks the events whose date has passed as done and updates the status of their clients."
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        with transaction.atomic():
+            passed_events = Event.objects.filter(status=False, event_date__lt=now)
+            # the clients are updated first, while the passed events can still be told apart
+            # from the others. Once the events are swept, those clients have a past event.
+            clients = (Client.objects
+                       .filter(Exists(passed_events.filter(contract__client=OuterRef("pk"))))
+                       .exclude(client_status=3)
+                       .update(client_status=3))
+            client_ids = set(passed_events.values_list("contract__client_id", flat=True))
+            events = passed_events.update(status=True, date_updated=now)
+            if events:
+                rows_changed.send(sender=Event)
+                schedule_rollup_refresh(client_ids=client_ids)
+        self.stdout.write(f"{events} event(s) marked as done, {clients} client(s) updated.")
@@ -1,6 +1,9 @@
-"""We use a custom User model. Thus, we have to specify a custom Manager"""
+"""We use a custom User model. Thus, we have to specify a custom Manager. The Client model
+also gets a custom QuerySet for the operations working on many clients at once."""
 
 from django.contrib.auth.models import BaseUserManager
+from django.db import models
+from django.db.models import Case, Exists, OuterRef, Value, When
 
 
 class CustomUserManager(BaseUserManager):
@@ -51,3 +54,43 @@ class CustomUserManager(BaseUserManager):
                                 first_name=first_name,
                                 last_name=last_name, user_type=user_type,
                                 **extra_fields)
+
+
+class ClientQuerySet(models.QuerySet):
+    """Adds to the Client model's default manager methods resolving or updating many clients
+    in a single query."""
+
+    def in_bulk_by_name(self, names):
+        """Receives "First Last" strings and returns a dict mapping each of them to the
+        matching client. Names that don't match any client are left out of the dict.
+
+        The clients are fetched with a single query filtering on the first names, the leading
+        column of the unique index on the names. Filtering on the last names as well would
+        make the database probe the index for every pair of a first name and a last name,
+        i.e. millions of times for a few thousand names. The clients whose last name doesn't
+        complete one of the names are then discarded."""
+        pairs = set()
+        for name in names:
+            parts = name.split(" ")
+            if len(parts) == 2:
+                pairs.add(tuple(parts))
+        if not pairs:
+            return {}
+        clients = self.filter(first_name__in={first_name for first_name, _ in pairs})
+        return {client.full_name: client for client in clients
+                if (client.first_name, client.last_name) in pairs}
+
+    def refresh_status(self):
+        """Recomputes the client_status of every client in the queryset with a single UPDATE.
+        A client with at least one past event is existent with a past event (3). Otherwise, a
+        client with at least one upcoming event is existent with an upcoming event (2). Any
+        other client is a potential client (1). Returns the number of updated rows."""
+        has_past_event = Exists(self.model.objects.filter(pk=OuterRef("pk"),
+                                                          contract__event__status=True))
+        has_upcoming_event = Exists(self.model.objects.filter(pk=OuterRef("pk"),
+                                                              contract__event__status=False))
+        return self.update(client_status=Case(
+            When(has_past_event, then=Value(3)),
+            When(has_upcoming_event, then=Value(2)),
+            default=Value(1),
+        ))
@@ -0,0 +1,92 @@
+# Generated by Django 4.1.3 on 2026-10-17 20:44
+
+from django.conf import settings
+import django.contrib.auth.validators
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('password', models.CharField(max_length=128, verbose_name='password')),
+                ('last_login', models.DateTimeField(blank=True, null=True, verbose_name='last login')),
+                ('is_superuser', models.BooleanField(default=False, help_text='Designates that this user has all permissions without explicitly assigning them.', verbose_name='superuser status')),
+                ('username', models.CharField(error_messages={'unique': 'A user with that username already exists.'}, help_text='Required. 150 characters or fewer. Letters, digits and @/./+/-/_ only.', max_length=150, unique=True, validators=[django.contrib.auth.validators.UnicodeUsernameValidator()], verbose_name='username')),
+                ('is_staff', models.BooleanField(default=False, help_text='Designates whether the user can log into this admin site.', verbose_name='staff status')),
+                ('is_active', models.BooleanField(default=True, help_text='Designates whether this user should be treated as active. Unselect this instead of deleting accounts.', verbose_name='active')),
+                ('date_joined', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date joined')),
+                ('first_name', models.CharField(max_length=25)),
+                ('last_name', models.CharField(max_length=25)),
+                ('email', models.EmailField(max_length=254)),
+                ('user_type', models.PositiveSmallIntegerField(choices=[(1, 'management team'), (2, 'sales team'), (3, 'support team')])),
+                ('phone', models.CharField(blank=True, max_length=17, null=True, validators=[django.core.validators.RegexValidator(message="Phone number must be entered in the format: '+999999999'. Up to 15 digits allowed.", regex='^\\+?1?\\d{9,15}$')])),
+                ('groups', models.ManyToManyField(blank=True, help_text='The groups this user belongs to. A user will get all permissions granted to each of their groups.', related_name='user_set', related_query_name='user', to='auth.group', verbose_name='groups')),
+                ('user_permissions', models.ManyToManyField(blank=True, help_text='Specific permissions for this user.', related_name='user_set', related_query_name='user', to='auth.permission', verbose_name='user permissions')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Client',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_name', models.CharField(max_length=25)),
+                ('last_name', models.CharField(max_length=25)),
+                ('email', models.EmailField(max_length=100)),
+                ('phone', models.CharField(blank=True, max_length=20, null=True)),
+                ('mobile', models.CharField(blank=True, max_length=20, null=True)),
+                ('company_name', models.CharField(max_length=250)),
+                ('client_status', models.PositiveSmallIntegerField(choices=[(1, 'potential'), (2, 'existent with at least one upcoming event.'), (3, 'existent with at least one past event.')], default=1)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('sales_contact', models.ForeignKey(limit_choices_to=models.Q(('user_type', 2)), null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('first_name', 'last_name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Contract',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(help_text='do not use special characters', max_length=50, unique=True)),
+                ('signed', models.BooleanField(help_text='tick if the contract is signed')),
+                ('amount', models.FloatField()),
+                ('payment_due', models.FloatField()),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.client')),
+                ('sales_contact', models.ForeignKey(limit_choices_to=models.Q(('user_type', 2)), null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Event',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=50, unique=True)),
+                ('status', models.BooleanField(blank=True, default=False, help_text='green if the event already took place')),
+                ('attendees', models.IntegerField()),
+                ('event_date', models.DateTimeField()),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('contract', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.contract')),
+                ('support_contact', models.ForeignKey(limit_choices_to=models.Q(('user_type', 3)), null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='customuser',
+            constraint=models.UniqueConstraint(models.F('username'), name='username_unique'),
+        ),
+    ]
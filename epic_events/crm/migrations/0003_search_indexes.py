@@ -0,0 +1,51 @@
+"""Adds the GIN indexes of the full-text search of api/search.py, on Postgres only.
+
+The indexes are built on the same tsvector expressions as the search queries, otherwise the
+planner doesn't use them. They're built concurrently, so that the tables stay writable while
+they're built, which requires a non-atomic migration. On the other databases, the search falls
+back on plain lookups and the migration does nothing."""
+
+from django.db import migrations
+
+# must match SEARCH_CONFIG and SEARCH_FIELDS in api/search.py.
+SEARCH_CONFIG = "simple"
+SEARCH_INDEXES = {
+    "client": ("client_search_idx", ("first_name", "last_name", "email", "company_name")),
+    "contract": ("contract_search_idx", ("title",)),
+    "event": ("event_search_idx", ("title", "notes")),
+}
+
+
+def get_indexes(apps):
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+
+    for model_name, (name, fields) in SEARCH_INDEXES.items():
+        index = GinIndex(SearchVector(*fields, config=SEARCH_CONFIG), name=name)
+        yield apps.get_model("crm", model_name), index
+
+
+def add_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for model, index in get_indexes(apps):
+        schema_editor.add_index(model, index, concurrently=True)
+
+
+def remove_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for model, index in get_indexes(apps):
+        schema_editor.remove_index(model, index, concurrently=True)
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('crm', '0002_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_indexes, remove_search_indexes),
+    ]
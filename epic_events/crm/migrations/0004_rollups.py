@@ -0,0 +1,79 @@
+# Generated by Django 4.1.3 on 2026-10-17 21:17
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def fill_rollups(apps, schema_editor):
+    """Computes the rollups of the existing clients and salesmen. From then on, they're kept
+    up to date by crm/rollups.py."""
+    Client = apps.get_model("crm", "Client")
+    Contract = apps.get_model("crm", "Contract")
+    Event = apps.get_model("crm", "Event")
+    ClientRollup = apps.get_model("crm", "ClientRollup")
+    SalesmanRollup = apps.get_model("crm", "SalesmanRollup")
+    CustomUser = apps.get_model("crm", "CustomUser")
+
+    contract_totals = {"contract_count": Count("id"), "total_amount": Sum("amount"),
+                       "total_payment_due": Sum("payment_due")}
+    clients = {pk: ClientRollup(client_id=pk)
+               for pk in Client.objects.values_list("pk", flat=True)}
+    for row in Contract.objects.values("client_id").annotate(**contract_totals).order_by():
+        rollup = clients[row.pop("client_id")]
+        for name, value in row.items():
+            setattr(rollup, name, value)
+    events = (Event.objects.values("contract__client_id", "status")
+              .annotate(count=Count("id")).order_by())
+    for row in events:
+        rollup = clients[row["contract__client_id"]]
+        if row["status"]:
+            rollup.past_event_count = row["count"]
+        else:
+            rollup.upcoming_event_count = row["count"]
+    ClientRollup.objects.bulk_create(clients.values(), batch_size=1000)
+
+    salesmen = {pk: SalesmanRollup(salesman_id=pk)
+                for pk in CustomUser.objects.filter(user_type=2).values_list("pk", flat=True)}
+    contracts = (Contract.objects.filter(sales_contact__isnull=False)
+                 .values("sales_contact_id").annotate(**contract_totals).order_by())
+    for row in contracts:
+        pk = row.pop("sales_contact_id")
+        rollup = salesmen.setdefault(pk, SalesmanRollup(salesman_id=pk))
+        for name, value in row.items():
+            setattr(rollup, name, value)
+    SalesmanRollup.objects.bulk_create(salesmen.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0003_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientRollup',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rollup', serialize=False, to='crm.client')),
+                ('contract_count', models.IntegerField(default=0)),
+                ('total_amount', models.FloatField(default=0)),
+                ('total_payment_due', models.FloatField(default=0)),
+                ('upcoming_event_count', models.IntegerField(default=0)),
+                ('past_event_count', models.IntegerField(default=0)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SalesmanRollup',
+            fields=[
+                ('salesman', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='salesman_rollup', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('contract_count', models.IntegerField(default=0)),
+                ('total_amount', models.FloatField(default=0)),
+                ('total_payment_due', models.FloatField(default=0)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,19 @@
-"""Defines four models used in both the crm and api app."""
+"""Defines four models used in both the crm and api app, and the two rollup tables holding
+totals of the contracts and events per client and per salesman, see crm/rollups.py."""
 
 
+from threading import local
+
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 
-from .managers import CustomUserManager
+from .managers import ClientQuerySet, CustomUserManager
 
 
 class Client(models.Model):
@@ -37,13 +40,24 @@ class Client(models.Model):
                                       on_delete=models.SET_NULL,
                                       null=True,
                                       limit_choices_to=Q(user_type=2))  # type 2 is sales team
+    objects = ClientQuerySet.as_manager()
 
     class Meta:
         unique_together = [['first_name', 'last_name']]
+        indexes = [
+            # the read endpoints are paginated on (date_created, id).
+            models.Index(fields=["date_created", "id"], name="client_created_idx"),
+            models.Index(fields=["sales_contact", "date_created"], name="client_sales_created_idx"),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} {self.email}"
 
+    @property
+    def full_name(self):
+        """The "First Last" string used to refer to a client through the API."""
+        return f"{self.first_name} {self.last_name}"
+
     def clean(self):
         """first name and last name shouldn't contain spaces."""
         if " " in self.first_name:
@@ -71,6 +85,14 @@ class Contract(models.Model):
                                       limit_choices_to=Q(user_type=2))  # type 2 is sales team
     client = models.ForeignKey("Client", on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # the read endpoints are paginated on (date_created, id).
+            models.Index(fields=["date_created", "id"], name="contract_created_idx"),
+            models.Index(fields=["signed", "date_created"], name="contract_signed_created_idx"),
+            models.Index(fields=["client", "signed"], name="contract_client_signed_idx"),
+        ]
+
     def clean(self):
         """checks that all char can fit in a URL. If there are special char,
         raises a ValidationError as the user knows he shouldn't use such char in the title.
@@ -116,6 +138,16 @@ class Event(models.Model):
                                         limit_choices_to=Q(user_type=3))  # type 3 is support team
     contract = models.ForeignKey("Contract", on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # the read endpoints are paginated on (date_created, id).
+            models.Index(fields=["date_created", "id"], name="event_created_idx"),
+            models.Index(fields=["event_date"], name="event_date_idx"),
+            models.Index(fields=["status", "event_date"], name="event_status_date_idx"),
+            models.Index(fields=["support_contact", "event_date"], name="event_support_date_idx"),
+            models.Index(fields=["contract", "event_date"], name="event_contract_date_idx"),
+        ]
+
     def clean(self):
         """checks that all char can fit in a URL. If there are special char,
         raises a ValidationError as the user knows he shouldn't use such char in the title.
@@ -130,12 +162,16 @@ class Event(models.Model):
                 validated_title += ch
         self.title = validated_title
 
-    def save(self, *args, **kwargs):
-        """The field status is automatically updated everytime the object is saved."""
+    def set_status(self):
+        """The status is True if the event already took place."""
         if self.event_date < timezone.now():
             self.status = True
         else:
             self.status = False
+
+    def save(self, *args, **kwargs):
+        """The field status is automatically updated everytime the object is saved."""
+        self.set_status()
         self.clean()
         super().save(*args, **kwargs)
 
@@ -169,6 +205,10 @@ class CustomUser(AbstractUser):
 
     class Meta:
         constraints = [models.UniqueConstraint('username', name="username_unique")]
+        indexes = [
+            # users/view is paginated on (date_joined, id).
+            models.Index(fields=["date_joined", "id"], name="user_joined_idx"),
+        ]
 
     def clean(self):
         """Ensures all users have the is_staff permission needed to access the admin interface. Also
@@ -190,21 +230,111 @@ class CustomUser(AbstractUser):
         return self.username
 
 
+class ClientRollup(models.Model):
+    """Totals of the contracts and events of a client, kept up to date by crm/rollups.py as
+    they're written, so that they're read with the client instead of being aggregated. An
+    event is counted as upcoming or past according to its status."""
+    client = models.OneToOneField("Client", on_delete=models.CASCADE, primary_key=True,
+                                  related_name="rollup")
+    contract_count = models.IntegerField(default=0)
+    total_amount = models.FloatField(default=0)
+    total_payment_due = models.FloatField(default=0)
+    upcoming_event_count = models.IntegerField(default=0)
+    past_event_count = models.IntegerField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"totals of {self.client_id}"
+
+
+class SalesmanRollup(models.Model):
+    """Totals of the contracts of a sales contact, kept up to date by crm/rollups.py."""
+    salesman = models.OneToOneField("CustomUser", on_delete=models.CASCADE, primary_key=True,
+                                    related_name="salesman_rollup")
+    contract_count = models.IntegerField(default=0)
+    total_amount = models.FloatField(default=0)
+    total_payment_due = models.FloatField(default=0)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"totals of {self.salesman_id}"
+
+
+_pending_status_refresh = local()
+
+
+def schedule_client_status_refresh(client_ids=(), contract_ids=()):
+    """Registers clients, directly or through their contracts, whose status must be recomputed.
+
+    The status isn't recomputed right away. The clients are collected until the current
+    transaction is committed and then updated all at once by a single query. Outside a
+    transaction, the update happens immediately."""
+    pending = getattr(_pending_status_refresh, "ids", None)
+    if pending is None:
+        pending = _pending_status_refresh.ids = {"clients": set(), "contracts": set()}
+    pending["clients"].update(client_ids)
+    pending["contracts"].update(contract_ids)
+    # only the first callback run after a commit finds pending clients, the others do nothing.
+    transaction.on_commit(refresh_pending_client_status)
+
+
+def refresh_pending_client_status():
+    """Recomputes the status of the clients registered since the last refresh. If a transaction
+    was rolled back, its clients are still refreshed with those of the next one, which is
+    harmless as the status is computed from scratch."""
+    pending = getattr(_pending_status_refresh, "ids", None)
+    if not pending or not (pending["clients"] or pending["contracts"]):
+        return
+    _pending_status_refresh.ids = None
+    contracts = Contract.objects.filter(pk__in=pending["contracts"]).values("client_id")
+    clients = Client.objects.filter(Q(pk__in=pending["clients"]) | Q(pk__in=contracts))
+    clients.refresh_status()
+
+
 @receiver(post_save, sender=Event)
-def update_client_status(sender, **kwargs):
+@receiver(post_delete, sender=Event)
+def update_client_status(sender, instance, **kwargs):
     """Registers on the client instance the fact that he has or not at
-    least one upcoming/past event."""
-    event = kwargs.get("instance")
-    contract = event.contract
-    client = contract.client
-    # if the client already has a past event, his status
-    # won't change.
-    if client.client_status != 3:
-        if client.client_status == 2:
-            if event.status is True:
-                client.client_status = 3
-                client.save()
-        elif client.client_status == 1:
-            if event.status is False:
-                client.client_status = 2
-                client.save()
+    least one upcoming/past event. The client is reached through the
+    contract_id of the event, so no related instance is loaded."""
+    schedule_client_status_refresh(contract_ids=[instance.contract_id])
+
+
+@receiver(post_delete, sender=Contract)
+def update_client_status_on_contract_delete(sender, instance, **kwargs):
+    """Once a contract is deleted, its events can't lead to the client anymore. The client
+    is thus registered directly."""
+    schedule_client_status_refresh(client_ids=[instance.client_id])
+
+
+@receiver(post_init, sender=Contract)
+def record_loaded_client(sender, instance, **kwargs):
+    """Records the client the contract is loaded with. A deferred client_id isn't set yet and
+    isn't recorded."""
+    if "client_id" in instance.__dict__:
+        instance._loaded_client_id = instance.client_id
+
+
+@receiver(pre_save, sender=Contract)
+def record_previous_client(sender, instance, raw=False, **kwargs):
+    """Records the client the contract had before the save, read from the database when the
+    client_id was deferred."""
+    if raw or instance._state.adding:
+        instance._previous_client_id = None
+    elif "_loaded_client_id" in instance.__dict__:
+        instance._previous_client_id = instance._loaded_client_id
+    else:
+        instance._previous_client_id = (Contract.objects.filter(pk=instance.pk)
+                                        .values_list("client_id", flat=True).first())
+
+
+@receiver(post_save, sender=Contract)
+def update_client_status_on_contract_save(sender, instance, created, **kwargs):
+    """A contract moved to another client takes its events along, so both clients are
+    registered."""
+    previous_client_id = instance.__dict__.get("_previous_client_id")
+    instance._loaded_client_id = instance.client_id
+    if not created and previous_client_id != instance.client_id:
+        schedule_client_status_refresh(
+            client_ids=[client_id for client_id in (previous_client_id, instance.client_id)
+                        if client_id is not None])
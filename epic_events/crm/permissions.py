@@ -0,0 +1,125 @@
+"""Defines, in a single place, which rows of each model a user can view, change or delete.
+
+The rules depend on the user_type of the user and on the ownership of the rows. They are
+expressed as Q objects, so they can be compiled into the WHERE clause of a query instead of
+being checked in Python against loaded instances. Both api/views.py and crm/admin.py rely on
+this module. The admin restricts some actions further, e.g. only managers delete rows there,
+and lets a salesman change the contracts they signed, whoever the client is:
+    - scoped_queryset restricts a queryset to the rows a user can act on;
+    - has_object_permission checks a single row with one EXISTS query;
+    - annotate_permission flags each row of a queryset with the outcome of the check;
+    - visibility_scope names the set of rows a user can view, to key cached data on it.
+"""
+
+
+from django.db.models import BooleanField, ExpressionWrapper, Q, Value
+from django.utils import timezone
+
+from .models import Client, Contract, CustomUser, Event
+
+VIEW = "view"
+CHANGE = "change"
+DELETE = "delete"
+
+MANAGER = 1
+SALESMAN = 2
+SUPPORT = 3
+
+
+def custom_user_filter(user, action):
+    """Managers can act on all users. Other users can view and change their own data only."""
+    if user.user_type == MANAGER:
+        return Q()
+    if action in (VIEW, CHANGE):
+        return Q(pk=user.pk)
+    return None
+
+
+def client_filter(user, action):
+    """Anyone can view clients. Managers can change and delete all of them, salesmen only
+    the clients they are assigned to."""
+    if user.user_type == MANAGER or action == VIEW:
+        return Q()
+    if user.user_type == SALESMAN:
+        return Q(sales_contact=user)
+    return None
+
+
+def contract_filter(user, action):
+    """Anyone can view contracts. Managers can change and delete all of them, salesmen only
+    the contracts of their clients."""
+    if user.user_type == MANAGER or action == VIEW:
+        return Q()
+    if user.user_type == SALESMAN:
+        return Q(client__sales_contact=user)
+    return None
+
+
+def event_filter(user, action):
+    """Anyone can view events. Managers can change and delete all of them, salesmen only the
+    events of their contracts. Support team members can change the events they are assigned
+    to, until the events happen, but cannot delete events."""
+    if user.user_type == MANAGER or action == VIEW:
+        return Q()
+    if user.user_type == SALESMAN:
+        return Q(contract__sales_contact=user)
+    if user.user_type == SUPPORT and action == CHANGE:
+        return Q(support_contact=user, event_date__gte=timezone.now())
+    return None
+
+
+FILTERS = {
+    CustomUser: custom_user_filter,
+    Client: client_filter,
+    Contract: contract_filter,
+    Event: event_filter,
+}
+
+
+def get_filter(user, model, action):
+    """Returns the Q object matching the rows of model the user can act on, or None if the
+    user cannot act on any row."""
+    return FILTERS[model](user, action)
+
+
+def scoped_queryset(user, model, action=VIEW, queryset=None):
+    """Restricts queryset, or all the rows of model, to those the user can act on."""
+    if queryset is None:
+        queryset = model._default_manager.all()
+    rule = get_filter(user, model, action)
+    if rule is None:
+        return queryset.none()
+    return queryset.filter(rule)
+
+
+def has_object_permission(user, action, obj):
+    """Returns True if the user can act on obj. When the answer only depends on the
+    user_type, no query is made. Otherwise, a single EXISTS query is made."""
+    rule = get_filter(user, type(obj), action)
+    if rule is None:
+        return False
+    if not rule:
+        return True
+    return type(obj)._default_manager.filter(rule, pk=obj.pk).exists()
+
+
+def annotate_permission(queryset, user, action, name):
+    """Annotates each row of the queryset with a boolean named name telling whether the
+    user can act on it. The check is thus made by the query fetching the rows."""
+    rule = get_filter(user, queryset.model, action)
+    if rule is None:
+        expression = Value(False)
+    elif not rule:
+        expression = Value(True)
+    else:
+        expression = ExpressionWrapper(rule, output_field=BooleanField())
+    return queryset.annotate(**{name: expression})
+
+
+def visibility_scope(user, model):
+    """Returns a string shared by all the users who can view the same rows of model. Users
+    who can view every row share the "all" scope, the others get a scope of their own."""
+    rule = get_filter(user, model, VIEW)
+    if rule is not None and not rule:
+        return "all"
+    return f"user:{user.pk}"
@@ -0,0 +1,327 @@
+"""Maintains the ClientRollup and SalesmanRollup tables, which hold the totals of the contracts
+and events of each client and of the contracts of each sales contact.
+
+When a contract or an event is saved or deleted, only the difference it makes is applied, with
+an UPDATE adding it to the current totals, e.g. SET total_amount = total_amount + 250. No
+aggregate is computed, so a write costs the same whatever the number of rows of the client.
+To know that difference, the values a contract or an event was loaded with are recorded on
+the instance. An event reaches the rollup of its client through its contract, within the
+UPDATE, so no related instance is loaded.
+
+The writes made through the querysets, such as bulk_create and update, don't send post_save.
+Their callers register the clients and the salesmen concerned with schedule_rollup_refresh
+instead, and their totals are recomputed from scratch once the transaction is committed, as
+the status of the clients is. The same refresh is used when the difference can't be applied:
+a missing rollup row or a contract moved to another client along with its events. Queryset
+deletes do send post_delete for each row, but applying the differences one row at a time
+would cost an UPDATE per row, so they're run within refresh_rollups_on_commit.
+
+The rollups command checks the tables against the contracts and events and rebuilds them."""
+
+
+from contextlib import contextmanager
+from threading import local
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Abs, Coalesce
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Client, ClientRollup, Contract, CustomUser, Event, SalesmanRollup
+from .signals import rows_changed
+
+# the fields of the contracts and events the totals depend on.
+CONTRACT_FIELDS = ("client_id", "sales_contact_id", "amount", "payment_due")
+EVENT_FIELDS = ("contract_id", "status")
+
+AMOUNT_FIELDS = ("total_amount", "total_payment_due")
+# the amounts are floats, summed in another order by the refresh than by the updates.
+AMOUNT_TOLERANCE = 0.005
+
+_pending_refresh = local()
+_deferred = local()
+
+
+def subquery_total(queryset, key, aggregate, default):
+    """Returns a subquery computing the aggregate over the rows of queryset, which must be
+    filtered on an OuterRef through key, or default when there's no row."""
+    rows = queryset.order_by().values(key).annotate(total=aggregate).values("total")
+    return Coalesce(Subquery(rows), Value(default))
+
+
+def get_client_totals(client):
+    """Returns the expressions computing the totals of the client, an OuterRef to its id."""
+    contracts = Contract.objects.filter(client=client)
+    events = Event.objects.filter(contract__client=client)
+    return {
+        "contract_count": subquery_total(contracts, "client", Count("id"), 0),
+        "total_amount": subquery_total(contracts, "client", Sum("amount"), 0.0),
+        "total_payment_due": subquery_total(contracts, "client", Sum("payment_due"), 0.0),
+        "upcoming_event_count": subquery_total(events.filter(status=False), "contract__client",
+                                               Count("id"), 0),
+        "past_event_count": subquery_total(events.filter(status=True), "contract__client",
+                                           Count("id"), 0),
+    }
+
+
+def get_salesman_totals(salesman):
+    """Returns the expressions computing the totals of the salesman, an OuterRef to its id."""
+    contracts = Contract.objects.filter(sales_contact=salesman)
+    return {
+        "contract_count": subquery_total(contracts, "sales_contact", Count("id"), 0),
+        "total_amount": subquery_total(contracts, "sales_contact", Sum("amount"), 0.0),
+        "total_payment_due": subquery_total(contracts, "sales_contact", Sum("payment_due"),
+                                            0.0),
+    }
+
+
+def refresh_client_rollups(clients=None):
+    """Recomputes from scratch the rollups of the clients of the queryset, of all the clients
+    by default, creating the missing ones. Returns the number of rollups updated."""
+    if clients is None:
+        clients = Client.objects.all()
+    missing = clients.filter(rollup__isnull=True).values_list("pk", flat=True)
+    ClientRollup.objects.bulk_create([ClientRollup(client_id=pk) for pk in missing],
+                                     batch_size=1000, ignore_conflicts=True)
+    updated = ClientRollup.objects.filter(client__in=clients).update(
+        date_updated=timezone.now(), **get_client_totals(OuterRef("client_id")))
+    rows_changed.send(sender=ClientRollup)
+    return updated
+
+
+def refresh_salesman_rollups(salesmen=None):
+    """Recomputes from scratch the rollups of the users of the queryset, of all the salesmen
+    and the users holding contracts by default, creating the missing ones. Returns the number
+    of rollups updated."""
+    if salesmen is None:
+        salesmen = CustomUser.objects.filter(Q(user_type=2) | Q(contract__isnull=False))
+    salesmen = CustomUser.objects.filter(pk__in=salesmen.values("pk"))
+    missing = salesmen.filter(salesman_rollup__isnull=True).values_list("pk", flat=True)
+    SalesmanRollup.objects.bulk_create([SalesmanRollup(salesman_id=pk) for pk in missing],
+                                       batch_size=1000, ignore_conflicts=True)
+    updated = SalesmanRollup.objects.filter(salesman__in=salesmen).update(
+        date_updated=timezone.now(), **get_salesman_totals(OuterRef("salesman_id")))
+    rows_changed.send(sender=SalesmanRollup)
+    return updated
+
+
+def schedule_rollup_refresh(client_ids=(), contract_ids=(), salesman_ids=()):
+    """Registers clients, directly or through their contracts, and salesmen whose rollups must
+    be recomputed. As with schedule_client_status_refresh, they are collected until the
+    current transaction is committed and refreshed all at once."""
+    pending = getattr(_pending_refresh, "ids", None)
+    if pending is None:
+        pending = _pending_refresh.ids = {"clients": set(), "contracts": set(),
+                                          "salesmen": set()}
+    pending["clients"].update(client_ids)
+    pending["contracts"].update(contract_ids)
+    pending["salesmen"].update(salesman_ids)
+    transaction.on_commit(refresh_pending_rollups)
+
+
+def refresh_pending_rollups():
+    """Recomputes the rollups registered since the last refresh."""
+    pending = getattr(_pending_refresh, "ids", None)
+    if not pending:
+        return
+    _pending_refresh.ids = None
+    if pending["clients"] or pending["contracts"]:
+        contracts = Contract.objects.filter(pk__in=pending["contracts"]).values("client_id")
+        refresh_client_rollups(Client.objects.filter(Q(pk__in=pending["clients"])
+                                                     | Q(pk__in=contracts)))
+    pending["salesmen"].discard(None)
+    if pending["salesmen"]:
+        refresh_salesman_rollups(CustomUser.objects.filter(pk__in=pending["salesmen"]))
+
+
+@contextmanager
+def refresh_rollups_on_commit():
+    """Within the block, the contracts and events saved or deleted register the rollups they
+    count in to be refreshed once the transaction is committed, instead of updating them one
+    row at a time. Meant for the writes of many rows, e.g. a queryset delete, which also
+    deletes the events of the contracts."""
+    depth = getattr(_deferred, "depth", 0)
+    _deferred.depth = depth + 1
+    try:
+        yield
+    finally:
+        _deferred.depth = depth
+
+
+def create_client_rollups(clients):
+    """Creates the rollups of new clients, which don't have any contract yet."""
+    ClientRollup.objects.bulk_create([ClientRollup(client_id=client.pk) for client in clients])
+    rows_changed.send(sender=ClientRollup)
+
+
+def add_to_rollups(rollups, totals, sign=1):
+    """Adds the totals, or subtracts them when sign is -1, to the rollups of the queryset with
+    a single UPDATE. Returns the number of rollups updated."""
+    updated = rollups.update(date_updated=timezone.now(),
+                             **{name: F(name) + sign * value for name, value in totals.items()})
+    rows_changed.send(sender=rollups.model)
+    return updated
+
+
+def move_totals(model, key, old_id, old_totals, new_id, new_totals, refresh):
+    """Moves the totals of a row from the rollup it counted in, found by filtering model on
+    key=old_id, to the one it counts in now, key=new_id. Either id is None when the row
+    didn't or doesn't count in any rollup. When the ids are the same, only the difference
+    is applied. refresh is called with the ids whose rollup is missing, to create it."""
+    if old_id == new_id:
+        totals = old_id is not None and diff_totals(old_totals, new_totals)
+        if totals and not add_to_rollups(model.objects.filter(**{key: old_id}), totals):
+            refresh([old_id])
+        return
+    if old_id is not None and not add_to_rollups(model.objects.filter(**{key: old_id}),
+                                                 old_totals, -1):
+        refresh([old_id])
+    if new_id is not None and not add_to_rollups(model.objects.filter(**{key: new_id}),
+                                                 new_totals):
+        refresh([new_id])
+
+
+def get_contract_totals(values):
+    return {"contract_count": 1, "total_amount": values["amount"],
+            "total_payment_due": values["payment_due"]}
+
+
+def get_event_totals(values):
+    past = int(values["status"])
+    return {"upcoming_event_count": 1 - past, "past_event_count": past}
+
+
+def diff_totals(old_totals, new_totals):
+    return {name: new_totals[name] - old_totals[name] for name in new_totals
+            if new_totals[name] != old_totals[name]}
+
+
+def get_values(instance, fields):
+    return {field: getattr(instance, field) for field in fields}
+
+
+def get_loaded_values(instance, fields):
+    """Returns the values of the fields the saved instance was loaded with. They're read from
+    the database when they weren't all loaded, e.g. with only() or defer()."""
+    loaded = instance.__dict__.get("_rollup_values")
+    if loaded is not None and set(fields) <= set(loaded):
+        return loaded
+    return type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(post_init, sender=Contract)
+@receiver(post_init, sender=Event)
+def record_loaded_values(sender, instance, **kwargs):
+    """Records the values of the tracked fields set on the instance. Deferred fields aren't
+    set yet and are left out."""
+    fields = CONTRACT_FIELDS if sender is Contract else EVENT_FIELDS
+    instance._rollup_values = {field: instance.__dict__[field] for field in fields
+                               if field in instance.__dict__}
+
+
+@receiver(pre_save, sender=Contract)
+@receiver(pre_save, sender=Event)
+def record_previous_values(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        instance._rollup_values = None
+        return
+    fields = CONTRACT_FIELDS if sender is Contract else EVENT_FIELDS
+    instance._rollup_values = get_loaded_values(instance, fields)
+
+
+@receiver(post_save, sender=Client)
+def create_client_rollup(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ClientRollup.objects.create(client_id=instance.pk)
+
+
+@receiver(post_save, sender=Contract)
+def update_rollups_on_contract_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance._rollup_values
+    new = get_values(instance, CONTRACT_FIELDS)
+    instance._rollup_values = new
+    update_contract_rollups(old, new)
+
+
+@receiver(post_delete, sender=Contract)
+def update_rollups_on_contract_delete(sender, instance, **kwargs):
+    update_contract_rollups(get_values(instance, CONTRACT_FIELDS), None)
+
+
+def update_contract_rollups(old, new):
+    """Applies the change of a contract from its old values to its new ones to the rollups of
+    its client and salesman. old is None for a new contract, new for a deleted one."""
+    if getattr(_deferred, "depth", 0):
+        schedule_rollup_refresh(
+            client_ids=[values["client_id"] for values in (old, new) if values],
+            salesman_ids=[values["sales_contact_id"] for values in (old, new) if values])
+        return
+    old_totals = old and get_contract_totals(old)
+    new_totals = new and get_contract_totals(new)
+    old_client_id = old and old["client_id"]
+    new_client_id = new and new["client_id"]
+    if old and new and old_client_id != new_client_id:
+        # the events of the contract move along with it.
+        schedule_rollup_refresh(client_ids=[old_client_id, new_client_id])
+    else:
+        move_totals(ClientRollup, "client_id", old_client_id, old_totals, new_client_id,
+                    new_totals, lambda ids: schedule_rollup_refresh(client_ids=ids))
+    move_totals(SalesmanRollup, "salesman_id", old and old["sales_contact_id"], old_totals,
+                new and new["sales_contact_id"], new_totals,
+                lambda ids: schedule_rollup_refresh(salesman_ids=ids))
+
+
+@receiver(post_save, sender=Event)
+def update_rollups_on_event_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance._rollup_values
+    new = get_values(instance, EVENT_FIELDS)
+    instance._rollup_values = new
+    update_event_rollups(old, new)
+
+
+@receiver(post_delete, sender=Event)
+def update_rollups_on_event_delete(sender, instance, **kwargs):
+    update_event_rollups(get_values(instance, EVENT_FIELDS), None)
+
+
+def update_event_rollups(old, new):
+    """Applies the change of an event to the rollup of its client, reached through the
+    contract. old is None for a new event, new for a deleted one."""
+    if getattr(_deferred, "depth", 0):
+        schedule_rollup_refresh(
+            contract_ids=[values["contract_id"] for values in (old, new) if values])
+        return
+    move_totals(ClientRollup, "client__contract", old and old["contract_id"],
+                old and get_event_totals(old), new and new["contract_id"],
+                new and get_event_totals(new),
+                lambda ids: schedule_rollup_refresh(contract_ids=ids))
+
+
+def get_stale_rollups(model, totals):
+    """Returns the rollups of model whose totals differ from those computed by the totals
+    expressions."""
+    rollups = model.objects.alias(**{f"expected_{name}": expression
+                                     for name, expression in totals.items()})
+    stale = Q()
+    for name in totals:
+        expected = F(f"expected_{name}")
+        if name in AMOUNT_FIELDS:
+            rollups = rollups.alias(**{f"gap_{name}": Abs(F(name) - expected)})
+            stale |= Q(**{f"gap_{name}__gt": AMOUNT_TOLERANCE})
+        else:
+            stale |= ~Q(**{name: expected})
+    return rollups.filter(stale)
+
+
+def get_stale_client_rollups():
+    return get_stale_rollups(ClientRollup, get_client_totals(OuterRef("client_id")))
+
+
+def get_stale_salesman_rollups():
+    return get_stale_rollups(SalesmanRollup, get_salesman_totals(OuterRef("salesman_id")))
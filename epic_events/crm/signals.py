@@ -0,0 +1,8 @@
+"""Defines the signals sent by the crm app on top of those provided by Django."""
+
+
+from django.dispatch import Signal
+
+# Sent with the model as sender after a write made through the queryset, such as update or
+# bulk_create. Those writes don't send post_save nor post_delete for each row.
+rows_changed = Signal()
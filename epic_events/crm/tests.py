@@ -0,0 +1,356 @@
+"""Tests of the rules of crm/permissions.py, as applied by the API and the admin site, and of
+the denormalized data kept up to date by the signals and the sweep_event_status command: the
+status of the clients and the rollups.
+
+Run them with python manage.py test epic_events.crm.tests."""
+
+
+import io
+from datetime import timedelta
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from .models import Client, Contract, CustomUser, Event
+from .rollups import get_stale_client_rollups, get_stale_salesman_rollups
+
+MANAGER = "manager"
+SALESMAN = "salesman"
+SUPPORT = "support"
+
+
+def create_user(username, user_type):
+    return CustomUser.objects.create_user(username=username, password="password",
+                                          email=f"{username}@example.com",
+                                          first_name=username.capitalize(),
+                                          last_name="Test", user_type=user_type)
+
+
+class PermissionMatrixTests(APITestCase):
+    """Checks what a manager, a salesman and a support team member can view, change and
+    delete among clients, contracts and events, through the API and through the admin.
+
+    The salesman owns the client Own and signed its contract OwnContract, as well as the
+    contract SignedContract of the client Other, owned by another salesman. The support team
+    member is assigned to the upcoming event OwnUpcoming and to the past event OwnPast, both
+    of OwnContract. The event OtherUpcoming, of OtherContract, is assigned to another support
+    team member."""
+    objects = {
+        "client": ["Own", "Other"],
+        "contract": ["OwnContract", "SignedContract", "OtherContract"],
+        "event": ["OwnUpcoming", "OwnPast", "OtherUpcoming"],
+    }
+    # the objects each user can change and delete, the managers acting on all of them.
+    api_rules = {
+        ("change", SALESMAN): {"Own", "OwnContract", "OwnUpcoming", "OwnPast"},
+        ("change", SUPPORT): {"OwnUpcoming"},
+        ("delete", SALESMAN): {"Own", "OwnContract", "OwnUpcoming", "OwnPast"},
+        ("delete", SUPPORT): set(),
+    }
+    admin_rules = {
+        ("change", SALESMAN): {"Own", "OwnContract", "SignedContract", "OwnUpcoming"},
+        ("change", SUPPORT): {"OwnUpcoming"},
+        ("delete", SALESMAN): set(),
+        ("delete", SUPPORT): set(),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {MANAGER: create_user(MANAGER, 1), SALESMAN: create_user(SALESMAN, 2),
+                     SUPPORT: create_user(SUPPORT, 3)}
+        other_salesman = create_user("othersalesman", 2)
+        salesman = cls.users[SALESMAN]
+        own = Client.objects.create(first_name="Own", last_name="Client", email="own@test.com",
+                                    company_name="Own", sales_contact=salesman)
+        other = Client.objects.create(first_name="Other", last_name="Client",
+                                      email="other@test.com", company_name="Other",
+                                      sales_contact=other_salesman)
+        contracts = {}
+        for title, client, sales_contact in [("OwnContract", own, salesman),
+                                             ("SignedContract", other, salesman),
+                                             ("OtherContract", other, other_salesman)]:
+            contracts[title] = Contract.objects.create(title=title, signed=True, amount=1000,
+                                                       payment_due=0, client=client,
+                                                       sales_contact=sales_contact)
+        other_support = create_user("othersupport", 3)
+        now = timezone.now()
+        for title, days, contract, support in [
+                ("OwnUpcoming", 10, "OwnContract", cls.users[SUPPORT]),
+                ("OwnPast", -10, "OwnContract", cls.users[SUPPORT]),
+                ("OtherUpcoming", 10, "OtherContract", other_support)]:
+            Event.objects.create(title=title, attendees=10, event_date=now + timedelta(days=days),
+                                 notes="", support_contact=support, contract=contracts[contract])
+
+    def get_object(self, kind, name):
+        if kind == "client":
+            return Client.objects.get(first_name=name)
+        return {"contract": Contract, "event": Event}[kind].objects.get(title=name)
+
+    def get_api_path(self, kind, obj):
+        if kind == "client":
+            return f"/api/client/{obj.first_name}/{obj.last_name}/"
+        return f"/api/{kind}/{obj.title}/"
+
+    def get_api_changes(self, kind, obj):
+        """Returns changes the API accepts from whoever can change obj: the related objects
+        are left as they are."""
+        if kind == "client":
+            return {"company_name": "Changed", "sales_contact": obj.sales_contact.username}
+        if kind == "contract":
+            return {"title": obj.title, "signed": False,
+                    "sales_contact": obj.sales_contact.username,
+                    "client": obj.client.full_name}
+        return {"title": obj.title, "attendees": 20, "event_date": obj.event_date.isoformat(),
+                "notes": "", "support_contact": obj.support_contact.username,
+                "contract": obj.contract.title}
+
+    def api_allows(self, user, action, kind, name):
+        self.client.force_authenticate(self.users[user])
+        obj = self.get_object(kind, name)
+        path = self.get_api_path(kind, obj)
+        # the writes are rolled back, so every check starts from the same rows.
+        with transaction.atomic():
+            if action == "view":
+                response = self.client.get(f"/api/{kind}/view", HTTP_ACCEPT="application/json")
+                self.assertEqual(response.status_code, 200)
+                allowed = any(name in row.values() for row in response.json()["results"])
+            elif action == "change":
+                response = self.client.put(path, self.get_api_changes(kind, obj), format="json")
+                self.assertIn(response.status_code, (200, 403), response.content)
+                allowed = response.status_code == 200
+            else:
+                response = self.client.delete(path)
+                self.assertIn(response.status_code, (204, 403), response.content)
+                allowed = response.status_code == 204
+            transaction.set_rollback(True)
+        return allowed
+
+    def admin_allows(self, user, action, kind, name):
+        model = {"client": Client, "contract": Contract, "event": Event}[kind]
+        model_admin = admin.site._registry[model]
+        request = RequestFactory().get("/admin/")
+        request.user = self.users[user]
+        # the object is fetched as the admin does, with the annotated permissions.
+        obj = model_admin.get_queryset(request).get(pk=self.get_object(kind, name).pk)
+        return getattr(model_admin, f"has_{action}_permission")(request, obj)
+
+    def check_matrix(self, allows, rules):
+        for user in (MANAGER, SALESMAN, SUPPORT):
+            for kind, names in self.objects.items():
+                for name in names:
+                    for action in ("view", "change", "delete"):
+                        if user == MANAGER or action == "view":
+                            expected = True
+                        else:
+                            expected = name in rules[action, user]
+                        with self.subTest(user=user, action=action, object=name):
+                            self.assertEqual(allows(user, action, kind, name), expected)
+
+    def test_api(self):
+        self.check_matrix(self.api_allows, self.api_rules)
+
+    def test_admin(self):
+        self.check_matrix(self.admin_allows, self.admin_rules)
+
+
+class ClientStatusTests(APITestCase):
+    """The status of the clients follows their events, including the events of a contract
+    moved to another client."""
+
+    @classmethod
+    def setUpTestData(cls):
+        salesman = create_user(SALESMAN, 2)
+        cls.clients = [Client.objects.create(first_name=name, last_name="Client",
+                                             email=f"{name}@test.com", company_name=name,
+                                             sales_contact=salesman)
+                       for name in ("First", "Second")]
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            contract = Contract.objects.create(title="Moved", signed=True, amount=1000,
+                                               payment_due=0, client=self.clients[0],
+                                               sales_contact=self.clients[0].sales_contact)
+            Event.objects.create(title="Past", attendees=10, notes="", contract=contract,
+                                 event_date=timezone.now() - timedelta(days=1))
+
+    def get_statuses(self):
+        return [client.client_status
+                for client in Client.objects.filter(last_name="Client").order_by("pk")]
+
+    def test_moving_a_contract_refreshes_both_clients(self):
+        self.assertEqual(self.get_statuses(), [3, 1])
+        contract = Contract.objects.get(title="Moved")
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.client = self.clients[1]
+            contract.save()
+        self.assertEqual(self.get_statuses(), [1, 3])
+
+        # a second save of the same instance compares with the client it was saved with.
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.client = self.clients[0]
+            contract.save()
+        self.assertEqual(self.get_statuses(), [3, 1])
+
+    def test_moving_a_contract_loaded_without_its_client(self):
+        contract = Contract.objects.only("title").get(title="Moved")
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.client = self.clients[1]
+            contract.save()
+        self.assertEqual(self.get_statuses(), [1, 3])
+
+
+class RollupTests(APITestCase):
+    """The rollups, updated with the difference each write makes, match the totals recomputed
+    from scratch after every kind of write."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = create_user(MANAGER, 1)
+        cls.salesmen = [create_user(SALESMAN, 2), create_user("othersalesman", 2)]
+        cls.support = create_user(SUPPORT, 3)
+        cls.clients = [Client.objects.create(first_name=name, last_name="Client",
+                                             email=f"{name}@test.com", company_name=name,
+                                             sales_contact=cls.salesmen[0])
+                       for name in ("First", "Second")]
+
+    def setUp(self):
+        self.client.force_authenticate(self.manager)
+
+    def assertRollupsMatch(self):
+        self.assertFalse(Client.objects.filter(rollup__isnull=True).exists())
+        self.assertFalse(CustomUser.objects.filter(contract__isnull=False,
+                                                   salesman_rollup__isnull=True).exists())
+        self.assertEqual(list(get_stale_client_rollups().values_list("pk", flat=True)), [])
+        self.assertEqual(list(get_stale_salesman_rollups().values_list("pk", flat=True)), [])
+
+    def get_totals(self, client):
+        rollup = Client.objects.get(pk=client.pk).rollup
+        return (rollup.contract_count, rollup.total_amount, rollup.upcoming_event_count,
+                rollup.past_event_count)
+
+    def send(self, method, path, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(path, data, format="json")
+        self.assertLess(response.status_code, 300, response.content)
+        self.assertRollupsMatch()
+
+    def test_single_writes(self):
+        first, second = self.clients
+        with self.captureOnCommitCallbacks(execute=True):
+            contract = Contract.objects.create(title="Contract", signed=True, amount=1000,
+                                               payment_due=200, client=first,
+                                               sales_contact=self.salesmen[0])
+            event = Event.objects.create(title="Event", attendees=10, notes="",
+                                         event_date=timezone.now() + timedelta(days=10),
+                                         contract=contract)
+        self.assertRollupsMatch()
+        self.assertEqual(self.get_totals(first), (1, 1000, 1, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.amount = 1500
+            contract.save()
+        self.assertRollupsMatch()
+
+        # the contract moves to another client and salesman, along with its event.
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.client = second
+            contract.sales_contact = self.salesmen[1]
+            contract.save()
+        self.assertRollupsMatch()
+        self.assertEqual(self.get_totals(first), (0, 0, 0, 0))
+        self.assertEqual(self.get_totals(second), (1, 1500, 1, 0))
+
+        # the event takes place, the status set by save moves it to the past events.
+        with self.captureOnCommitCallbacks(execute=True):
+            event.event_date = timezone.now() - timedelta(days=1)
+            event.save()
+        self.assertRollupsMatch()
+        self.assertEqual(self.get_totals(second), (1, 1500, 0, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            event.delete()
+        self.assertRollupsMatch()
+        with self.captureOnCommitCallbacks(execute=True):
+            contract.delete()
+        self.assertRollupsMatch()
+        self.assertEqual(self.get_totals(second), (0, 0, 0, 0))
+
+    def test_bulk_endpoints(self):
+        self.send("post", "/api/contract/create", [
+            {"title": f"Contract{number}", "signed": True, "amount": 1000, "payment_due": 100,
+             "client": "First Client", "sales_contact": SALESMAN} for number in range(3)])
+        event_date = (timezone.now() + timedelta(days=10)).isoformat()
+        self.send("post", "/api/event/create", [
+            {"title": f"Event{number}", "attendees": 10, "event_date": event_date, "notes": "",
+             "contract": f"Contract{number}", "support_contact": SUPPORT}
+            for number in range(3)])
+        self.assertEqual(self.get_totals(self.clients[0]), (3, 3000, 3, 0))
+
+        self.send("patch", "/api/contract/bulk",
+                  {"keys": ["Contract0", "Contract1"], "changes": {"amount": 500}})
+        self.send("patch", "/api/contract/bulk",
+                  {"keys": ["Contract1", "Contract2"],
+                   "changes": {"client": "Second Client", "sales_contact": "othersalesman"}})
+        past = (timezone.now() - timedelta(days=1)).isoformat()
+        self.send("patch", "/api/event/bulk",
+                  {"keys": ["Event0", "Event1"], "changes": {"event_date": past}})
+        self.send("patch", "/api/event/bulk",
+                  {"keys": ["Event0"], "changes": {"contract": "Contract2"}})
+        self.assertEqual(self.get_totals(self.clients[0]), (1, 500, 0, 0))
+        self.assertEqual(self.get_totals(self.clients[1]), (2, 1500, 1, 2))
+
+        self.send("delete", "/api/event/bulk", {"keys": ["Event1"]})
+        self.send("delete", "/api/contract/bulk", {"keys": ["Contract0", "Contract2"]})
+        self.assertEqual(self.get_totals(self.clients[1]), (1, 500, 0, 0))
+
+
+class SweepEventStatusTests(APITestCase):
+    """The sweep_event_status command marks the events whose date has passed as done, and
+    updates the status and the rollups of their clients."""
+
+    @classmethod
+    def setUpTestData(cls):
+        salesman = create_user(SALESMAN, 2)
+        now = timezone.now()
+        for name, days in (("Passed", 10), ("Upcoming", 20)):
+            client = Client.objects.create(first_name=name, last_name="Client",
+                                           email=f"{name}@test.com", company_name=name,
+                                           sales_contact=salesman)
+            contract = Contract.objects.create(title=name, signed=True, amount=1000,
+                                               payment_due=0, client=client,
+                                               sales_contact=salesman)
+            Event.objects.create(title=name, attendees=10, notes="", contract=contract,
+                                 event_date=now + timedelta(days=days))
+        # the date of the event passes without the event being saved again.
+        Event.objects.filter(title="Passed").update(event_date=now - timedelta(days=1))
+
+    def sweep(self):
+        stdout = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("sweep_event_status", stdout=stdout)
+        return stdout.getvalue()
+
+    def get_client(self, name):
+        return Client.objects.select_related("rollup").get(first_name=name)
+
+    def test_sweep(self):
+        self.assertFalse(Event.objects.get(title="Passed").status)
+        upcoming_status = self.get_client("Upcoming").client_status
+        self.assertEqual(self.sweep().strip(), "1 event(s) marked as done, 1 client(s) updated.")
+        self.assertEqual(dict(Event.objects.values_list("title", "status")),
+                         {"Passed": True, "Upcoming": False})
+        passed, upcoming = self.get_client("Passed"), self.get_client("Upcoming")
+        self.assertEqual(passed.client_status, 3)
+        self.assertEqual(upcoming.client_status, upcoming_status)
+        self.assertEqual((passed.rollup.upcoming_event_count, passed.rollup.past_event_count),
+                         (0, 1))
+        self.assertEqual((upcoming.rollup.upcoming_event_count,
+                          upcoming.rollup.past_event_count), (1, 0))
+        self.assertFalse(get_stale_client_rollups().exists())
+
+        # a second run finds nothing left to do.
+        self.assertEqual(self.sweep().strip(), "0 event(s) marked as done, 0 client(s) updated.")
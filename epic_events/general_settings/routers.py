@@ -0,0 +1,190 @@
+"""Sends the read-only traffic of the list endpoints and of the admin changelists to the
+replica databases, and everything else to the primary one.
+
+ReplicaMiddleware decides, for each request, whether its reads may go to a replica: the
+request must be a GET or a HEAD handled by a view flagged with read_from_replica = True, or by
+an admin changelist. ReplicaRouter then picks one of the DATABASE_REPLICAS aliases at random
+for the reads made while handling the request. Writes always go to the primary.
+
+A replica lags behind the primary. So that users see their own changes, a request writing
+data pins its user to the primary for REPLICA_PIN_SECONDS, through an entry of the default
+cache keyed by the id of the user, which every worker process reads. The pin thus follows
+the user whatever the way they authenticate, e.g. with basic auth, which keeps no cookie. The
+user is only known once the request is authenticated, which the API views do after the
+middleware ran, so the router checks the pin on the first read following the authentication.
+The reads authenticating the user are made on a replica. The cached API responses are keyed
+by the kind of database they were read from, so that a pinned user never gets a response
+read from a lagging replica, see api/cache.py.
+
+Replicas are declared in DATABASES and listed in DATABASE_REPLICAS. In tests, a replica should
+be configured with {"TEST": {"MIRROR": "default"}} so that it reads the test database."""
+
+
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.urls import Resolver404, resolve
+from django.utils.functional import LazyObject, empty
+
+PRIMARY = "default"
+SAFE_METHODS = ("GET", "HEAD")
+# the sessions are read by every request right after being written by the login, so they
+# are always read from the primary.
+PRIMARY_ONLY_APPS = ("sessions",)
+
+# the request whose reads may go to a replica, if any.
+_replica_request = ContextVar("replica_request", default=None)
+
+
+def get_replicas():
+    return getattr(settings, "DATABASE_REPLICAS", [])
+
+
+def get_pin_key(user_id):
+    return f"replica:pin:{user_id}"
+
+
+def get_user_id(request):
+    """Returns the id of the user the request is authenticated as, or None while it's anonymous
+    or not authenticated yet. The user set lazily by AuthenticationMiddleware isn't loaded
+    here, loading it would read from the database through the router."""
+    user = request.__dict__.get("user")
+    if isinstance(user, LazyObject):
+        user = user._wrapped
+    if user is empty or user is None or not user.is_authenticated:
+        return None
+    return user.pk
+
+
+def is_pinned(request):
+    """Returns True if the user of the request wrote data less than REPLICA_PIN_SECONDS ago.
+    The pin is read once per request, as soon as the user is known."""
+    pinned = request.__dict__.get("_pinned_to_primary")
+    if pinned is None:
+        user_id = get_user_id(request)
+        if user_id is None:
+            return False
+        pinned = request._pinned_to_primary = cache.get(get_pin_key(user_id)) is not None
+    return pinned
+
+
+class ReplicaRouter:
+    """Routes the reads to a replica when ReplicaMiddleware allowed it for the current
+    request, and all the other operations to the primary."""
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replicas()
+        request = _replica_request.get()
+        if (replicas and request is not None
+                and model._meta.app_label not in PRIMARY_ONLY_APPS and not is_pinned(request)):
+            return random.choice(replicas)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # the replicas get the schema from the primary.
+        return db == PRIMARY
+
+
+def reads_from_replica(request):
+    """Returns True if the request only reads data: a GET or HEAD request handled by a view
+    flagged with read_from_replica or by an admin changelist."""
+    if request.method not in SAFE_METHODS:
+        return False
+    try:
+        view_func = resolve(request.path_info).func
+    except Resolver404:
+        return False
+    view_class = getattr(view_func, "view_class", None) or getattr(view_func, "cls", None)
+    if view_class is not None:
+        return getattr(view_class, "read_from_replica", False)
+    return (hasattr(view_func, "model_admin")
+            and getattr(view_func, "__name__", None) == "changelist_view")
+
+
+def iter_from_replica(content, request):
+    """Keeps reading from the replica while the content of a streamed response is produced,
+    which happens after the middleware returned."""
+    token = _replica_request.set(request)
+    try:
+        yield from content
+    finally:
+        _replica_request.reset(token)
+
+
+async def aiter_from_replica(content, request):
+    """Asynchronous version of iter_from_replica, for the streamed responses of the async
+    views. The ORM calls made through sync_to_async copy the context variable."""
+    token = _replica_request.set(request)
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        _replica_request.reset(token)
+
+
+def stream_from_replica(response, request):
+    """Wraps the content of a streamed response so that it's read from the replica, if the
+    request may read from one."""
+    if response.streaming and _replica_request.get() is not None:
+        if response.is_async:
+            response.streaming_content = aiter_from_replica(response.streaming_content, request)
+        else:
+            response.streaming_content = iter_from_replica(response.streaming_content, request)
+
+
+class ReplicaMiddleware:
+    """Allows the reads of the eligible requests to go to a replica and pins the users who
+    write data to the primary. The middleware runs in sync and async modes, the context
+    variable it sets is seen by the ORM calls of both."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # tells the handler that calling the middleware returns a coroutine, as
+            # MiddlewareMixin does.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        token = _replica_request.set(request if reads_from_replica(request) else None)
+        try:
+            response = self.get_response(request)
+            stream_from_replica(response, request)
+        finally:
+            _replica_request.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = _replica_request.set(request if reads_from_replica(request) else None)
+        try:
+            response = await self.get_response(request)
+            stream_from_replica(response, request)
+        finally:
+            _replica_request.reset(token)
+        return self.pin(request, response)
+
+    def pin(self, request, response):
+        """Pins the user of a request writing data. The API views set the user they
+        authenticated on the request, so it's known once the response is returned."""
+        if request.method not in SAFE_METHODS and get_replicas():
+            user_id = get_user_id(request)
+            if user_id is not None:
+                cache.set(get_pin_key(user_id), True,
+                          timeout=getattr(settings, "REPLICA_PIN_SECONDS", 5))
+        return response
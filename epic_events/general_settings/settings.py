@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so that the measures cover the other middlewares.
+    'epic_events.api.metrics.MetricsMiddleware',
+    'epic_events.api.inspection.QueryInspectionMiddleware',
+    'epic_events.general_settings.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -72,6 +77,18 @@ TEMPLATES = [
 WSGI_APPLICATION = 'epic_events.general_settings.wsgi.application'
 
 
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_PAGINATION_CLASS': 'epic_events.api.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Upper bound for the page_size query parameter of the read endpoints.
+API_MAX_PAGE_SIZE = 1000
+
+
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
@@ -86,6 +103,48 @@ DATABASES = {
     }
 }
 
+# Aliases of DATABASES that are read-only replicas of the default database. The list endpoints
+# and the admin changelists read from them, see general_settings/routers.py.
+DATABASE_REPLICAS = []
+
+DATABASE_ROUTERS = ['epic_events.general_settings.routers.ReplicaRouter']
+
+# Seconds during which a user who wrote data reads from the primary database only.
+REPLICA_PIN_SECONDS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+# The file-based backend is shared by all the worker processes of a host, which is needed
+# for the invalidation of the cached API responses to reach every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': Path(tempfile.gettempdir()) / 'epic_events_cache',
+    }
+}
+
+API_CACHE_ALIAS = 'default'
+
+# Seconds a cached API response is kept. Writes invalidate it before that.
+API_CACHE_TIMEOUT = 300
+
+# Seconds the reports of the analytics endpoint are cached. Short, as the reports count the
+# upcoming events, which become past events as time goes by.
+API_ANALYTICS_CACHE_TIMEOUT = 60
+
+# Records the latency, queries and response size of each request, exposed at /metrics. When
+# disabled, MetricsMiddleware is left out of the middleware chain.
+API_METRICS_ENABLED = True
+
+# Set to "log" or "raise", in tests and staging, to report the repeated queries of a request
+# (probable N+1) and the views exceeding their query_budget. See api/inspection.py.
+API_QUERY_INSPECTION = None
+
+# Number of queries of the same shape, in one request, reported as a probable N+1.
+API_QUERY_REPEAT_THRESHOLD = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
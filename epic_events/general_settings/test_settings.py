@@ -0,0 +1,24 @@
+"""Settings of the test suite, run with:
+
+    python manage.py test epic_events.api.tests epic_events.crm.tests \
+        epic_events.general_settings.tests --settings=epic_events.general_settings.test_settings
+
+The tests run on two local SQLite databases: the default one and a replica mirroring it, as
+described in general_settings/routers.py. The replica is only read from by the tests enabling
+DATABASE_REPLICAS."""
+
+
+from .settings import *  # noqa: F401, F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'db.sqlite3',
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'TEST': {'MIRROR': 'default'},
+    },
+}
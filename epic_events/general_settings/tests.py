@@ -0,0 +1,104 @@
+"""Tests of the routing of the reads to the replicas, see routers.py. They need the replica
+declared by test_settings.py and are skipped otherwise."""
+
+
+import base64
+import time
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITransactionTestCase
+
+from epic_events.crm.models import Client, CustomUser
+
+TEST_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@skipUnless("replica" in settings.DATABASES,
+            "run with --settings=epic_events.general_settings.test_settings")
+@override_settings(CACHES=TEST_CACHES, DATABASE_REPLICAS=["replica"], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(APITransactionTestCase):
+    """The replica mirrors the default database through another connection, which only sees
+    the committed rows. The tests thus commit their writes, as the requests do."""
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        salesman = CustomUser.objects.create_user(
+            username="salesman", password="password", email="salesman@example.com",
+            first_name="Sales", last_name="Man", user_type=2)
+        Client.objects.create(first_name="First", last_name="Client", email="c@example.com",
+                              company_name="Company", sales_contact=salesman)
+        credentials = base64.b64encode(b"salesman:password").decode()
+        self.authorization = f"Basic {credentials}"
+
+    def get(self, path):
+        return self.client.get(path, HTTP_ACCEPT="application/json",
+                               HTTP_AUTHORIZATION=self.authorization)
+
+    def capture(self, request):
+        """Returns the SQL of the queries run by request on the primary and on the replica."""
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            response = request()
+        self.assertLess(response.status_code, 400, response.content)
+        return ([query["sql"] for query in primary], [query["sql"] for query in replica])
+
+    def reads_client_table(self, queries):
+        return any('"crm_client"' in sql and sql.startswith("SELECT") for sql in queries)
+
+    def write(self):
+        return self.client.put("/api/client/First/Client/",
+                               {"company_name": "Renamed", "sales_contact": "salesman"},
+                               format="json", HTTP_AUTHORIZATION=self.authorization)
+
+    def get_cache_sources(self):
+        """Returns the kinds of database the cached list responses were read from."""
+        return {key.split(":")[6] for key in cache._cache if ":api:crm.client:" in key}
+
+    def test_list_reads_go_to_the_replica(self):
+        primary, replica = self.capture(lambda: self.get("/api/client/view"))
+        self.assertTrue(self.reads_client_table(replica))
+        self.assertFalse(self.reads_client_table(primary))
+        self.assertEqual(self.get_cache_sources(), {"replica"})
+
+    def test_writes_go_to_the_primary_and_pin_the_user(self):
+        primary, replica = self.capture(self.write)
+        self.assertTrue(any(sql.startswith("UPDATE") for sql in primary))
+        self.assertFalse(any(sql.startswith("UPDATE") for sql in replica))
+
+        # the user is pinned to the primary, and the response cached for them is keyed apart.
+        primary, replica = self.capture(lambda: self.get("/api/client/view"))
+        self.assertTrue(self.reads_client_table(primary))
+        self.assertFalse(self.reads_client_table(replica))
+        self.assertEqual(self.get_cache_sources(), {"primary"})
+
+        # once REPLICA_PIN_SECONDS have passed, the reads go back to the replica.
+        later = time.time() + settings.REPLICA_PIN_SECONDS + 1
+        with mock.patch("django.core.cache.backends.locmem.time.time", return_value=later):
+            primary, replica = self.capture(lambda: self.get("/api/client/view"))
+        self.assertTrue(self.reads_client_table(replica))
+        self.assertFalse(self.reads_client_table(primary))
+
+    def test_async_stream_reads_from_the_replica(self):
+        async def stream():
+            response = await self.async_client.get(
+                "/api/async/client/view?stream=jsonl",
+                headers={"authorization": self.authorization})
+            self.assertEqual(response.status_code, 200)
+            # the content is produced once the middleware returned.
+            return b"".join([chunk async for chunk in response.streaming_content])
+
+        # the ORM calls of the async view run in the thread of the test, through
+        # sync_to_async, on the connections captured here.
+        with CaptureQueriesContext(connections["default"]) as primary, \
+                CaptureQueriesContext(connections["replica"]) as replica:
+            content = async_to_sync(stream)()
+        self.assertIn(b'"Company"', content)
+        self.assertTrue(self.reads_client_table(query["sql"] for query in replica))
+        self.assertFalse(self.reads_client_table(query["sql"] for query in primary))
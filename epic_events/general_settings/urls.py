@@ -20,9 +20,11 @@ from django.urls import path, include
 
 
 from epic_events.api import urls as api_urls
+from epic_events.api.metrics import MetricsView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api_auth/', include('rest_framework.urls')),
-    path('api/', include(api_urls))
+    path('api/', include(api_urls)),
+    path('metrics', MetricsView.as_view()),
 ]